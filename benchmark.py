@@ -0,0 +1,962 @@
+#! /usr/bin/env python
+"""
+Benchmarks of the procedural generators against their reference
+implementations. Parity with the references is checked by the tests, run
+them with `python -m pytest`.
+
+Usage:
+    python benchmark.py             runs all benchmarks
+    python benchmark.py mesh ...    runs only the named benchmarks
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent import futures
+from functools import partial
+from math import pi
+
+import numpy as np
+import pyfastnoisesimd as fns
+from panda3d import core
+
+from game import collision
+from game import common
+from game import modelgen
+from game import world
+from game.shapegen import cache as modelcache
+from game.shapegen import draw
+from game.shapegen import mesh
+from game.shapegen import noise
+from game.shapegen import service
+from game.shapegen import shading
+from game.shapegen import shape
+from game.shapegen import simplify
+from game.shapegen import tessellate
+from game.shapegen import util
+from game.shapegen import vcache
+from tests.reference import BLOBS
+from tests.reference import CONES
+from tests.reference import RecordingMesh
+from tests.reference import SHAPES
+from tests.reference import SPHERES
+from tests.reference import blob
+from tests.reference import check_obelisks
+from tests.reference import devils_tower
+from tests.reference import generation_jobs
+from tests.reference import geom_arrays
+from tests.reference import geom_node_paths
+from tests.reference import num_geoms
+from tests.reference import reference_blob
+from tests.reference import reference_cone
+from tests.reference import reference_fir_tree
+from tests.reference import reference_noise_blob
+from tests.reference import reference_obelisks
+from tests.reference import reference_populate_triangles
+from tests.reference import reference_setup_fns
+from tests.reference import reference_sphere
+from tests.reference import reference_trees
+from tests.reference import reference_world_fields
+from tests.reference import scatter_trees
+from tests.reference import shape_jobs
+from tests.reference import unpack
+
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    """Return the best wall clock time in seconds of `repeat` runs."""
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(*args, **kwargs)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def timeit_fresh(setup, func, repeat=3):
+    """
+    Return the best wall clock time in seconds of `repeat` runs of
+    `func(setup())`, not counting the time spent in `setup`.
+    """
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        t = time.perf_counter()
+        func(arg)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def report(name, old, new):
+    print(f'  {name:<28} {old * 1000:9.2f}ms -> {new * 1000:9.2f}ms '
+          f'({old / new:6.2f}x)')
+
+
+def peak_memory(func, *args, **kwargs):
+    """Return the peak traced memory in bytes while running `func`."""
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+@benchmark
+def mesh_storage():
+    """Mesh vs ArrayMesh on ShapeGen.blob and ShapeGen.elliptic_cone."""
+    old, new = shape.ShapeGen(mesh.Mesh), shape.ShapeGen(mesh.ArrayMesh)
+    rec = shape.ShapeGen(RecordingMesh)
+    models = (
+        ('blob', blob, {'face_normals': False, 'nac': False}),
+        ('elliptic_cone', devils_tower,
+         {'face_normals': False, 'nac': False, 'tangent': True})
+    )
+    for name, func, export_args in models:
+        func(rec)
+        calls = RecordingMesh.last
+        report(
+            f'{name} build',
+            timeit(calls.replay, mesh.Mesh),
+            timeit(calls.replay, mesh.ArrayMesh)
+        )
+        report(
+            f'{name} build + export',
+            timeit(lambda: calls.replay(mesh.Mesh).export(**export_args)),
+            timeit(lambda: calls.replay(mesh.ArrayMesh).export(**export_args))
+        )
+        report(f'{name} total', timeit(func, old), timeit(func, new))
+        print(f'  {name + " build memory":<28} '
+              f'{peak_memory(calls.replay, mesh.Mesh) / 1024:9.1f}KiB -> '
+              f'{peak_memory(calls.replay, mesh.ArrayMesh) / 1024:9.1f}KiB')
+
+
+@benchmark
+def smooth_normals():
+    """Vectorized smooth normals vs Mesh._compute_smooth_normals."""
+    rec = shape.ShapeGen(RecordingMesh)
+    for name in ('blob', 'elliptic_cone'):
+        SHAPES[name](rec)
+        calls = RecordingMesh.last
+        msh = calls.replay(mesh.ArrayMesh)
+        pts, trs = msh.points, msh.triangles
+        report(
+            name,
+            timeit_fresh(
+                lambda: calls.replay(mesh.Mesh),
+                lambda m: m._compute_smooth_normals(80.0)
+            ),
+            timeit(
+                lambda: shading.smooth_normals(
+                    msh._vpt.data,
+                    trs,
+                    shading.face_normals(pts, trs)
+                )
+            )
+        )
+
+
+@benchmark
+def tangents():
+    """Vectorized tangent space vs Mesh._compute_tangents."""
+    rec = shape.ShapeGen(RecordingMesh)
+    devils_tower(rec)
+    calls = RecordingMesh.last
+
+    def legacy_setup():
+        msh = calls.replay(mesh.Mesh)
+        msh._compute_smooth_normals(80.0)
+        return msh
+
+    msh = calls.replay(mesh.ArrayMesh)
+    pts, trs = msh.points, msh.triangles
+    vts, trs, normals = shading.smooth_normals(
+        msh._vpt.data, trs, shading.face_normals(pts, trs)
+    )
+    pts, uvs = msh.points[vts], msh.texcoords[vts]
+    report(
+        'elliptic_cone',
+        timeit_fresh(legacy_setup, lambda m: m._compute_tangents()),
+        timeit(shading.tangent_space, pts, uvs, trs, normals)
+    )
+
+
+@benchmark
+def vertex_export():
+    """VertArray.add_row/add_triangle vs add_arrays/add_triangles."""
+    rng = np.random.default_rng(0)
+    for n in (10000, 100000):
+        cols = [rng.random((n, k), np.float32) for k in (3, 3, 4, 2)]
+        idx = rng.integers(0, n, (n * 2, 3))
+
+        def rows():
+            va = util.VertArray('rows', tangents=False)
+            for row in zip(*[map(tuple, c.tolist()) for c in cols]):
+                va.add_row(*row)
+            for t in idx.tolist():
+                va.add_triangle(*t)
+            return va.node
+
+        def bulk():
+            va = util.VertArray('bulk', tangents=False)
+            va.add_arrays(*cols)
+            va.add_triangles(idx)
+            return va.node
+
+        report(f'{n} vertices', timeit(rows), timeit(bulk))
+
+
+@benchmark
+def welding():
+    """ArrayMesh vertex welding stats and bulk vs per vertex insertion."""
+    rec = shape.ShapeGen(RecordingMesh)
+    welded = shape.ShapeGen(RecordingMesh, weld_eps=1e-4)
+    for name in SHAPES:
+        SHAPES[name](rec)
+        before = RecordingMesh.last.weld_stats
+        SHAPES[name](welded)
+        after = RecordingMesh.last.weld_stats
+        print(f'  {name:<28} points {before.points:6} -> {after.points:6}  '
+              f'vertices {before.vertices:6} -> {after.vertices:6}')
+    devils_tower(rec)
+    src = RecordingMesh.last.replay(mesh.ArrayMesh)
+    corners = src.triangles.ravel()
+    pts, colors = src.points[corners], src.colors[corners]
+    uvs = src.texcoords[corners]
+
+    def per_vertex(weld_eps):
+        msh = mesh.ArrayMesh(weld_eps=weld_eps)
+        for row in zip(pts.tolist(), colors.tolist(), uvs.tolist()):
+            msh.add_vertex(*row)
+
+    def bulk(weld_eps):
+        msh = mesh.ArrayMesh(weld_eps=weld_eps)
+        msh.add_vertices(pts, colors, uvs)
+        return msh
+
+    for weld_eps in (None, 1e-4):
+        report(
+            f'insert eps={weld_eps}',
+            timeit(per_vertex, weld_eps),
+            timeit(bulk, weld_eps)
+        )
+
+
+@benchmark
+def lod():
+    """Triangle counts per LOD level and simplification time."""
+    rec = shape.ShapeGen(RecordingMesh)
+    print(f'  switch distances {simplify.switch_distances(3)}')
+    for name in ('sphere', 'cone', 'box_round', 'blob', 'elliptic_cone'):
+        SHAPES[name](rec)
+        msh = RecordingMesh.last.replay(mesh.ArrayMesh)
+        t = time.perf_counter()
+        _, counts = simplify.lod_node(msh, 3, face_normals=False, nac=False)
+        t = time.perf_counter() - t
+        print(f'  {name:<28} {" -> ".join(map(str, counts)):>22} '
+              f'triangles in {t * 1000:7.2f}ms')
+
+
+@benchmark
+def vertex_cache():
+    """ACMR before/after ArrayMesh.export(optimize=True)."""
+    rec = shape.ShapeGen(RecordingMesh)
+    for name in ('elliptic_cone', 'blob', 'cone', 'sphere', 'box_round'):
+        SHAPES[name](rec)
+        msh = RecordingMesh.last.replay(mesh.ArrayMesh)
+        before = geom_arrays(msh.export(face_normals=False, nac=False))
+        t = time.perf_counter()
+        node = msh.export(face_normals=False, nac=False, optimize=True)
+        t = time.perf_counter() - t
+        after = geom_arrays(node)
+        print(f'  {name:<28} ACMR {vcache.acmr(before["index"]):5.3f} -> '
+              f'{vcache.acmr(after["index"]):5.3f}  (export {t * 1000:.1f}ms)')
+
+
+@benchmark
+def composition():
+    """Mesh.extend vs ArrayMesh.extend/append to compose parts."""
+    rec = shape.ShapeGen(RecordingMesh)
+    calls = []
+    for name in SHAPES:
+        SHAPES[name](rec)
+        calls.append(RecordingMesh.last)
+    old = [c.replay(mesh.Mesh) for c in calls]
+    new = [c.replay(mesh.ArrayMesh) for c in calls]
+    for i, part in enumerate(new):
+        part.transform(core.Mat4.translate_mat(i * 10, 0, 0))
+
+    def legacy(parts):
+        msh = mesh.Mesh()
+        for part in parts:
+            msh.extend(part)
+        return msh
+
+    for copies in (1, 4, 16):
+        report(
+            f'{copies:2} copies, welded',
+            timeit(legacy, old * copies),
+            timeit(mesh.concatenate, new * copies, weld=True)
+        )
+        report(
+            f'{copies:2} copies, appended',
+            timeit(legacy, old * copies),
+            timeit(mesh.concatenate, new * copies)
+        )
+
+
+@benchmark
+def sphere():
+    """Vectorized ShapeGen.sphere vs the Draw rig reference."""
+    sg = shape.ShapeGen()
+    origin, direction = core.Vec3(1, 2, 3), core.Vec3(0, 1, 0.3)
+    # the spheres the game builds: character eyes and nonogram cells
+    for name, args in (
+            ('eye', (core.Vec3(0), core.Vec3.up(), 0.07, 12)),
+            ('nonogram cell', (core.Vec3(0), core.Vec3.up(),
+                               common.NG_RADIUS, common.NG_POLY))
+    ):
+        report(
+            f'{name} polygon={args[-1]} node',
+            timeit(reference_sphere, sg, *args, nac=False, repeat=100),
+            timeit(sg.sphere, *args, nac=False, repeat=100)
+        )
+    # ArrayMesh spheres are transformed copies of a cached unit sphere
+    build = shape.ShapeGen()
+    build._export = lambda msh, **export_args: msh
+    shape._sphere_template.cache_clear()
+    args = (origin, direction, 2, 12)
+    t = time.perf_counter()
+    build.sphere(*args, nac=False)
+    print(f'  {"first polygon=12 (template)":<28} '
+          f'{(time.perf_counter() - t) * 1000:9.2f}ms')
+    for polygon in (3, 4, 8, 12, 20, 32, 64, 128):
+        for name in ('complete', 'slice'):
+            args = (origin, direction, 2, polygon)
+            kwargs = dict(SPHERES[name], nac=False)
+            report(
+                f'{name} polygon={polygon} mesh',
+                timeit(reference_sphere, build, *args, repeat=20, **kwargs),
+                timeit(build.sphere, *args, repeat=20, **kwargs)
+            )
+            report(
+                f'{name} polygon={polygon} node',
+                timeit(reference_sphere, sg, *args, repeat=20, **kwargs),
+                timeit(sg.sphere, *args, repeat=20, **kwargs)
+            )
+
+
+@benchmark
+def cone():
+    """Vectorized ShapeGen.cone vs the Draw rig reference."""
+    sg = shape.ShapeGen()
+    build = shape.ShapeGen()
+    build._export = lambda msh, **export_args: msh
+    origin, direction = core.Vec3(1, 2, 3), core.Vec3(1, 1, 0)
+    for name in ('trunk', 'capsule', 'ring'):
+        radius, polygon, length, kwargs = CONES[name]
+        args = (origin, direction, radius, polygon, length)
+        kwargs = dict(kwargs, nac=False)
+        report(
+            f'{name} mesh',
+            timeit(reference_cone, build, *args, **kwargs),
+            timeit(build.cone, *args, **kwargs)
+        )
+        report(
+            f'{name} node',
+            timeit(reference_cone, sg, *args, **kwargs),
+            timeit(sg.cone, *args, **kwargs)
+        )
+
+
+@benchmark
+def blobs():
+    """Vectorized ShapeGen.blob vs the Draw rig reference."""
+    sg = shape.ShapeGen()
+    build = shape.ShapeGen()
+    build._export = lambda msh, **export_args: msh
+    origin, direction = core.Vec3(1, 2, 3), core.Vec3(1, 1, 0)
+    for name in ('stone', 'canopy'):
+        bounds, kwargs = BLOBS[name]
+        args = (origin, direction, bounds)
+        kwargs = dict(kwargs, nac=False, seed=1234)
+        report(
+            f'{name} mesh',
+            timeit(reference_blob, build, *args, **kwargs),
+            timeit(build.blob, *args, **kwargs)
+        )
+        report(
+            f'{name} node',
+            timeit(reference_blob, sg, *args, **kwargs),
+            timeit(sg.blob, *args, **kwargs)
+        )
+
+
+@benchmark
+def draw_rig():
+    """Draw NodePath rig vs ArrayDraw on sphere like sample grids."""
+    rng = np.random.default_rng(0)
+    old, new = draw.Draw(), draw.ArrayDraw()
+    for n in (100, 10000):
+        h = rng.uniform(-180, 180, n)
+        p = rng.uniform(-90, 90, n)
+        r = rng.uniform(0.1, 5, n)
+        z = rng.uniform(-3, 3, n)
+        origin, direction = core.Vec3(1, 2, 3), core.Vec3(-0.3, 0.2, 1)
+        offset = core.Vec3(10, 20, 30)
+
+        def rig(d):
+            d.setup(origin, direction)
+            d.set_orientation_offset(core.Vec3(0.5, 0.2, 0), offset)
+
+        def legacy():
+            rig(old)
+            pts, centers = [], []
+            for row in zip(h.tolist(), p.tolist(), r.tolist(), z.tolist()):
+                old.set_dir_offset(row[3])
+                old.set_hp_r(*row[:3])
+                pts.append(old.point)
+                centers.append(old.center_point)
+            return np.array(pts), np.array(centers)
+
+        def vectorized():
+            rig(new)
+            return new.points(h, p, r, z), new.center_points(h, p, r, z)
+
+        report(f'{n} samples', timeit(legacy), timeit(vectorized))
+
+
+@benchmark
+def ring_strip():
+    """ring_strip_indices vs per pair triangle_line_connect tuples."""
+    # sphere like surface, the pole rings collapse into single points
+    rings, polygon = 32, 64
+    p = np.linspace(-pi / 2, pi / 2, rings)[:, None]
+    h = np.linspace(0, 2 * pi, polygon, endpoint=False)[None, :]
+    pts = np.stack(np.broadcast_arrays(
+        np.cos(p) * np.cos(h), np.cos(p) * np.sin(h), np.sin(p)
+    ), axis=-1).reshape(-1, 3)
+    msh = mesh.ArrayMesh()
+    vids = msh.add_vertices(pts)
+    lines = [line.tolist() for line in vids.reshape(rings, polygon)]
+
+    def legacy():
+        m = msh.copy()
+        reference_populate_triangles(m, lines, True, chk_illegal=True)
+        return m.triangles
+
+    def analytic():
+        m = msh.copy()
+        shape.ShapeGen._populate_triangles(m, lines, True, chk_illegal=True)
+        return m.triangles
+
+    def analytic_cold():
+        util.line_pair_indices.cache_clear()
+        util._ring_strip_indices.cache_clear()
+        return analytic()
+
+    culled = rings * polygon * 2 - len(analytic())
+    print(f'  {"degenerate culling":<28} {culled} pole triangles culled')
+    report('32 rings, cold cache', timeit(legacy), timeit(analytic_cold))
+    report('32 rings, warm cache', timeit(legacy), timeit(analytic))
+
+
+def collision_handler(num_shapes):
+    """Return a CollisionHandler populated like World does."""
+    rng = random.Random(0)
+    half = common.T_XY * common.T_XY_SCALE / 2
+    handler = collision.CollisionHandler(core.Vec2(0), core.Vec2(half))
+    for i in range(num_shapes):
+        p = core.Vec2(rng.uniform(-half, half), rng.uniform(-half, half))
+        if i % 2:
+            handler.add(collision.CollisionCircle(p, rng.uniform(1, 5)))
+        else:
+            handler.add(collision.CollisionEllipse(
+                p, rng.uniform(1, 5), rng.uniform(1, 5), rng.uniform(0, 360)
+            ))
+    return handler
+
+
+@benchmark
+def object_memory():
+    """Peak traced memory of the object based Mesh and collision structures."""
+    rec = shape.ShapeGen(RecordingMesh)
+    for name in ('blob', 'elliptic_cone'):
+        SHAPES[name](rec)
+        calls = RecordingMesh.last
+
+        def build():
+            msh = calls.replay(mesh.Mesh)
+            msh._compute_smooth_normals(80.0)
+            return msh
+
+        print(f'  {name + " Mesh":<28} {peak_memory(build) / 1024:9.1f}KiB')
+    for n in (1000, 10000):
+        print(f'  {f"{n} collision shapes":<28} '
+              f'{peak_memory(collision_handler, n) / 1024:9.1f}KiB')
+
+
+@benchmark
+def world_memory():
+    """Peak traced memory and max RSS of World.__init__ (needs a display)."""
+    from game import world
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    try:
+        world.World(collision_handler(0), service.GenerationService())
+    except Exception as err:
+        print(f'  skipped, World could not be built: {err!r}')
+        return
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f'  {"traced peak":<28} {peak / 1024:9.1f}KiB')
+    print(f'  {"max RSS increase":<28} '
+          f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss:9}KiB')
+
+
+@benchmark
+def batch():
+    """ShapeGen.batch vs one GeomNode per primitive for composite models."""
+    old_sg, modelgen.sg = modelgen.sg, shape.ShapeGen()
+    tex = core.Texture('bark')
+    try:
+        print(f'  {"fir_tree Geoms":<28} '
+              f'{num_geoms(reference_fir_tree(tex=tex)[0])} -> '
+              f'{num_geoms(modelgen.fir_tree(tex=tex)[0])}')
+        report(
+            'fir_tree',
+            timeit(reference_fir_tree, tex=tex),
+            timeit(modelgen.fir_tree, tex=tex)
+        )
+        print(f'  {"leaf_tree Geoms":<28} {num_geoms(modelgen.leaf_tree()[0])}')
+        print(f'  {"obelisk Geoms":<28} {num_geoms(modelgen.obelisk())}')
+    finally:
+        modelgen.sg = old_sg
+
+    # LOD: one merged GeomNode per level
+    sg = shape.ShapeGen(lod_levels=3, optimize=True)
+    sg.batch([
+        shape.Primitive(
+            'cone',
+            transform=core.Mat4.translate_mat(i * 3, 0, 0),
+            origin=core.Vec3(0),
+            direction=core.Vec3.up(),
+            radius=(1, 0.5),
+            polygon=16,
+            length=5,
+            nac=False
+        ) for i in range(8)
+    ] + [shape.Primitive(
+        'sphere',
+        origin=core.Vec3(0, 5, 0),
+        direction=core.Vec3.up(),
+        radius=2,
+        polygon=24,
+        nac=False
+    )])
+    print(f'  {"LOD triangles":<28} {" -> ".join(map(str, sg.lod_triangles))}')
+
+
+def world_models(sg):
+    """
+    Return a NodePath with the procedural models World builds: the tower, the
+    unique trees, the stones around the tower and the stone circles.
+    """
+    old_sg, modelgen.sg = modelgen.sg, sg
+    random_state = modelgen.random.getstate()
+    modelgen.random.seed(0)
+    try:
+        root = core.NodePath('world_models')
+        root.attach_new_node(devils_tower(sg))
+        for i in range(10):
+            tree = (modelgen.fir_tree, modelgen.leaf_tree)[i % 2]()
+            tree[0].reparent_to(root)
+        for _ in range(40):
+            modelgen.stone(core.Vec2(20, 30)).reparent_to(root)
+        for _ in range(4):
+            circle = modelgen.stone_circle(20, 30)
+            modelgen.obelisk().reparent_to(circle)
+            circle.reparent_to(root)
+        return root
+    finally:
+        modelgen.sg = old_sg
+        modelgen.random.setstate(random_state)
+
+
+def vertex_bytes(root):
+    """
+    Return a 2-tuple (vertex bytes, index bytes) of all vertex and index
+    arrays below `root`, i.e. what gets uploaded to the GPU.
+    """
+    vertex, index = 0, 0
+    for node_path in root.find_all_matches('**/+GeomNode'):
+        node = node_path.node()
+        for i in range(node.get_num_geoms()):
+            geom = node.get_geom(i)
+            vdata = geom.get_vertex_data()
+            for j in range(vdata.get_num_arrays()):
+                vertex += vdata.get_array(j).get_data_size_bytes()
+            for j in range(geom.get_num_primitives()):
+                prim = geom.get_primitive(j)
+                if prim.get_vertices() is not None:
+                    index += prim.get_vertices().get_data_size_bytes()
+    return vertex, index
+
+
+@benchmark
+def model_cache():
+    """Cached vs freshly generated models (ModelCache, .bam and .npz)."""
+    with tempfile.TemporaryDirectory() as directory:
+        models = modelcache.ModelCache(directory, 2 ** 30)
+
+        def miss():
+            models.clear()
+            return models.node('stone_circle', modelgen.stone_circle, 20, 30,
+                               seed=11)
+
+        def hit():
+            return models.node('stone_circle', modelgen.stone_circle, 20, 30,
+                               seed=11)
+
+        report('stone_circle', timeit(miss), timeit(hit))
+
+        # ArrayMesh entries are memory mapped
+        build = shape.ShapeGen()
+        build._export = lambda msh, **export_args: msh
+        args = (core.Vec3(0), core.Vec3.up(), (1.2, 0), 12, 50)
+        models.mesh('trunk', build.cone, *args, nac=False)
+        report(
+            'trunk mesh',
+            timeit(build.cone, *args, nac=False),
+            timeit(models.mesh, 'trunk', build.cone, *args, nac=False)
+        )
+
+
+@benchmark
+def generation_service():
+    """GenerationService at 1/2/4/8 workers vs serial, spawning included."""
+    jobs = generation_jobs()
+    t = time.perf_counter()
+    for f, args, seed in jobs:
+        modelcache.seeded(seed, f, *args)
+    serial_t = time.perf_counter() - t
+    print(f'  {len(jobs)} models, {os.cpu_count()} cpus')
+    for num_workers in (1, 2, 4, 8):
+        t = time.perf_counter()
+        with service.GenerationService(num_workers, 0) as gen_service:
+            submitted = [
+                gen_service.submit(f, *args, seed=seed)
+                for f, args, seed in jobs
+            ]
+            while not all(job.done() for job in submitted):
+                time.sleep(0.001)
+            assemble_t = time.perf_counter()
+            for job in submitted:
+                job.result()
+            assemble_t = time.perf_counter() - assemble_t
+        t = time.perf_counter() - t
+        report(f'{num_workers} worker(s), wall time', serial_t, t)
+        report(f'{num_workers} worker(s), main thread', serial_t, assemble_t)
+
+
+def num_triangles(root):
+    """Return the number of triangles of all Geoms below `root`."""
+    count = 0
+    for node_path in geom_node_paths(root):
+        node = node_path.node()
+        for i in range(node.get_num_geoms()):
+            geom = node.get_geom(i)
+            count += sum(geom.get_primitive(j).get_num_primitives()
+                         for j in range(geom.get_num_primitives()))
+    return count
+
+
+@benchmark
+def tessellation():
+    """Fixed tessellation of the modelgen models vs 1px tolerances."""
+    cases = (
+        ('fir_tree', modelgen.fir_tree, ()),
+        ('leaf_tree', modelgen.leaf_tree, ()),
+        ('devils_tower', modelgen.devils_tower, ()),
+        ('stone_circle', modelgen.stone_circle, (20, 30)),
+    )
+    distances = (None, common.TESS_DISTANCE, 100, 400, 1600)
+    sg = shape.ShapeGen(optimize=True, packed=common.PACKED_VERTICES)
+    old_sg, modelgen.sg = modelgen.sg, sg
+    try:
+        # the game builds its models at TESS_DISTANCE
+        print(f'  {"triangles (build ms)":<28}' + ''.join(
+            f'{"fixed" if d is None else f"{d}m":>16}' for d in distances
+        ))
+        for name, func, args in cases:
+            row = []
+            for distance in distances:
+                tolerance = None if distance is None \
+                    else tessellate.pixel_tolerance(distance)
+                t = time.perf_counter()
+                with sg.tessellation(tolerance):
+                    result = modelcache.seeded(1, func, *args)
+                t = time.perf_counter() - t
+                result = unpack(result)
+                row.append(f'{num_triangles(result):>8} '
+                           f'({t * 1000:5.0f})')
+            print(f'  {name:<28}' + ''.join(f'{c:>16}' for c in row))
+    finally:
+        modelgen.sg = old_sg
+    print(f'  {"1px tolerance at 100/1600m":<28} '
+          f'{tessellate.pixel_tolerance(100):.3f} / '
+          f'{tessellate.pixel_tolerance(1600):.3f}')
+
+
+@benchmark
+def threaded_loader():
+    """Shared ShapeGen on worker threads and the ThreadedLoader frame stalls."""
+    from direct.task.TaskManagerGlobal import taskMgr
+
+    sg = shape.ShapeGen(lod_levels=common.LOD_LEVELS, optimize=True,
+                        packed=common.PACKED_VERTICES)
+    jobs = shape_jobs(sg)
+    t = time.perf_counter()
+    for job in jobs:
+        job()
+    serial_t = time.perf_counter() - t
+    t = time.perf_counter()
+    with futures.ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda job: job(), jobs))
+    report(f'{len(jobs)} shapes on 4 threads', serial_t,
+           time.perf_counter() - t)
+
+    seeds = list(range(12))
+    t = time.perf_counter()
+    for seed in seeds:
+        modelcache.seeded(seed, modelgen.random_stone, 3, 6)
+    blocking = time.perf_counter() - t
+
+    # like World: seeded stones are generated (or read from the cache) on
+    # the loader threads, from a local RNG, while the main thread keeps
+    # drawing from the global one
+    with tempfile.TemporaryDirectory() as directory:
+        models = modelcache.ModelCache(directory, 2 ** 30)
+        for seed in seeds[::2]:
+            models.node('stone', modelgen.random_stone, 3, 6, seed=seed)
+
+        def deliver(seed, stone):
+            delivered[seed] = stone
+
+        delivered = {}
+        loader = service.ThreadedLoader(taskMgr)
+        for seed in seeds:
+            loader.load(models.node, 'stone', modelgen.random_stone, 3, 6,
+                        seed=seed, callback=partial(deliver, seed))
+        frames = []
+        t = time.perf_counter()
+        while loader.pending:
+            frame = time.perf_counter()
+            taskMgr.step()
+            time.sleep(1 / 120)     # stands in for rendering
+            frames.append(time.perf_counter() - frame)
+        total = time.perf_counter() - t
+        loader.shutdown()
+    print(f'  {len(seeds)} stones blocking the main thread for '
+          f'{blocking * 1000:.0f}ms vs streamed in {total * 1000:.0f}ms over '
+          f'{len(frames)} frames (half cached)')
+    print(f'  {"frame time median / max":<28} '
+          f'{np.median(frames) * 1000:9.2f}ms / {max(frames) * 1000:.2f}ms')
+
+
+@benchmark
+def noise_pool():
+    """Pooled fns.Noise generators vs a new generator per setup_fns call."""
+    gen = noise.Noise()
+    pooled = noise.Noise.setup_fns
+
+    def stone_blobs():
+        # the noise ShapeGen.blob requests for the stones around the tower
+        np.random.seed(3)
+        return [gen.blob(40, 21, 4, 200, None, 0.001) for _ in range(40)]
+
+    def run(setup_fns, func):
+        noise.Noise.setup_fns = setup_fns
+        try:
+            return func()
+        finally:
+            noise.Noise.setup_fns = pooled
+
+    print(f'  {noise.noise_pool.num_workers} noise workers')
+
+    kwargs = dict(noise_type=fns.NoiseType.SimplexFractal, frequency=0.001)
+    report(
+        'setup_fns per call',
+        timeit(run, reference_setup_fns, lambda: gen.setup_fns(**kwargs),
+               repeat=200),
+        timeit(gen.setup_fns, repeat=200, **kwargs)
+    )
+    report(
+        '40 stone blobs',
+        timeit(run, reference_setup_fns, stone_blobs),
+        timeit(stone_blobs)
+    )
+    print(f'  {"pool hits / misses":<28} {noise.noise_pool.hits} / '
+          f'{noise.noise_pool.misses}')
+
+
+@benchmark
+def noise_blob():
+    """Broadcast Noise.blob coordinates vs the nested per ring loops."""
+    gen = noise.Noise()
+    for xy, z, dim, r in ((40, 21, 4, 200), (96, 49, 4, 12)):
+        report(
+            f'{xy}x{z}x{dim}',
+            timeit(lambda: np.asarray(
+                reference_noise_blob(gen, xy, z, dim, r, 11, 0.001),
+                np.float64
+            ), repeat=50),
+            timeit(lambda: np.asarray(gen.blob(xy, z, dim, r, 11, 0.001),
+                                      np.float64), repeat=50)
+        )
+
+
+@benchmark
+def world_fields():
+    """Memory mapped .npy world fields vs generating them at every start."""
+    seed = 3
+    with tempfile.TemporaryDirectory() as directory:
+        fields = modelcache.FieldCache(directory, 2, salt='benchmark')
+
+        def load():
+            return fields.arrays('world_fields', world._generate_fields,
+                                 seed, seed=seed)
+
+        load()
+        print(f'  {sum(a.nbytes for a in load().values()) / 2 ** 20:.1f} MiB per seed')
+
+        def touched():
+            # what setup_terrain and place_trees read on startup
+            arrays = load()
+            return (arrays['heightfield'] * 255).astype(np.uint8), \
+                arrays['woods'].sum(), arrays['bounds'][:1024, :1024].sum()
+
+        report('cold vs warm start',
+               timeit(modelcache.seeded, seed, reference_world_fields, seed),
+               timeit(load, repeat=10))
+        report('incl. reading all pages',
+               timeit(modelcache.seeded, seed, reference_world_fields, seed),
+               timeit(touched, repeat=10))
+
+
+@benchmark
+def obelisk_placement():
+    """Rejection sampling vs Scatter for obelisks, random walk for trees."""
+    # capture the woods filter Noise.woods places obelisks in
+    fields = []
+    place_obelisks = noise._place_obelisks
+    noise._place_obelisks = lambda f: fields.append(f.copy()) \
+        or place_obelisks(f)
+    try:
+        placed = [
+            modelcache.seeded(seed, noise.Noise(seed).woods)
+            for seed in range(8)
+        ]
+    finally:
+        noise._place_obelisks = place_obelisks
+    # typical woods: a seed with dense patches for all obelisks
+    woods = next(f for f, (_, _, s) in zip(fields, placed)
+                 if not check_obelisks(f, [(825, 825)] + s))
+    # sparse woods: only a few patches are dense enough
+    sparse = np.zeros_like(woods)
+    for x, y in ((200, 200), (200, 800), (800, 200), (620, 380)):
+        sparse[y - 15:y + 15, x - 15:x + 15] = 1
+    # no dense patch at all: rejection sampling never ends
+    for name, fltr in (('woods', woods), ('sparse woods', sparse),
+                       ('no dense woods', np.zeros_like(woods))):
+        np.random.seed(1)
+        runs = [reference_obelisks(fltr) for _ in range(10)]
+        stuck = sum(len(sites) < 4 for sites, _ in runs)
+        tries = np.mean([t for sites, t in runs if len(sites) == 4] or [0])
+        print(f'  {name:<28} {tries:9.1f} tries by rejection sampling, '
+              f'{stuck}/{len(runs)} runs stuck after 20000')
+        report(name,
+               timeit(lambda: reference_obelisks(fltr)),
+               timeit(noise._place_obelisks, fltr))
+
+    woods = placed[0][0] > 0
+    walk, sites = reference_trees(woods), scatter_trees(woods)
+    print(f'  {"trees":<28} {len(walk)} by random walk, {len(sites)} by '
+          f'Scatter')
+    report('trees', timeit(reference_trees, woods),
+           timeit(scatter_trees, woods))
+
+
+@benchmark
+def vertex_formats():
+    """float32 vs packed vertex format on the procedural World models."""
+    sizes = {}
+    for packed in (False, True):
+        sg = shape.ShapeGen(
+            lod_levels=common.LOD_LEVELS,
+            optimize=True,
+            packed=packed
+        )
+        t = time.perf_counter()
+        root = world_models(sg)
+        t = time.perf_counter() - t
+        sizes[packed] = vertex_bytes(root)
+        vertex, index = sizes[packed]
+        print(f'  {"packed" if packed else "float32":<28} vertices '
+              f'{vertex / 1024:9.1f}KiB  indices {index / 1024:8.1f}KiB  '
+              f'(built in {t * 1000:.0f}ms)')
+    print(f'  {"vertex memory ratio":<28} '
+          f'{sizes[True][0] / sizes[False][0]:9.2f}')
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f'unknown benchmark "{name}", choose from: '
+                  f'{", ".join(BENCHMARKS)}')
+            return 1
+        print(f'{name}: {BENCHMARKS[name].__doc__.strip()}')
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
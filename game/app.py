@@ -36,6 +36,7 @@ from direct.interval.LerpInterval import *
 from direct.interval.IntervalGlobal import *
 from panda3d import core
 
+from .shapegen import service
 from .shapegen import shape
 from . import character
 from . import common
@@ -70,8 +71,12 @@ class GameApp(world.World, nonogram.NonogramSolver, puzzle.Puzzle):
             core.Vec2(common.T_XY * common.T_XY_SCALE / 2)
         )
 
+        # model generation, kept for the lifetime of the app
+        self.gen_service = service.GenerationService()
+
         # init parent classes
-        world.World.__init__(self, self.__collision)
+        world.World.__init__(self, self.__collision, self.gen_service)
+        self.finalExitCallbacks.append(self.gen_service.shutdown)
         nonogram.NonogramSolver.__init__(self)
         symbols = [s[0] for s in self.symbols]
         puzzle.Puzzle.__init__(
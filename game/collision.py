@@ -152,14 +152,12 @@ class CollisionHandler(object):
 
 
 class CollisionShape(object):
+    __slots__ = ('point', 'aabb', 'callback', 'ghost')
     shape = NOP
-    point = core.Vec2(0)
-    aabb = None
-    callback = None
-    ghost = None
 
 
 class CollisionCircle(CollisionShape):
+    __slots__ = ('r', )
     shape = CIRCLE
 
     def __init__(self, p, r, callback=None, ghost=False):
@@ -173,6 +171,17 @@ class CollisionCircle(CollisionShape):
 
 
 class CollisionEllipse(CollisionShape):
+    __slots__ = (
+        'a',
+        'b',
+        'h_offset',
+        'a_sq',
+        'b_sq',
+        'sin',
+        'cos',
+        'inv_sin',
+        'inv_cos'
+    )
     shape = ELLIPSE
 
     def __init__(self, p, a, b, h_offset=0, callback=None, ghost=False):
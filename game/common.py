@@ -70,6 +70,55 @@ TXT_WON = [
 FOG_COLOR = (0.3, 0.3, 0.3)
 FOG_EXP_DENSITY = 0.008
 
+# level of detail, opt-in: simplification costs more than building the full
+# detail models (see benchmark.py lod), 1 -> no LOD
+LOD_LEVELS = 1
+LOD_RATIO = 0.4
+
+# compact vertex format (see shapegen.util.packed_format), off until the
+# normalization of its snorm16 normals is verified in the renderer
+PACKED_VERTICES = False
+
+# tolerance driven tessellation (see shapegen.tessellate), models are built
+# with the 1px error at the follow camera distance (Y_OFFSET), the closest
+# props are usually seen from
+TESS_DISTANCE = 20
+TESS_PIXELS = 1.0           # tolerated screen space error at TESS_DISTANCE
+TESS_FOV = 60               # vertical fov and resolution the error is
+TESS_SCREEN_HEIGHT = 764    # measured with, see app.py and settings.prc
+TESS_MAX_POLYGON = 128      # cap if no polygon count is given
+
+# persistent model cache (see shapegen.cache)
+MODEL_CACHE = True
+MODEL_CACHE_DIR = '$MAIN_DIR/cache/models'
+MODEL_CACHE_MAX_BYTES = 128 * 2 ** 20
+# randomized models (trees, stones, stone circles) are seeded per world (see
+# modelgen.variant) and only cached for recurring worlds (see WORLD_SEED),
+# one world takes ~4MB in the cache
+
+# persistent terrain/woods fields per world seed (see shapegen.cache)
+FIELD_CACHE = True
+FIELD_CACHE_DIR = '$MAIN_DIR/cache/fields'
+FIELD_CACHE_ENTRIES = 16
+# None -> a new random world every start. Its fields and randomized models
+# are not cached, they would never be read again. Warm starts need worlds
+# that come up again: a fixed seed, or WORLD_VARIANTS.
+WORLD_SEED = None
+# opt-in: draw random seeds from only this many worlds, which are cached
+# (None -> unlimited one-off worlds)
+WORLD_VARIANTS = None
+
+# pooled noise generators (see shapegen.noise.NoisePool)
+NOISE_WORKERS = None    # pyfastnoisesimd threads, None -> os.cpu_count()
+NOISE_POOL_SIZE = 16    # generators per thread
+
+# model generation processes (see shapegen.service), None -> os.cpu_count()
+GEN_WORKERS = None
+# fewer jobs are generated inline, spawning the workers would take longer
+GEN_MIN_JOBS = 8
+LOADER_THREADS = 2
+LOADER_PER_FRAME = 4    # models handed to the scene graph per frame
+
 # three rings
 TR_COLORS = [
     core.Vec4(core.Vec3(0.06, 0.1, 0.07), 1),
@@ -152,6 +201,8 @@ W_CELL_TYPE_COUNT = 14
 W_BOUND_CLIP = 0.6
 W_WOOD_CELL_COUNT = 2
 W_INDIVIDUAL_TREES = 10
+# minimum distance between trees in cells
+W_TREE_SPACING = 16
 
 # devils tower constants
 DT_TEX_SHAPE = 512, 2048
@@ -26,18 +26,83 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import hashlib
 import random
 from math import ceil
 from math import pi
+from typing import Any
+from typing import Callable
 
 import numpy as np
 from panda3d import core
 
+from .shapegen import cache
+from .shapegen import service
 from .shapegen import shape
+from .shapegen import tessellate
 from . import common
 
 
-sg = shape.ShapeGen()
+sg = shape.ShapeGen(
+    lod_levels=common.LOD_LEVELS,
+    optimize=True,
+    packed=common.PACKED_VERTICES,
+    tolerance=tessellate.pixel_tolerance(common.TESS_DISTANCE)
+)
+model_cache = cache.ModelCache(salt=(
+    common.LOD_LEVELS, common.LOD_RATIO, common.PACKED_VERTICES, sg.tolerance
+)) if common.MODEL_CACHE else None
+
+
+def cached(func, *args, seed=None, store=True, **kwargs):
+    """
+    Return `func(*args, **kwargs)`, served from the model cache if enabled.
+    Randomized models need a `seed` to be cached, see variant. With `store`
+    False the cache is bypassed, e.g. for models that never come up again.
+    """
+    if model_cache is None or not store:
+        return cache.seeded(seed, func, *args, **kwargs)
+    return model_cache.node(_name(func), func, *args, seed=seed, **kwargs)
+
+
+def generate(gen_service, func, *args, seed=None, store=True, **kwargs):
+    # type: (...) -> service.Job
+    """
+    Like cached, but returns a service.Job and generates misses on
+    `gen_service`. They are stored in the model cache once assembled.
+    """
+    if model_cache is None or not store:
+        return gen_service.submit(func, *args, seed=seed, **kwargs)
+    key = model_cache.key(_name(func), args, kwargs, seed)
+    result = model_cache.load_node(key)
+    if result is not None:
+        return service.Job(value=result)
+    return gen_service.submit(func, *args, seed=seed, **kwargs).then(
+        lambda r: model_cache.store_node(key, r)
+    )
+
+
+def _name(func):
+    # type: (Callable) -> str
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def variant(world_seed, *tags):
+    # type: (int, Any) -> int
+    """
+    Return the seed of a randomized model of world `world_seed`, e.g. with
+    the tags ('stone', i) for its i-th stone. Every model of a world is
+    distinct and the same world gets the same models, which are then served
+    from the model cache on its next start.
+    """
+    digest = hashlib.sha1(repr((world_seed, ) + tags).encode()).digest()
+    return int.from_bytes(digest[:4], 'little') & 0x7fffffff
+
+
+def _pos_hpr_mat(pos, hpr):
+    # type: (core.Vec3, core.Vec3) -> core.Mat4
+    """Return the transform of a node at `pos` with rotation `hpr`."""
+    return core.Mat4(core.TransformState.make_pos_hpr(pos, hpr).get_mat())
 
 
 # noinspection PyArgumentList
@@ -54,30 +119,32 @@ def fir_tree(
     )
     segments = int(ceil(avg_segments / avg_height * height))
     trunk_radius = avg_radius / avg_height * height
+    # += would modify the Vec4 constants in common
     trunk_color = common.FIR_TRUNK_START
-    trunk_color += common.FIR_TRUNK_DELTA * random.random()
+    trunk_color = trunk_color + common.FIR_TRUNK_DELTA * random.random()
     bbc = common.FIR_BRANCH_START + common.FIR_BRANCH_DELTA * random.random()
     branch_colors = [
         bbc + common.FIR_BRANCH_DELTA * (random.random() - 0.5) * 0.1
         for _ in range(segments)
     ]
-    node_path = core.NodePath('fir_tree')
-    trunk_node_path = node_path.attach_new_node(
-        sg.cone(
-            origin=core.Vec3(0),
-            direction=core.Vec3.up(),
-            radius=(trunk_radius, 0),
-            polygon=12,
-            length=height,
-            origin_offset=0.05,
-            color=trunk_color,
-            nac=False,
-            name='fir_tree/trunk'
-        )
+    trunk_mat = _pos_hpr_mat(
+        core.Vec3(0),
+        core.Vec3(random.uniform(0, 360), random.uniform(0, 5), 0)
     )
-    trunk_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 5), 0)
-    if tex is not None:
-        trunk_node_path.set_texture(tex, 1)
+    primitives = [shape.Primitive(
+        'cone',
+        transform=trunk_mat,
+        material=tex,
+        origin=core.Vec3(0),
+        direction=core.Vec3.up(),
+        radius=(trunk_radius, 0),
+        polygon=12,
+        length=height,
+        origin_offset=0.05,
+        color=trunk_color,
+        nac=False,
+        name='fir_tree/trunk'
+    )]
     seg_height = height * 0.8 / segments
     seg_start = height * 0.2
     for i, bc in enumerate(branch_colors):
@@ -91,20 +158,23 @@ def fir_tree(
                 (segments - i - 1) * trunk_radius * 0.8
             ) if i < segments - 1 else 0,
         )
-        br_node_path = node_path.attach_new_node(
-            sg.cone(
-                origin=core.Vec3(0),
-                direction=core.Vec3.up(),
-                radius=radius,
-                polygon=16,
-                length=seg_height,
-                color=bc,
-                nac=False,
-                name=f'fir_tree/branch{i}'
-            )
-        )
-        br_node_path.set_z(trunk_node_path, seg_start + seg_height * 0.5 + i * seg_height)
-        br_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 5), 0)
+        z = seg_start + seg_height * 0.5 + i * seg_height
+        primitives.append(shape.Primitive(
+            'cone',
+            transform=_pos_hpr_mat(
+                trunk_mat.xform_point(core.Point3(0, 0, z)),
+                core.Vec3(random.uniform(0, 360), random.uniform(0, 5), 0)
+            ),
+            origin=core.Vec3(0),
+            direction=core.Vec3.up(),
+            radius=radius,
+            polygon=16,
+            length=seg_height,
+            color=bc,
+            nac=False,
+            name=f'fir_tree/branch{i}'
+        ))
+    node_path = core.NodePath(sg.batch(primitives, 'fir_tree'))
 
     return node_path, trunk_radius
 
@@ -121,30 +191,32 @@ def leaf_tree(
         (1.0 - offset + 1) * avg_height
     )
     trunk_radius = avg_radius / avg_height * height
+    # += would modify the Vec4 constants in common
     trunk_color = common.LEAF_TRUNK_START
-    trunk_color += common.LEAF_TRUNK_DELTA * random.random()
+    trunk_color = trunk_color + common.LEAF_TRUNK_DELTA * random.random()
     branch_color, branch_delta = random.choice(common.LEAF_BRANCH_COLORS)
     branch_color2 = branch_color * 0.999
-    branch_color += common.LEAF_TRUNK_DELTA * random.random()
-    branch_color2 += common.LEAF_TRUNK_DELTA * random.random()
+    branch_color = branch_color + common.LEAF_TRUNK_DELTA * random.random()
+    branch_color2 = branch_color2 + common.LEAF_TRUNK_DELTA * random.random()
 
-    node_path = core.NodePath('leaf_tree')
-    trunk_node_path = node_path.attach_new_node(
-        sg.cone(
-            origin=core.Vec3(0),
-            direction=core.Vec3.up(),
-            radius=(trunk_radius, 0),
-            polygon=12,
-            length=height,
-            origin_offset=0.05,
-            color=trunk_color,
-            nac=False,
-            name='leaf_tree/trunk'
-        )
+    trunk_mat = _pos_hpr_mat(
+        core.Vec3(0),
+        core.Vec3(random.uniform(0, 360), random.uniform(0, 5), 0)
     )
-    trunk_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 5), 0)
-    if tex is not None:
-        trunk_node_path.set_texture(tex, 1)
+    primitives = [shape.Primitive(
+        'cone',
+        transform=trunk_mat,
+        material=tex,
+        origin=core.Vec3(0),
+        direction=core.Vec3.up(),
+        radius=(trunk_radius, 0),
+        polygon=12,
+        length=height,
+        origin_offset=0.05,
+        color=trunk_color,
+        nac=False,
+        name='leaf_tree/trunk'
+    )]
 
     for i in range(random.randint(1, 3)):
         bb = core.Vec3(
@@ -152,32 +224,48 @@ def leaf_tree(
             random.uniform(trunk_radius * 4, height / 4),
             random.uniform(height / 3, height * 0.4),
         )
-
-        br_node_path = node_path.attach_new_node(
-            sg.blob(
-                origin=core.Vec3(0),
-                direction=core.Vec3.up(),
-                bounds=bb,
-                color=branch_color,
-                color2=branch_color2,
-                name='fir_tree/branch',
-                # seed=np.random.randint(0, 2**31, dtype=np.int32),
-                noise_radius=12,
-                nac=False
-            )
-        )
-        br_node_path.set_z(trunk_node_path, height - bb.z * random.random())
-        br_node_path.set_x(trunk_node_path, bb.x * (random.random() - 0.5))
-        br_node_path.set_y(trunk_node_path, bb.y * (random.random() - 0.5))
-        br_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 90), 0)
+        z = height - bb.z * random.random()
+        x = bb.x * (random.random() - 0.5)
+        y = bb.y * (random.random() - 0.5)
+        primitives.append(shape.Primitive(
+            'blob',
+            transform=_pos_hpr_mat(
+                trunk_mat.xform_point(core.Point3(x, y, z)),
+                core.Vec3(random.uniform(0, 360), random.uniform(0, 90), 0)
+            ),
+            origin=core.Vec3(0),
+            direction=core.Vec3.up(),
+            bounds=bb,
+            color=branch_color,
+            color2=branch_color2,
+            name='fir_tree/branch',
+            # seed=np.random.randint(0, 2**31, dtype=np.int32),
+            noise_radius=12,
+            nac=False
+        ))
+    node_path = core.NodePath(sg.batch(primitives, 'leaf_tree'))
     return node_path, trunk_radius
 
 
+def devils_tower():
+    return sg.elliptic_cone(
+        a=(240, 70),
+        b=(200, 80),
+        h=250,
+        max_seg_len=20.0,
+        exp=2.5,
+        top_xy=(40, -20),
+        color=core.Vec4(0.717, 0.635, 0.558, 1),
+        nac=False
+    )
+
+
 # noinspection PyArgumentList
 def obelisk(r=(2.5, 1.8)):
-    node_path = core.NodePath('obelisk')
-    base = node_path.attach_new_node(
-        sg.cone(
+    color = core.Vec4(core.Vec3(0.2), 1)
+    node_path = core.NodePath(sg.batch((
+        shape.Primitive(
+            'cone',
             origin=core.Vec3(0),
             direction=core.Vec3.up(),
             radius=r,
@@ -186,12 +274,12 @@ def obelisk(r=(2.5, 1.8)):
             smooth=False,
             capsule=False,
             origin_offset=0,
-            color=core.Vec4(core.Vec3(0.2), 1),
+            color=color,
             nac=False
-        )
-    )
-    top = node_path.attach_new_node(
-        sg.cone(
+        ),
+        shape.Primitive(
+            'cone',
+            transform=core.Mat4.translate_mat(0, 0, 15),
             origin=core.Vec3(0),
             direction=core.Vec3.up(),
             radius=(r[1], 0),
@@ -200,11 +288,10 @@ def obelisk(r=(2.5, 1.8)):
             smooth=False,
             capsule=False,
             origin_offset=0,
-            color=core.Vec4(core.Vec3(0.2), 1),
+            color=color,
             nac=False
         )
-    )
-    top.set_z(15)
+    ), 'obelisk'))
     # mat = core.Material()
     # mat.set_emission(core.Vec4(.35, 1.0, 0.52, 0.1))
     # mat.set_shininess(5.0)
@@ -213,14 +300,15 @@ def obelisk(r=(2.5, 1.8)):
 
 
 # noinspection PyArgumentList
-def stone(xy):
+@cache.local_rng
+def stone(xy, rng=random):
     node_path = core.NodePath('stone')
     base = common.STONE_START
-    color = base + common.STONE_DELTA * random.random()
-    color2 = base + common.STONE_DELTA * random.random()
+    color = base + common.STONE_DELTA * rng.random()
+    color2 = base + common.STONE_DELTA * rng.random()
     bb = core.Vec3(
         xy,
-        random.uniform(min(xy) * 0.9, min(xy) * 1.1)
+        rng.uniform(min(xy) * 0.9, min(xy) * 1.1)
     )
     br_node_path = node_path.attach_new_node(
         sg.blob(
@@ -230,7 +318,7 @@ def stone(xy):
             color=color,
             color2=color2,
             name='fir_tree/branch',
-            # seed=random.randint(0, 2 ** 32 - 1),
+            seed=rng.randint(-2147483648, 2147483647),
             noise_radius=200,
             nac=False
         )
@@ -238,6 +326,18 @@ def stone(xy):
     return br_node_path
 
 
+@cache.local_rng
+def random_stone(min_size, max_size, rng=random):
+    """
+    Return a stone with random xy bounds in min_size..max_size. Only draws
+    from `rng`, so seeded stones can be generated on loader threads.
+    """
+    return stone(core.Vec2(
+        rng.uniform(min_size, max_size),
+        rng.uniform(min_size, max_size)
+    ), rng=rng)
+
+
 # noinspection PyArgumentList
 def three_rings():
     node_path = core.NodePath('three_rings')
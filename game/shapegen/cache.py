@@ -0,0 +1,480 @@
+"""
+Provides persistent, content addressed caches for generated models and
+seeded array fields.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import enum
+import hashlib
+import json
+import os
+import random
+import shutil
+import struct
+import threading
+import zipfile
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+from panda3d import core
+
+from . import mesh
+from .. import common
+
+# bump when generators change their output for the same arguments
+CACHE_VERSION = 7
+_META_TAG = 'model_cache'
+_FIELDS_INDEX = 'fields.json'
+
+
+class ModelCache(object):
+    """
+    Stores generated models on disk, keyed by a hash of the generator name,
+    its arguments and the RNG seed. Nodes are stored as .bam, ArrayMesh
+    instances as uncompressed .npz whose arrays are memory mapped on load.
+    The least recently used entries are evicted once the total size of the
+    cache directory exceeds `max_bytes`.
+
+    Args:
+        directory: cache directory, Panda3D variables like $MAIN_DIR are
+            expanded
+        max_bytes: size bound of all entries together
+        salt: hashable settings that change the output of all generators
+            (e.g. LOD and vertex format), part of every key
+    """
+    def __init__(
+            self,
+            directory=common.MODEL_CACHE_DIR,
+            max_bytes=common.MODEL_CACHE_MAX_BYTES,
+            salt=None
+    ):
+        # type: (str, int, Any) -> None
+        self._dir = core.Filename.expand_from(directory).to_os_specific()
+        self.max_bytes = max_bytes
+        self._salt = _encode(salt)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        # type: () -> str
+        return self._dir
+
+    def key(self, name, args=(), kwargs=None, seed=None):
+        # type: (str, tuple, Optional[Dict[str, Any]], Optional[int]) -> str
+        """
+        Return the hex digest that identifies the output of generator
+        `name` called with `args`, `kwargs` and RNG `seed`.
+        """
+        return _digest(CACHE_VERSION, self._salt, name, args, kwargs, seed)
+
+    def node(self, name, func, *args, seed=None, **kwargs):
+        # type: (str, Callable, Any, Optional[int], Any) -> Any
+        """
+        Return `func(*args, **kwargs)` from the cache or, on a miss, call it
+        and store the result as .bam. `func` has to return a NodePath or
+        PandaNode, or a tuple of one followed by JSON serializable values.
+        If `seed` is given, `random` and `np.random` are seeded with it for
+        the call and restored afterwards, so the output only depends on the
+        key.
+        """
+        key = self.key(name, args, kwargs, seed)
+        result = self.load_node(key)
+        if result is None:
+            result = seeded(seed, func, *args, **kwargs)
+            self.store_node(key, result)
+        return result
+
+    def load_node(self, key):
+        # type: (str) -> Any
+        """Return the node stored under `key` or None on a miss."""
+        return self._load(self._path(key, '.bam'), _read_bam)
+
+    def store_node(self, key, result):
+        # type: (str, Any) -> None
+        """Store a result of a node generator under `key`, see node."""
+        self._store(self._path(key, '.bam'), _write_bam, result)
+
+    def mesh(self, name, func, *args, seed=None, **kwargs):
+        # type: (str, Callable, Any, Optional[int], Any) -> mesh.ArrayMesh
+        """
+        Like `node`, for generators that return an ArrayMesh. The mesh is
+        stored as .npz and its arrays are memory mapped copy-on-write on a
+        hit.
+        """
+        path = self._path(self.key(name, args, kwargs, seed), '.npz')
+        result = self._load(path, _read_npz)
+        if result is not None:
+            return result
+        result = seeded(seed, func, *args, **kwargs)
+        self._store(path, _write_npz, result)
+        return result
+
+    def size(self):
+        # type: () -> int
+        """Return the total size of all entries in bytes."""
+        return sum(e.stat().st_size for e in self._entries())
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        for entry in self._entries():
+            os.remove(entry.path)
+        self.hits = self.misses = self.evictions = 0
+
+    def _path(self, key, ext):
+        return os.path.join(self._dir, key + ext)
+
+    def _load(self, path, read):
+        try:
+            result = read(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mtime is the LRU timestamp
+        except OSError:     # evicted by another thread in the meantime
+            pass
+        self.hits += 1
+        return result
+
+    def _store(self, path, write, result):
+        os.makedirs(self._dir, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            write(tmp, result)
+            os.replace(tmp, path)
+        except BaseException:
+            # e.g. disk full or an interrupted write, don't leave it behind
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._evict()
+
+    def _entries(self):
+        if not os.path.isdir(self._dir):
+            return []
+        return [
+            e for e in os.scandir(self._dir)
+            if e.is_file() and e.name.endswith(('.bam', '.npz'))
+        ]
+
+    def _evict(self):
+        with self._lock:
+            entries = [(e.stat(), e.path) for e in self._entries()]
+            total = sum(st.st_size for st, _ in entries)
+            entries.sort(key=lambda e: e[0].st_mtime)
+            for st, path in entries[:-1]:   # the newest entry is always kept
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= st.st_size
+                self.evictions += 1
+
+
+class FieldCache(object):
+    """
+    Stores named arrays generated from a seed (e.g. the terrain heightfield
+    of a world) on disk as one .npy per array in a directory per key, keyed
+    like ModelCache. On a hit the arrays are memory mapped read-only, so
+    only the pages actually touched are read. The least recently used
+    entries are removed beyond `max_entries`.
+
+    Args:
+        directory: cache directory, Panda3D variables like $MAIN_DIR are
+            expanded
+        max_entries: number of entries kept
+        salt: hashable settings that change the output of all generators
+            (e.g. noise constants), part of every key
+    """
+    def __init__(
+            self,
+            directory=common.FIELD_CACHE_DIR,
+            max_entries=common.FIELD_CACHE_ENTRIES,
+            salt=None
+    ):
+        # type: (str, int, Any) -> None
+        self._dir = core.Filename.expand_from(directory).to_os_specific()
+        self.max_entries = max_entries
+        self._salt = _encode(salt)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        # type: () -> str
+        return self._dir
+
+    def key(self, name, args=(), kwargs=None, seed=None):
+        # type: (str, tuple, Optional[Dict[str, Any]], Optional[int]) -> str
+        """See ModelCache.key."""
+        return _digest(
+            CACHE_VERSION,
+            'fields',
+            self._salt,
+            name,
+            args,
+            kwargs,
+            seed
+        )
+
+    def arrays(self, name, func, *args, seed=None, **kwargs):
+        # type: (str, Callable, Any, Optional[int], Any) -> Dict[str, Any]
+        """
+        Return `func(*args, **kwargs)` from the cache or, on a miss, call it
+        seeded with `seed` (see seeded) and store the result. `func` has to
+        return a dict of non-empty numeric arrays. Arrays served from the
+        cache are read-only memory maps, a miss returns what `func` returned.
+        """
+        path = os.path.join(self._dir, self.key(name, args, kwargs, seed))
+        try:
+            result = _read_fields(path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+        else:
+            try:
+                os.utime(path)  # mtime is the LRU timestamp
+            except OSError:     # evicted by another thread in the meantime
+                pass
+            self.hits += 1
+            return result
+        result = seeded(seed, func, *args, **kwargs)
+        self._store(path, result)
+        return result
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        for entry in self._entries():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        self.hits = self.misses = self.evictions = 0
+
+    def _store(self, path, result):
+        os.makedirs(self._dir, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(tmp)
+        try:
+            for name, array in result.items():
+                np.save(os.path.join(tmp, name + '.npy'), array)
+            # written last, an entry without it is incomplete
+            with open(os.path.join(tmp, _FIELDS_INDEX), 'w') as f:
+                json.dump(sorted(result), f)
+            try:
+                os.replace(tmp, path)
+            except OSError:     # stored by someone else in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+
+    def _entries(self):
+        if not os.path.isdir(self._dir):
+            return []
+        return [
+            e for e in os.scandir(self._dir)
+            if e.is_dir() and not e.name.endswith('.tmp')
+        ]
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(
+                self._entries(),
+                key=lambda e: e.stat().st_mtime
+            )
+            for entry in entries[:max(0, len(entries) - self.max_entries)]:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                self.evictions += 1
+
+
+def local_rng(func):
+    # type: (Callable) -> Callable
+    """
+    Mark generator `func` as drawing only from its `rng` keyword argument, a
+    random.Random or the `random` module (the default), see seeded.
+    """
+    func.local_rng = True
+    return func
+
+
+def seeded(seed, func, *args, **kwargs):
+    # type: (Optional[int], Callable, Any, Any) -> Any
+    """
+    Return `func(*args, **kwargs)` with `random` and `np.random` seeded with
+    `seed` for the call and restored afterwards. A `seed` of None calls
+    `func` with the current RNG state. Generators marked with local_rng get
+    `rng=random.Random(seed)` instead and leave the global RNG alone.
+
+    The global RNG is shared by all threads of a process: only seed other
+    generators where no other thread draws from it meanwhile, i.e. on the
+    main thread or in a worker process. From any other thread the results
+    are not reproducible and the draws of the main thread get rewound.
+    """
+    if seed is None:
+        return func(*args, **kwargs)
+    if getattr(func, 'local_rng', False):
+        return func(*args, rng=random.Random(seed), **kwargs)
+    state, np_state = random.getstate(), np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        random.setstate(state)
+        np.random.set_state(np_state)
+
+
+def _digest(*parts):
+    # type: (Any) -> str
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(_encode(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _encode(value):
+    # type: (Any) -> str
+    """Return a canonical string of an argument value for hashing."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        return '(' + ','.join(_encode(v) for v in value) + ')'
+    if isinstance(value, dict):
+        return '{' + ','.join(
+            f'{_encode(k)}:{_encode(value[k])}' for k in sorted(value)
+        ) + '}'
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha1(np.ascontiguousarray(value).tobytes())
+        return f'ndarray{value.dtype.str}{value.shape}{digest.hexdigest()}'
+    if isinstance(value, np.generic):
+        return repr(value.item())
+    if isinstance(value, enum.Enum):
+        return f'{type(value).__name__}.{value.name}'
+    if isinstance(value, (core.LVecBase2f, core.LVecBase3f, core.LVecBase4f,
+                          core.LVecBase2i, core.LVecBase3i, core.LVecBase4i,
+                          core.LMatrix3f, core.LMatrix4f)):
+        return type(value).__name__ + repr(tuple(np.asarray(value).ravel()))
+    raise TypeError(f'cannot use {type(value).__name__} in a cache key')
+
+
+def _write_bam(path, result):
+    extras = None
+    if isinstance(result, tuple):
+        result, extras = result[0], list(result[1:])
+    is_node_path = isinstance(result, core.NodePath)
+    node_path = result if is_node_path else core.NodePath(result)
+    node_path.set_tag(_META_TAG, json.dumps({
+        'node_path': is_node_path,
+        'extras': extras
+    }))
+    try:
+        with open(path, 'wb') as f:
+            f.write(node_path.encode_to_bam_stream())
+    finally:
+        node_path.clear_tag(_META_TAG)
+
+
+def _read_bam(path):
+    with open(path, 'rb') as f:
+        node_path = core.NodePath.decode_from_bam_stream(f.read())
+    if node_path.is_empty():
+        raise ValueError(f'unable to read "{path}"')
+    meta = json.loads(node_path.get_tag(_META_TAG))
+    node_path.clear_tag(_META_TAG)
+    result = node_path if meta['node_path'] else node_path.node()
+    if meta['extras'] is None:
+        return result
+    return (result, ) + tuple(meta['extras'])
+
+
+def _write_npz(path, msh):
+    # np.savez does not compress, which keeps the arrays mappable
+    with open(path, 'wb') as f:
+        np.savez(f, name=np.array(msh.name), **msh.arrays())
+
+
+def _read_npz(path):
+    arrays = _mmap_npz(path)
+    return mesh.ArrayMesh.from_arrays(str(arrays.pop('name')), **arrays)
+
+
+def _mmap_npz(path):
+    # type: (str) -> Dict[str, np.ndarray]
+    """
+    Return the arrays of an uncompressed .npz, memory mapped copy-on-write.
+    np.load ignores `mmap_mode` for .npz, so the members are located in the
+    zip archive and mapped directly.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'"{path}" is compressed')
+            # skip the local file header, its extra field can differ from
+            # the one in the central directory
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(name_len + extra_len, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran, dtype = header
+            name = info.filename[:-len('.npy')]
+            if dtype.hasobject:
+                raise ValueError(f'"{path}" holds object arrays')
+            if not shape:
+                arrays[name] = np.fromfile(f, dtype, 1)[0]
+            elif not np.prod(shape):
+                arrays[name] = np.zeros(shape, dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype,
+                    'c',
+                    f.tell(),
+                    shape,
+                    'F' if fortran else 'C'
+                )
+    return arrays
+
+
+def _read_fields(path):
+    # type: (str) -> Dict[str, np.ndarray]
+    with open(os.path.join(path, _FIELDS_INDEX)) as f:
+        names = json.load(f)
+    return {
+        name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        for name in names
+    }
@@ -1,5 +1,6 @@
 """
-Provides a Panda NodePath based drawing rig for general shape generation.
+Provides a Panda NodePath based drawing rig for general shape generation and
+ArrayDraw, the same rig as NumPy matrices for whole arrays of samples.
 """
 
 __copyright__ = """
@@ -26,6 +27,9 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from typing import Optional
+
+import numpy as np
 from panda3d import core
 
 
@@ -134,3 +138,214 @@ class Draw(object):
             r: draw radius (distance from orientation)
         """
         self._draw.set_y(r)
+
+
+class ArrayDraw(object):
+    """
+    Drop in replacement for Draw that composes the rig as 4x4 matrices (row
+    vector convention, like Panda3D) instead of NodePath transforms. Besides
+    the Draw interface, `points` and `center_points` evaluate whole arrays of
+    heading/pitch/radius/offset samples at once.
+    """
+    def __init__(self):
+        # heading and pitch correction, see Draw.__init__
+        self._correction = hpr_mats(-90, 0, 0)[0] @ hpr_mats(0, -90, 0)[0]
+        self._origin = np.eye(4)
+        self._chain = np.eye(4)     # orient parent (heading) -> world
+        self._offset = np.eye(4)    # orient_offset in orient space
+        self._pos = np.zeros(3)     # orient position
+        self._hp = (0.0, 0.0)       # orient heading, pitch
+        self._radius = 0.0
+
+    @property
+    def point(self):
+        return core.Point3(*self.points(*self._hp)[0])
+
+    @property
+    def local_point(self):
+        return core.Point3(*self._local_points(*self._hp)[0])
+
+    @property
+    def center_point(self):
+        return core.Point3(*self.center_points(*self._hp)[0])
+
+    @property
+    def transform_mat(self):
+        return core.Mat4(*self._chain.ravel().tolist())
+
+    @property
+    def matrix(self):
+        # type: () -> np.ndarray
+        """The (4, 4) NumPy version of transform_mat, read only."""
+        matrix = self._chain.view()
+        matrix.flags.writeable = False
+        return matrix
+
+    def setup(self, origin, direction):
+        """
+        Setup the rigs' origin and direction
+
+        Args:
+            origin:
+            direction:
+        """
+        quat = core.Quat()
+        core.look_at(quat, core.Vec3(direction), core.Vec3.up())
+        rot = core.Mat3()
+        quat.extract_to_matrix(rot)
+        self._origin = np.eye(4)
+        self._origin[:3, :3] = np.array(rot, np.float64)
+        self._origin[3, :3] = tuple(origin)
+        self._chain = np.eye(4)
+        self._chain[:3, :3] = self._correction @ self._origin[:3, :3]
+        self._chain[3, :3] = self._origin[3, :3]
+        self._offset = np.eye(4)
+        self._pos = np.zeros(3)
+        self._hp = (0.0, 0.0)
+        self._radius = 0.0
+
+    def set_orientation_offset(self, point=core.Vec3(0), hpr=core.Vec3(0)):
+        point.y = -point.y
+        self._offset = np.eye(4)
+        self._offset[:3, :3] = hpr_mats(*hpr)[0]
+        self._offset[3, :3] = tuple(point)
+
+    def orientation_offset_look_at(self, direction):
+        quat = core.Quat()
+        core.look_at(quat, core.Vec3(direction), core.Vec3.up())
+        rot = core.Mat3()
+        quat.extract_to_matrix(rot)
+        self._offset[:3, :3] = np.array(rot, np.float64)
+
+    def set_pos_hp_r(self, x, y, z, h, p, r):
+        """
+        Update the entire rig in model space.
+
+        Args:
+            x: u-axis
+            y: v-axis
+            z: direction-axis
+            h: heading
+            p: pitch
+            r: draw radius (distance from orientation)
+        """
+        self._pos = np.array((y, x, z), np.float64)
+        self._hp = (h, p)
+        self._radius = r
+
+    def set_hp_r(self, h, p, r=None):
+        """
+        Update heading and pitch of orientation and optionally draw distance.
+
+        Args:
+            h: heading
+            p: pitch
+            r: draw radius (distance from orientation)
+        """
+        self._hp = (h, p)
+        if r is not None:
+            self._radius = r
+
+    def set_dir_offset(self, o):
+        """
+        Updates only directional-axis.
+
+        Args:
+            o: offset
+        """
+        self._pos[2] = o
+
+    def set_radius(self, r):
+        """
+        Update the draw distance.
+
+        Args:
+            r: draw radius (distance from orientation)
+        """
+        self._radius = r
+
+    def points(self, h, p, r=None, dir_offset=None):
+        # type: (np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]) -> np.ndarray
+        """
+        Return the (n, 3) world space draw points of all samples. Arguments
+        are broadcast against each other, `r` and `dir_offset` default to the
+        current rig state.
+
+        Args:
+            h: heading
+            p: pitch
+            r: draw radius (distance from orientation)
+            dir_offset: offset along the direction-axis
+        """
+        local = self._orient_points(h, p, r, dir_offset)
+        return local @ self._chain[:3, :3] + self._chain[3, :3]
+
+    def center_points(self, h, p, r=None, dir_offset=None):
+        # type: (np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]) -> np.ndarray
+        """
+        Return the (n, 3) world space points on the direction-axis at the
+        height of the draw points, see Draw.center_point.
+        """
+        z = self._local_points(h, p, r, dir_offset)[:, 1:2]
+        return z * self._chain[2, :3] + self._chain[3, :3]
+
+    def axis_offsets(self, x, y):
+        # type: (np.ndarray, np.ndarray) -> np.ndarray
+        """
+        Return the (n, 3) world space vectors of u/v-axis offsets of the
+        orientation, see set_pos_hp_r.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, np.float64), y)
+        local = np.stack((y, x, np.zeros_like(x)), axis=-1).reshape(-1, 3)
+        return local @ self._chain[:3, :3]
+
+    def _local_points(self, h, p, r=None, dir_offset=None):
+        # type: (np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]) -> np.ndarray
+        """Return the (n, 3) draw points relative to the rigs' origin."""
+        return self._orient_points(h, p, r, dir_offset) @ self._correction
+
+    def _orient_points(self, h, p, r, dir_offset):
+        # type: (np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]) -> np.ndarray
+        """Return the (n, 3) draw points in the space of the orient parent."""
+        r = self._radius if r is None else np.asarray(r, np.float64)
+        z = self._pos[2] if dir_offset is None else dir_offset
+        h = np.radians(np.asarray(h, np.float64))
+        p = np.radians(np.asarray(p, np.float64))
+        ch, sh, cp, sp = np.cos(h), np.sin(h), np.cos(p), np.sin(p)
+        # draw position in orient space, rotated by hpr_mats(h, p, 0)
+        d = np.multiply.outer(r, self._offset[1, :3]) + self._offset[3, :3]
+        d0, d1, d2 = d[..., 0], d[..., 1], d[..., 2]
+        pts = np.stack(np.broadcast_arrays(
+            d0 * ch - (d1 * cp - d2 * sp) * sh + self._pos[0],
+            d0 * sh + (d1 * cp - d2 * sp) * ch + self._pos[1],
+            d1 * sp + d2 * cp + z
+        ), axis=-1)
+        return pts.reshape(-1, 3)
+
+
+def hpr_mats(h, p, r):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Return (n, 3, 3) rotation matrices for heading/pitch/roll in degrees,
+    like core.compose_matrix in the default z-up right handed coordinate
+    system.
+    """
+    h, p, r = [
+        np.radians(a.ravel()) for a in np.broadcast_arrays(
+            *[np.asarray(a, np.float64) for a in (h, p, r)]
+        )
+    ]
+    ch, sh = np.cos(h), np.sin(h)
+    cp, sp = np.cos(p), np.sin(p)
+    cr, sr = np.cos(r), np.sin(r)
+    mats = np.empty((len(h), 3, 3))
+    mats[:, 0, 0] = cr * ch - sr * sp * sh
+    mats[:, 0, 1] = cr * sh + sr * sp * ch
+    mats[:, 0, 2] = -sr * cp
+    mats[:, 1, 0] = -cp * sh
+    mats[:, 1, 1] = cp * ch
+    mats[:, 1, 2] = sp
+    mats[:, 2, 0] = sr * ch + cr * sp * sh
+    mats[:, 2, 1] = sr * sh - cr * sp * ch
+    mats[:, 2, 2] = cr * cp
+    return mats
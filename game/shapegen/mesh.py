@@ -26,14 +26,22 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from collections import namedtuple
+from itertools import product
 from math import cos
+from math import floor
 from math import radians
 from typing import List
 from typing import Dict
+from typing import Optional
+from typing import Tuple
 
+import numpy as np
 from panda3d import core
 
+from . import shading
 from . import util
+from . import vcache
 from .. import common
 
 
@@ -337,7 +345,578 @@ class Mesh(object):
                     v.remove_triangle(t)
 
 
+class ArrayMesh(object):
+    """
+    Structure-of-arrays drop in replacement for Mesh. Unique positions,
+    per vertex attributes and triangle indices live in growable NumPy buffers
+    instead of individual Point/Vertex/Triangle objects.
+
+    With `weld_eps` set, positions that differ by at most `weld_eps` on every
+    axis are welded into a single point, using a spatial hash of integer grid
+    cells with an edge length of `2 * weld_eps`.
+    """
+    def __init__(self, name='noname', weld_eps=None):
+        # type: (str, Optional[float]) -> None
+        self._name = name
+        self._weld_eps = weld_eps
+        self._cells = {}        # type: Dict[Tuple[int, int, int], list]
+        self.num_welded = 0
+        self._points = util.ArrayBuffer((3, ), np.float32)
+        self._vpt = util.ArrayBuffer((), np.int32)
+        self._colors = util.ArrayBuffer((4, ), np.float32)
+        self._texcoords = util.ArrayBuffer((2, ), np.float32)
+        self._trs = util.ArrayBuffer((3, ), np.int32)
+        self._pt_lookup = {}    # type: Dict[Tuple[float, ...], int]
+        self._vt_lookup = {}    # type: Dict[Tuple[int, tuple, tuple], int]
+        self._stale = False     # lookups need a rebuild after bulk edits
+
+    @property
+    def name(self):
+        # type: () -> str
+        return self._name
+
+    @property
+    def triangles(self):
+        # type: () -> np.ndarray
+        return self._trs.data
+
+    @property
+    def points(self):
+        # type: () -> np.ndarray
+        """Per vertex positions."""
+        return self._points.data[self._vpt.data]
+
+    @property
+    def colors(self):
+        # type: () -> np.ndarray
+        return self._colors.data
+
+    @property
+    def texcoords(self):
+        # type: () -> np.ndarray
+        return self._texcoords.data
+
+    @property
+    def num_vertices(self):
+        return len(self._vpt)
+
+    @property
+    def weld_stats(self):
+        # type: () -> WeldStats
+        """Number of unique points, welded positions and vertices."""
+        return WeldStats(len(self._points), self.num_welded, len(self._vpt))
+
+    def mirror_extend(self, axis):
+        mirrored = self.copy()
+        mirrored.mirror_local(axis)
+        self.extend(mirrored)
+
+    def mirror_local(self, axis):
+        scale = core.Vec3(1)
+        scale[axis] = -1
+        self.transform(core.Mat4.scale_mat(scale))
+
+    def flip_faces(self):
+        trs = self._trs.data
+        trs[:, [0, 1]] = trs[:, [1, 0]]
+
+    def transform(self, mat):
+        # type: (core.Mat4) -> None
+        """
+        Transforms all points in place. Faces are flipped if `mat` mirrors,
+        so triangles keep their ccw winding.
+
+        Args:
+            mat: Mat4
+        """
+        pts = self._points.data
+        pts[:] = util.xform_points(mat, pts)
+        self._stale = True
+        if mat.get_upper_3().determinant() < 0:
+            self.flip_faces()
+
+    def arrays(self):
+        # type: () -> Dict[str, np.ndarray]
+        """
+        Return the raw buffers (unique positions, position id per vertex,
+        colors, texcoords and triangles), see from_arrays.
+        """
+        return {
+            'points': self._points.data,
+            'vpt': self._vpt.data,
+            'colors': self._colors.data,
+            'texcoords': self._texcoords.data,
+            'triangles': self._trs.data
+        }
+
+    @classmethod
+    def from_arrays(
+            cls,
+            name,
+            points,
+            vpt,
+            colors,
+            texcoords,
+            triangles,
+            weld_eps=None
+    ):
+        # type: (str, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, Optional[float]) -> ArrayMesh
+        """
+        Return an ArrayMesh that uses the arrays returned by `arrays` as its
+        buffers, without copying them (e.g. memory mapped arrays).
+        """
+        msh = cls(name, weld_eps)
+        msh._points = util.ArrayBuffer.from_array(points)
+        msh._vpt = util.ArrayBuffer.from_array(vpt)
+        msh._colors = util.ArrayBuffer.from_array(colors)
+        msh._texcoords = util.ArrayBuffer.from_array(texcoords)
+        msh._trs = util.ArrayBuffer.from_array(triangles)
+        msh._stale = True
+        return msh
+
+    def copy(self, name=None):
+        # type: (Optional[str]) -> ArrayMesh
+        """Return a copy of this instance with the same `weld_eps`."""
+        msh = ArrayMesh(name or self._name, self._weld_eps)
+        msh.append(self)
+        return msh
+
+    def append(self, other):
+        # type: (ArrayMesh) -> None
+        """
+        Concatenates all points, vertices and triangles of `other` without
+        deduplication or welding, in time linear in the size of `other`.
+
+        Args:
+            other: ArrayMesh
+        """
+        num_pts, num_vts = len(self._points), len(self._vpt)
+        self._points.extend(other._points.data)
+        self._vpt.extend(other._vpt.data + num_pts)
+        self._colors.extend(other.colors)
+        self._texcoords.extend(other.texcoords)
+        self._trs.extend(other.triangles + num_vts)
+        self._stale = True
+
+    def extend(self, other):
+        # type: (ArrayMesh) -> None
+        """
+        Extends this instance with all triangles of `other`, deduplicating
+        (or welding, if `weld_eps` is set) their vertices with the existing
+        ones. Does not consider unused vertices!!!
+
+        Args:
+            other: ArrayMesh
+        """
+        corners = other.triangles.ravel()
+        first, inv = _unique_rows(corners[:, None])
+        used = corners[first]
+        vids = self.add_vertices(
+            other.points[used],
+            other.colors[used],
+            other.texcoords[used]
+        )
+        self._trs.extend(vids[inv].reshape(-1, 3))
+
+    def export(
+            self,
+            face_normals=True,
+            avg_color=True,
+            sharp_angle=80.0,
+            nac=common.NAC,
+            transform=None,
+            no_texcoord=False,
+            tangent=False,
+            optimize=False,
+            packed=False
+    ):
+        """
+        Return a Panda Node of the mesh. Same arguments as Mesh.export, plus:
+
+        Args:
+            optimize: reorder triangles and vertices for vertex cache
+                locality and less overdraw (see vcache.optimize).
+            packed: use the compact util.packed_format instead of float32
+                normals, colors and texcoords.
+        """
+        va = util.VertArray(
+            self._name,
+            no_texcoord,
+            tangents=tangent,
+            packed=packed
+        )
+        trs = self._trs.data
+        pts = self.points
+        normal_mag = shading.face_normals(pts, trs)
+
+        if face_normals:  # flat shading
+            if optimize:
+                order, clusters = vcache.tipsify(trs)
+                order = vcache.overdraw_sort(trs, pts, order, clusters)
+                trs, normal_mag = trs[order], normal_mag[order]
+            normals = shading.normalized(normal_mag)
+            corners = trs.ravel()
+            if nac:
+                colors = np.ones((len(trs), 4), np.float32)
+                colors[:, :3] = normals
+                colors = np.repeat(colors, 3, axis=0)
+            elif avg_color:
+                colors = np.ones((len(trs), 4), np.float32)
+                colors[:, :3] = self._colors.data[trs, :3].sum(axis=1) / 3
+                colors = np.repeat(colors, 3, axis=0)
+            else:
+                colors = self._colors.data[corners]
+            rows = [
+                pts[corners],
+                np.repeat(normals, 3, axis=0),
+                colors,
+                self._texcoords.data[corners]
+            ]
+            trs = np.arange(len(corners))
+        else:  # smooth shading
+            vts, trs, normals = shading.smooth_normals(
+                self._vpt.data,
+                trs,
+                normal_mag,
+                sharp_angle
+            )
+            used = np.zeros(len(vts), bool)
+            used[trs.ravel()] = True
+            mesh2va = np.cumsum(used) - 1
+            colors = self._colors.data[vts]
+            if nac:
+                colors = np.ones_like(colors)
+                colors[:, :3] = normals
+            rows = [
+                self._points.data[self._vpt.data[vts]],
+                normals,
+                colors,
+                self._texcoords.data[vts]
+            ]
+            if tangent:
+                rows += shading.tangent_space(rows[0], rows[3], trs, normals)
+            rows = [r[used] for r in rows]
+            trs = mesh2va[trs]
+            if optimize:
+                trs, vertex_order = vcache.optimize(trs, rows[0])
+                rows = [r[vertex_order] for r in rows]
+        if packed and transform is not None:
+            # integer columns can't go through transform_vertices
+            rows[0] = util.xform_points(transform, rows[0])
+            rows[1] = util.xform_vectors(transform, rows[1], normals=True)
+            rows[4:] = [util.xform_vectors(transform, r) for r in rows[4:]]
+            transform = None
+        va.add_arrays(*rows)
+        va.add_triangles(trs)
+        if transform is not None:
+            va.transform(transform)
+        return va.node
+
+    def add_vertex(self, point, color=core.Vec4(1), texcoord=core.Vec2(0)):
+        # type: (core.Vec3, core.Vec4, core.Vec2) -> int
+        """
+        Return unique vertex id, inserting a new one only if necessary.
+
+        Args:
+            point:
+            color:
+            texcoord:
+        """
+        if self._stale:
+            self._rebuild_lookups()
+        pk = tuple(point)
+        pid = self._pt_lookup.get(pk)
+        if pid is None:
+            pid = self._insert_point(pk)
+        ck = tuple(color)
+        if len(ck) == 3:
+            ck += (1.0, )
+        vk = (pid, ck, tuple(texcoord))
+        vid = self._vt_lookup.get(vk)
+        if vid is None:
+            vid = self._vt_lookup[vk] = self._vpt.append(pid)
+            self._colors.append(ck)
+            self._texcoords.append(vk[2])
+        return vid
+
+    def add_vertices(self, points, colors=None, texcoords=None):
+        # type: (np.ndarray, Optional[np.ndarray], Optional[np.ndarray]) -> np.ndarray
+        """
+        Bulk version of add_vertex. Returns the vertex ids of all rows, new
+        vertices are numbered in order of their first row.
+
+        Args:
+            points: (n, 3) positions
+            colors: (n, 3) or (n, 4) colors, defaults to white
+            texcoords: (n, 2) uv coordinates, defaults to zero
+        """
+        points = np.asarray(points, np.float32).reshape(-1, 3)
+        n = len(points)
+        if colors is None:
+            colors = np.ones((n, 4), np.float32)
+        colors = np.asarray(colors, np.float32)
+        if colors.shape[1] == 3:
+            colors = np.hstack((colors, np.ones((n, 1), np.float32)))
+        if texcoords is None:
+            texcoords = np.zeros((n, 2), np.float32)
+        texcoords = np.asarray(texcoords, np.float32)
+        if not n:
+            return np.zeros(0, np.int32)
+        if self._weld_eps is None and not len(self._vpt):
+            # fresh mesh: dedupe in NumPy only, lookups are built on demand
+            first, pids = _unique_rows(points)
+            self._points.extend(points[first])
+            first, vids = _unique_rows(_vertex_rows(pids, colors, texcoords))
+            self._vpt.extend(pids[first])
+            self._colors.extend(colors[first])
+            self._texcoords.extend(texcoords[first])
+            self._stale = True
+            return vids.astype(np.int32)
+        if self._stale:
+            self._rebuild_lookups()
+
+        # positions: dedupe within the batch, then look up the survivors
+        if self._weld_eps is None:
+            first, inv = _unique_rows(points)
+            start = len(self._points)
+            pids = _lookup_or_insert(
+                self._pt_lookup,
+                list(map(tuple, points[first].tolist())),
+                start
+            )
+            self._points.extend(points[first[pids >= start]])
+        else:
+            # every distinct position goes through the same weld test as in
+            # add_vertex, pre-grouping on a grid would weld up to 2 * eps
+            first, inv = _unique_rows(points)
+            pt_lookup = self._pt_lookup
+            pids = np.array([
+                pt_lookup[pk] if pk in pt_lookup else self._insert_point(pk)
+                for pk in map(tuple, points[first].tolist())
+            ], np.int32)
+        pids = pids[inv]
+
+        # vertices: dedupe (point, color, uv) the same way
+        first, inv = _unique_rows(_vertex_rows(pids, colors, texcoords))
+        vks = list(zip(
+            pids[first].tolist(),
+            map(tuple, colors[first].tolist()),
+            map(tuple, texcoords[first].tolist())
+        ))
+        start = len(self._vpt)
+        vids = _lookup_or_insert(self._vt_lookup, vks, start)
+        new = first[vids >= start]
+        self._vpt.extend(pids[new])
+        self._colors.extend(colors[new])
+        self._texcoords.extend(texcoords[new])
+        return vids[inv]
+
+    def _rebuild_lookups(self):
+        """
+        Rebuild the point and vertex lookups and the weld cells from the
+        arrays, after bulk edits by append or transform.
+        """
+        pks = list(map(tuple, self._points.data.tolist()))
+        vks = list(zip(
+            self._vpt.data.tolist(),
+            map(tuple, self._colors.data.tolist()),
+            map(tuple, self._texcoords.data.tolist())
+        ))
+        # insert in reverse, so the first of several equal keys wins
+        self._pt_lookup = dict(zip(pks[::-1], range(len(pks) - 1, -1, -1)))
+        self._vt_lookup = dict(zip(vks[::-1], range(len(vks) - 1, -1, -1)))
+        self._cells = {}
+        if self._weld_eps is not None:
+            for pid, pk in enumerate(pks):
+                self._cells.setdefault(self._weld_cells(pk)[0], []).append(
+                    (pid, pk)
+                )
+        self._stale = False
+
+    def _insert_point(self, pk):
+        # type: (Tuple[float, ...]) -> int
+        """
+        Return the point id for a position that has no exact match yet,
+        welding it to a point within `weld_eps` if enabled.
+        """
+        if self._weld_eps is None:
+            pid = self._pt_lookup[pk] = self._points.append(pk)
+            return pid
+        eps = self._weld_eps
+        cells = self._weld_cells(pk)
+        for cell in cells:
+            for pid, other in self._cells.get(cell, ()):
+                if (abs(other[0] - pk[0]) <= eps
+                        and abs(other[1] - pk[1]) <= eps
+                        and abs(other[2] - pk[2]) <= eps):
+                    self.num_welded += 1
+                    self._pt_lookup[pk] = pid
+                    return pid
+        pid = self._pt_lookup[pk] = self._points.append(pk)
+        self._cells.setdefault(cells[0], []).append((pid, pk))
+        return pid
+
+    def _weld_cells(self, pk):
+        # type: (Tuple[float, ...]) -> List[Tuple[int, int, int]]
+        """
+        Return the grid cell of `pk` followed by the neighbouring cells that
+        can hold points within `weld_eps`.
+        """
+        axes = []
+        for c in pk:
+            q = c / (2 * self._weld_eps)
+            i = floor(q)
+            axes.append((i, i - 1) if q - i < 0.5 else (i, i + 1))
+        return list(product(*axes))
+
+    def add_triangle(self, va, vb, vc):
+        self._trs.append((va, vb, vc))
+
+    def add_triangles(self, triangles):
+        # type: (np.ndarray) -> None
+        """Bulk version of add_triangle for (m, 3) vertex ids."""
+        self._trs.extend(np.asarray(triangles, np.int32).reshape(-1, 3))
+
+    def get_point(self, vid):
+        # type: (int) -> np.ndarray
+        return self._points.data[self._vpt.data[vid]]
+
+    def __getitem__(self, item):
+        if 0 <= item < len(self._vpt):
+            return ArrayVertex(self, item)
+        raise IndexError
+
+
+WeldStats = namedtuple('WeldStats', 'points welded vertices')
+
+
+def concatenate(meshes, name='noname', weld=False, weld_eps=None):
+    # type: (List[ArrayMesh], str, bool, Optional[float]) -> ArrayMesh
+    """
+    Return a new ArrayMesh holding all triangles of `meshes`.
+
+    Args:
+        meshes: ArrayMesh parts, e.g. copies placed with ArrayMesh.transform
+        name: name of the new mesh
+        weld: deduplicate the vertices shared between parts (see
+            ArrayMesh.extend), otherwise the parts are appended as they are
+        weld_eps: welding tolerance, implies `weld`
+    """
+    msh = ArrayMesh(name, weld_eps)
+    for part in meshes:
+        if weld or weld_eps is not None:
+            msh.extend(part)
+        else:
+            msh.append(part)
+    return msh
+
+
+def _unique_rows(a):
+    # type: (np.ndarray) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Return a 2-tuple (first, inverse) for the unique rows of the 2D array
+    `a`, where `first` holds the index of the first occurrence of each unique
+    row in order of appearance and `a[first][inverse]` reconstructs `a`.
+    """
+    if not len(a):
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    # constant columns (e.g. a uniform color) don't need to be sorted
+    a = a[:, (a != a[:1]).any(axis=0)]
+    if not a.shape[1]:
+        return np.zeros(1, np.int64), np.zeros(len(a), np.int64)
+    keys = _row_keys(a)
+    if len(keys) == 1:
+        order = np.argsort(keys[0], kind='stable')
+    else:
+        order = np.lexsort(keys[::-1])
+    is_first = np.ones(len(a), bool)
+    is_first[1:] = np.logical_or.reduce(
+        [k[order][1:] != k[order][:-1] for k in keys]
+    )
+    group = np.cumsum(is_first) - 1
+    # the sort is stable, so the first row of every group comes first
+    group_first = order[is_first]
+    by_appearance = np.argsort(group_first)
+    rank = np.empty_like(by_appearance)
+    rank[by_appearance] = np.arange(len(by_appearance))
+    inv = np.empty(len(a), np.int64)
+    inv[order] = rank[group]
+    return group_first[by_appearance], inv
+
+
+def _vertex_rows(pids, colors, texcoords):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Return (point id, color, uv) rows as uint32 bit patterns, for
+    _unique_rows. -0.0 is mapped to 0.0 like in the tuple lookups.
+    """
+    floats = np.hstack((colors, texcoords)).astype(np.float32) + np.float32(0)
+    return np.hstack((pids[:, None].astype(np.uint32), floats.view(np.uint32)))
+
+
+def _row_keys(a):
+    # type: (np.ndarray) -> List[np.ndarray]
+    """
+    Return uint64 sort keys whose equality matches row equality of `a`. Bit
+    patterns of 32 bit columns are packed pairwise, -0.0 is mapped to 0.0.
+    """
+    if a.dtype.kind == 'f':
+        a = a + a.dtype.type(0)
+    a = np.ascontiguousarray(a)
+    if a.dtype.itemsize == 8:
+        bits = a.view(np.uint64)
+        return [bits[:, i] for i in range(a.shape[1])]
+    bits = a.astype(a.dtype.newbyteorder('=')).view(
+        {1: np.uint8, 2: np.uint16, 4: np.uint32}[a.dtype.itemsize]
+    ).astype(np.uint64)
+    keys = [bits[:, i] for i in range(a.shape[1])]
+    return [
+        keys[i] << np.uint64(32) | keys[i + 1] if i + 1 < len(keys) else keys[i]
+        for i in range(0, len(keys), 2)
+    ]
+
+
+def _lookup_or_insert(lookup, keys, start):
+    # type: (dict, list, int) -> np.ndarray
+    """
+    Return the ids of `keys` in `lookup`, inserting missing keys with
+    consecutive ids beginning at `start`.
+    """
+    ids = np.array([lookup.get(k, -1) for k in keys], np.int32)
+    new = np.flatnonzero(ids < 0)
+    ids[new] = np.arange(start, start + len(new))
+    lookup.update(zip([keys[i] for i in new.tolist()], ids[new].tolist()))
+    return ids
+
+
+class ArrayVertex(object):
+    """Read only view of a single ArrayMesh vertex."""
+    __slots__ = ('_m', '_vid')
+
+    def __init__(self, mesh, vid):
+        self._m = mesh      # type: ArrayMesh
+        self._vid = vid
+
+    @property
+    def vid(self):
+        return self._vid
+
+    @property
+    def point(self):
+        return core.Point3(*self._m.get_point(self._vid))
+
+    @property
+    def color(self):
+        return core.Vec4(*self._m.colors[self._vid])
+
+    @property
+    def texcoord(self):
+        return core.Vec2(*self._m.texcoords[self._vid])
+
+
 class Point(object):
+    __slots__ = ('_point', '_m', '_vts')
+
     def __init__(self, point, mesh):
         self._point = point
         self._m = mesh          # type: Mesh
@@ -367,6 +946,17 @@ class Point(object):
 
 
 class Vertex(object):
+    __slots__ = (
+        '_vid',
+        '_point',
+        '_color',
+        '_texcoord',
+        '_trs',
+        '_normal',
+        '_tangent',
+        '_bitangent'
+    )
+
     def __init__(self, vid, point, color=core.Vec4(1), texcoord=core.Vec2(0)):
         self._vid = vid
         self._point = point
@@ -374,8 +964,9 @@ class Vertex(object):
         self._texcoord = texcoord
         self._trs = []
         self._normal = None
-        self._tangent = core.Vec3(0)
-        self._bitangent = core.Vec3(0)
+        # tangent space is only allocated when first accessed
+        self._tangent = None
+        self._bitangent = None
 
     def add_triangle(self, triangle):
         self._trs.append(triangle)
@@ -407,6 +998,8 @@ class Vertex(object):
 
     @property
     def tangent(self):
+        if self._tangent is None:
+            self._tangent = core.Vec3(0)
         return self._tangent
 
     @tangent.setter
@@ -415,6 +1008,8 @@ class Vertex(object):
 
     @property
     def bitangent(self):
+        if self._bitangent is None:
+            self._bitangent = core.Vec3(0)
         return self._bitangent
 
     @bitangent.setter
@@ -439,6 +1034,8 @@ class Vertex(object):
 
 
 class Triangle(object):
+    __slots__ = ('_va', '_vb', '_vc', '_normal_mag', '_normal')
+
     def __init__(self, va, vb, vc):
         self._va = va
         self._vb = vb
@@ -452,10 +1049,12 @@ class Triangle(object):
             vc.point,
             False
         )
-        self._normal = self._normal_mag.normalized()
+        self._normal = None
 
     @property
     def normal(self):
+        if self._normal is None:
+            self._normal = self._normal_mag.normalized()
         return self._normal
 
     @property
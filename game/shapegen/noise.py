@@ -26,26 +26,102 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from collections import OrderedDict
+import os
+import threading
+from typing import List
 from typing import Union
 import random
 
 import numpy as np
-from panda3d import core
+from numpy.lib.stride_tricks import as_strided
 import pyfastnoisesimd as fns
 from PIL import Image
 
 from .. import common
+from . import scatter
 from . import sdf
 
 
+class NoisePool(object):
+    """
+    Configured fns.Noise generators, keyed by the frozen tuple of their
+    parameters and reused across calls instead of constructing and setting
+    up a new one every time. The seed is set per call. Every thread has its
+    own generators, the least recently used ones are dropped beyond
+    `max_size`.
+
+    Args:
+        num_workers: threads pyfastnoisesimd splits large requests across,
+            None for os.cpu_count()
+        max_size: generators kept per thread
+    """
+    def __init__(
+            self,
+            num_workers=common.NOISE_WORKERS,
+            max_size=common.NOISE_POOL_SIZE
+    ):
+        # type: (Union[int, None], int) -> None
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_size = max_size
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, params, seed):
+        # type: (tuple, int) -> fns.Noise
+        """
+        Return a generator configured with `params` (the arguments of
+        Noise.setup_fns in order, without seed) and `seed`.
+        """
+        generators = self._generators()
+        generator = generators.get(params)
+        if generator is None:
+            self.misses += 1
+            generator = fns.Noise(seed, self.num_workers)
+            _configure(generator, *params)
+            generators[params] = generator
+            if len(generators) > self.max_size:
+                generators.popitem(last=False)
+        else:
+            self.hits += 1
+            generators.move_to_end(params)
+            generator.seed = seed
+        return generator
+
+    def clear(self):
+        """Drop the generators of the calling thread."""
+        self._generators().clear()
+
+    def _generators(self):
+        # type: () -> OrderedDict
+        try:
+            return self._local.generators
+        except AttributeError:
+            self._local.generators = OrderedDict()
+            return self._local.generators
+
+
+noise_pool = NoisePool()
+
+
 class Noise(object):
     def __init__(self, seed=None):
         self.seed = seed
         self.fns = None     # type: Union[fns.Noise, None]
-        sl = common.T_XY + common.T_XY % 2
+        sl = simd_size(common.T_XY)
         self.terrain_grid = [1, sl, sl]
 
     def blob(self, xy, z, dim=1, r=None, seed=None, freq=0.001):
+        # type: (int, int, int, float, int, float) -> np.ndarray
+        """
+        Return noise sampled on `dim` cylinders of `z` rings with `xy` points
+        each, as a read only (dim, z, xy) float32 view of the generated array.
+
+        Cylinder `d` starts at offset d * z of the generated array, so the
+        cylinders overlap and later ones overwrite the coordinates of earlier
+        ones, like the original layout did; the view reproduces that.
+        """
         twopi = np.linspace(-np.pi, np.pi, xy, endpoint=False)
         r = r or np.sqrt(((xy / 2) ** 2) * 2)
         step = 2 * np.pi * r / xy
@@ -57,24 +133,20 @@ class Noise(object):
             frequency=freq,
             seed=seed
         )
-        coord = fns.empty_coords(dim * z * xy)
+        size = z * xy
+        n = (dim - 1) * z + size
+        coord = fns.empty_coords(n)
+        coord[:, n:] = 0    # SIMD padding
         for d in range(dim):
             ds = d * z
-            for zi in range(z):
-                zs = zi * xy + ds
-                ro = d * r * 3
-                coord[0, zs:zs + xy] = x_mesh + ro
-                coord[1, zs:zs + xy] = y_mesh + ro
-                coord[2, zs:zs + xy] = z_mesh[zi]
+            ro = d * r * 3
+            coord[0, ds:ds + size].reshape(z, xy)[:] = x_mesh + ro
+            coord[1, ds:ds + size].reshape(z, xy)[:] = y_mesh + ro
+            coord[2, ds:ds + size].reshape(z, xy)[:] = z_mesh[:, None]
         a = self.fns.genFromCoords(coord)
-        res = []
-        for d in range(dim):
-            ds = d * z
-            res.append([])
-            for zi in range(z):
-                zs = zi * xy + ds
-                res[-1].append(a[zs:zs + xy])
-        return res
+        item = a.itemsize
+        return as_strided(a, (dim, z, xy), (z * item, xy * item, item),
+                          writeable=False)
 
     def woods(self):
         self.setup_fns(
@@ -86,7 +158,14 @@ class Noise(object):
         c = self.fns.genAsGrid(self.terrain_grid)[0]
         c = c[:common.T_XY, :common.T_XY]
         c = (common.W_CELL_TYPE_COUNT - 1) / (c.max() - c.min()) * (c - c.min())
-        self.fns.cell.returnType = fns.CellularReturnType.Distance2Div
+        # pooled generators must not be reconfigured, get a second one
+        self.setup_fns(
+            noise_type=common.WN_TYPE,
+            cell_distance_func=common.WN_DIST_FUNC,
+            cell_return_type=fns.CellularReturnType.Distance2Div,
+            fractal_octaves=common.WN_FRACTAL_OCT,
+            seed=self.fns.seed
+        )
         b = self.fns.genAsGrid(self.terrain_grid)[0]
         b = b[:common.T_XY, :common.T_XY]
         b = 1 / (b.max() - b.min()) * (b - b.min())
@@ -104,29 +183,22 @@ class Noise(object):
         fltr[b] = 0
         fltr[sdf.circle(fltr.shape, 120)] = 0
         obelisk_circle = sdf.circle((30, 30), 15)
-        obelisk_coordinates = [(825, 825)]
-        for i in range(3):
-            while True:
-                cx, cy = 500, 500
-                while 400 < cx < 600 or 400 < cy < 600:
-                    cx, cy = np.random.randint(150, 950, 2)
-                ok = True
-                for x, y in obelisk_coordinates:
-                    d = (core.Vec2(x, y) - core.Vec2(cx, cy)).length()
-                    if d < 140:
-                        ok = False
-                if ok:
-                    if np.sum(fltr[cy - 15:cy + 15, cx - 15:cx + 15]) > 300:
-                        obelisk_coordinates.append((cx, cy))
-                        break
+        obelisk_coordinates = _place_obelisks(fltr)
         for x, y in obelisk_coordinates:
             fltr[y - 15:y + 15, x - 15:x + 15][obelisk_circle] = 0
         # Image.fromarray((fltr * 255).astype(np.uint8)).show()
         # Image.fromarray((b * 255).astype(np.uint8)).show()
         return fltr, b, obelisk_coordinates[1:]
 
-    # noinspection PyArgumentList
     def terrain(self):
+        self.setup_terrain_fns()
+        hf = self.fns.genAsGrid(self.terrain_grid)[0]
+        hf = hf[:common.T_XY, :common.T_XY]
+        hf = 1 / (hf.max() - hf.min()) * (hf - hf.min())
+        return hf
+
+    # noinspection PyArgumentList
+    def setup_terrain_fns(self):
         self.setup_fns(
             noise_type=common.N_TYPE,
             frequency=common.N_FREQ,
@@ -140,10 +212,6 @@ class Noise(object):
             perturb_lacunarity=common.N_PERT_LAC,
             perturb_gain=common.N_PERT_GAIN
         )
-        hf = self.fns.genAsGrid(self.terrain_grid)[0]
-        hf = hf[:common.T_XY, :common.T_XY]
-        hf = 1 / (hf.max() - hf.min()) * (hf - hf.min())
-        return hf
 
     # noinspection DuplicatedCode
     def setup_fns(
@@ -169,26 +237,110 @@ class Noise(object):
             cell_return_type=fns.CellularReturnType.Distance,
             seed=None
     ):
-        self.fns = fns.Noise(seed or self.seed)
-        self.fns.noiseType = noise_type
-        self.fns.frequency = frequency
-        self.fns.fractal.fractalType = fractal_type
-        self.fns.fractal.octaves = fractal_octaves
-        self.fns.fractal.gain = fractal_gain
-        self.fns.fractal.lacunarity = fractal_lacunarity
-        self.fns.perturb.perturbType = perturb_type
-        self.fns.perturb.octaves = perturb_octaves
-        self.fns.perturb.frequency = perturb_frequency
-        self.fns.perturb.amp = perturb_amp
-        self.fns.perturb.gain = perturb_gain
-        self.fns.perturb.lacunarity = perturb_lacunarity
-        self.fns.perturb.normaliseLength = perturb_normalise_length
-        self.fns.cell.distanceFunc = cell_distance_func
-        self.fns.cell.distanceIndices = cell_distance_indices
-        self.fns.cell.jitter = cell_jitter
-        self.fns.cell.lookupFrequency = cell_lookup_frequency
-        self.fns.cell.noiseLookupType = cell_noise_lookup_type
-        self.fns.cell.returnType = cell_return_type
+        """
+        Point `fns` to a generator from `noise_pool` with these parameters.
+        Without a seed (here or on the instance) a random one is drawn from
+        `np.random`, like fns.Noise does.
+        """
+        seed = seed if seed is not None else self.seed
+        if seed is None:
+            seed = np.random.randint(-2147483648, 2147483647)
+        self.fns = noise_pool.get(
+            (
+                noise_type,
+                frequency,
+                fractal_type,
+                fractal_octaves,
+                fractal_gain,
+                fractal_lacunarity,
+                perturb_type,
+                perturb_octaves,
+                perturb_frequency,
+                perturb_amp,
+                perturb_gain,
+                perturb_lacunarity,
+                perturb_normalise_length,
+                cell_distance_func,
+                tuple(cell_distance_indices),
+                cell_jitter,
+                cell_lookup_frequency,
+                cell_noise_lookup_type,
+                cell_return_type
+            ),
+            seed
+        )
+
+
+def _place_obelisks(fltr):
+    # type: (np.ndarray) -> List[scatter.Site]
+    """
+    Return the fixed obelisk site followed by three random ones in 150..949,
+    outside the center box, 140 apart and in dense woods of `fltr`. If no
+    dense enough patch is left, the densest woods are taken instead.
+    """
+    xy = np.arange(fltr.shape[0])
+    outer = (xy >= 150) & (xy < 950) & ((xy <= 400) | (xy >= 600))
+    sites = scatter.Scatter(outer[:, None] & outer[None, :], reach=140)
+    sites.add(825, 825)
+    density = scatter.window_sums(fltr, 30)
+    for _ in range(3):
+        if sites.sample(140, density > 300) is None:
+            sites.best(density, 140)
+    return sites.sites
+
+
+# noinspection DuplicatedCode
+def _configure(
+        generator,
+        noise_type,
+        frequency,
+        fractal_type,
+        fractal_octaves,
+        fractal_gain,
+        fractal_lacunarity,
+        perturb_type,
+        perturb_octaves,
+        perturb_frequency,
+        perturb_amp,
+        perturb_gain,
+        perturb_lacunarity,
+        perturb_normalise_length,
+        cell_distance_func,
+        cell_distance_indices,
+        cell_jitter,
+        cell_lookup_frequency,
+        cell_noise_lookup_type,
+        cell_return_type
+):
+    generator.noiseType = noise_type
+    generator.frequency = frequency
+    generator.fractal.fractalType = fractal_type
+    generator.fractal.octaves = fractal_octaves
+    generator.fractal.gain = fractal_gain
+    generator.fractal.lacunarity = fractal_lacunarity
+    generator.perturb.perturbType = perturb_type
+    generator.perturb.octaves = perturb_octaves
+    generator.perturb.frequency = perturb_frequency
+    generator.perturb.amp = perturb_amp
+    generator.perturb.gain = perturb_gain
+    generator.perturb.lacunarity = perturb_lacunarity
+    generator.perturb.normaliseLength = perturb_normalise_length
+    generator.cell.distanceFunc = cell_distance_func
+    generator.cell.distanceIndices = cell_distance_indices
+    generator.cell.jitter = cell_jitter
+    generator.cell.lookupFrequency = cell_lookup_frequency
+    generator.cell.noiseLookupType = cell_noise_lookup_type
+    generator.cell.returnType = cell_return_type
+
+
+def simd_size(n):
+    # type: (int) -> int
+    """
+    Return `n` rounded up to a multiple of 4, so that any grid of such sides
+    holds a multiple of 16 floats, as genAsGrid requires for SIMD widths up
+    to AVX-512.
+    """
+    return -(-n // 4) * 4
 
 
 # noinspection PyArgumentList
@@ -0,0 +1,176 @@
+"""
+Provides vectorized random placement of sites on a grid under spacing and
+density constraints.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from math import ceil
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+Site = Tuple[int, int]
+
+
+class Scatter(object):
+    """
+    Places sites on random cells of a grid, at a minimum distance from all
+    sites placed before. The distance of every cell to the nearest site is
+    kept as a distance field that is updated as sites are added, so valid
+    cells are found by masking instead of trying random cells until one
+    fits, and sampling takes bounded time. Cells are drawn uniformly among
+    the valid ones using `np.random`, which gives the same distribution as
+    rejection sampling would.
+
+    Args:
+        allowed: bool mask [y, x] of the cells sites may be placed on
+        reach: largest `min_distance` that will be asked for, the distance
+            field is only maintained up to it. None for no limit.
+    """
+    def __init__(self, allowed, reach=None):
+        # type: (np.ndarray, Optional[float]) -> None
+        self.allowed = np.array(allowed, dtype=bool)
+        self.reach = reach
+        self.distance = np.full(self.allowed.shape, np.inf, np.float32)
+        self.sites = []     # type: List[Site]
+
+    def add(self, x, y):
+        # type: (int, int) -> None
+        """Add a site at cell `x`, `y`, e.g. one that is placed upfront."""
+        h, w = self.distance.shape
+        if self.reach is None:
+            y0, y1, x0, x1 = 0, h, 0, w
+        else:
+            r = int(ceil(self.reach))
+            y0, y1 = max(0, y - r), min(h, y + r + 1)
+            x0, x1 = max(0, x - r), min(w, x + r + 1)
+        dx = np.arange(x0 - x, x1 - x)
+        dy = np.arange(y0 - y, y1 - y)[:, None]
+        window = self.distance[y0:y1, x0:x1]
+        np.minimum(window, np.hypot(dx, dy), out=window)
+        self.sites.append((x, y))
+
+    def candidates(self, min_distance=0.0, mask=None):
+        # type: (float, Optional[np.ndarray]) -> np.ndarray
+        """
+        Return the bool mask of allowed cells at least `min_distance` away
+        from all sites, further restricted to `mask` if given.
+        """
+        if self.reach is not None and min_distance > self.reach:
+            raise ValueError(f'min_distance exceeds reach of {self.reach}')
+        valid = self.allowed & (self.distance >= min_distance)
+        if mask is not None:
+            valid &= mask
+        return valid
+
+    def sample(self, min_distance=0.0, mask=None):
+        # type: (float, Optional[np.ndarray]) -> Optional[Site]
+        """
+        Add a site on a random cell of `candidates(min_distance, mask)` and
+        return it, None if there is no such cell.
+        """
+        cells = np.flatnonzero(self.candidates(min_distance, mask))
+        if not cells.size:
+            return None
+        return self._place(cells[np.random.randint(cells.size)])
+
+    def best(self, score, min_distance=0.0, mask=None):
+        # type: (np.ndarray, float, Optional[np.ndarray]) -> Optional[Site]
+        """
+        Like `sample`, but add the site on the candidate cell with the
+        highest `score` (first in row-major order on ties).
+        """
+        valid = self.candidates(min_distance, mask)
+        if not valid.any():
+            return None
+        return self._place(np.argmax(np.where(valid, score, -np.inf)))
+
+    def scatter(self, count, min_distance=0.0, mask=None):
+        # type: (int, float, Optional[np.ndarray]) -> List[Site]
+        """
+        Sample up to `count` sites, fewer if the candidates run out first.
+        """
+        sites = []
+        for _ in range(count):
+            site = self.sample(min_distance, mask)
+            if site is None:
+                break
+            sites.append(site)
+        return sites
+
+    def fill(self, min_distance, mask=None):
+        # type: (float, Optional[np.ndarray]) -> List[Site]
+        """
+        Add sites until no cell of `candidates(min_distance, mask)` is left
+        and return them. The candidates are visited once in random order and
+        taken if still far enough from all sites, which is the same as
+        calling `sample` until it returns None but does not rebuild the
+        candidate mask for every site.
+        """
+        if self.reach is None or min_distance > self.reach:
+            raise ValueError('fill needs a reach of at least min_distance')
+        cells = np.flatnonzero(self.candidates(min_distance, mask))
+        np.random.shuffle(cells)
+        distance = self.distance.reshape(-1)
+        sites = []
+        i = 0
+        while i < cells.size:
+            # look ahead in blocks for the next cell that is still valid
+            block = cells[i:i + 1024]
+            valid = np.flatnonzero(distance[block] >= min_distance)
+            if not valid.size:
+                i += block.size
+                continue
+            sites.append(self._place(block[valid[0]]))
+            i += int(valid[0]) + 1
+        return sites
+
+    def _place(self, cell):
+        # type: (int) -> Site
+        y, x = divmod(int(cell), self.distance.shape[1])
+        self.add(x, y)
+        return x, y
+
+
+def window_sums(field, size):
+    # type: (np.ndarray, int) -> np.ndarray
+    """
+    Return the sum of `field` over the `size` x `size` window around every
+    cell, from a summed-area table. The window at [y, x] covers rows
+    y - size // 2 .. y - size // 2 + size - 1 (and columns alike), clipped
+    at the borders.
+    """
+    half = size // 2
+    dtype = np.result_type(field.dtype, np.int64)
+    # zero padding clips the windows, the leading zero row/column of the
+    # table makes every window sum a difference of four shifted slices
+    sat = np.pad(field.astype(dtype), ((half + 1, size - half - 1),) * 2)
+    np.cumsum(sat, 0, out=sat)
+    np.cumsum(sat, 1, out=sat)
+    return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] \
+        + sat[:-size, :-size]
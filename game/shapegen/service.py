@@ -0,0 +1,479 @@
+"""
+Provides a process pool service that generates models in worker processes
+and ships their vertex and index arrays back through shared memory, and a
+thread pool loader that streams models in while the game is running.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import multiprocessing
+import os
+import queue
+from concurrent import futures
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import numpy as np
+from panda3d import core
+
+from . import cache
+from .. import common
+
+ALIGNMENT = 16
+
+
+class GenerationService(object):
+    """
+    Farms model generators out to a pool of worker processes. A worker calls
+    the generator, moves the vertex and index arrays of all indexed triangle
+    Geoms of the result into one shared memory block and returns the node
+    hierarchy without them (as .bam). The Geoms are then assembled on the
+    main thread by Job.result.
+
+    Generators have to be picklable, i.e. module level functions like the
+    ones in modelgen, and return a NodePath or PandaNode, optionally
+    followed by picklable extra values in a tuple.
+
+    The worker processes are only started once `min_jobs` generators are
+    waiting for them, a few models are generated faster inline than it
+    takes to spawn a worker. Jobs that are still waiting when their result
+    is asked for run inline on the calling thread.
+
+    Args:
+        num_workers: number of worker processes, default os.cpu_count() or 0
+            on a single core, where a worker process only adds overhead.
+            With 0 generators run inline on the calling thread.
+        min_jobs: number of waiting jobs that starts the worker processes
+    """
+    def __init__(
+            self,
+            num_workers=common.GEN_WORKERS,
+            min_jobs=common.GEN_MIN_JOBS
+    ):
+        # type: (Optional[int], int) -> None
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+            if num_workers == 1:
+                num_workers = 0
+        self.num_workers = num_workers
+        self.min_jobs = min_jobs
+        self._pool = None
+        self._jobs = []     # type: List[Job]
+        self._waiting = []  # type: List[Job]
+
+    @property
+    def started(self):
+        # type: () -> bool
+        """Whether the worker processes were started."""
+        return self._pool is not None
+
+    def submit(self, func, *args, seed=None, **kwargs):
+        # type: (Callable, Any, Optional[int], Any) -> Job
+        """
+        Schedule `func(*args, **kwargs)`, with `random` and `np.random`
+        seeded with `seed` if given (see cache.seeded).
+        """
+        job = Job(call=(func, args, kwargs, seed))
+        if not self.num_workers:
+            return job
+        # keep unassembled jobs, their shared memory is released on shutdown
+        self._jobs = [job for job in self._jobs if not job.assembled()]
+        self._jobs.append(job)
+        if self._pool is None:
+            self._waiting = [job for job in self._waiting if job.waiting()]
+            self._waiting.append(job)
+            if len(self._waiting) < self.min_jobs:
+                return job
+            self._start()
+            for waiting in self._waiting:
+                waiting.start(self._pool)
+            self._waiting = []
+        else:
+            job.start(self._pool)
+        return job
+
+    def map(self, func, seeds, *args, **kwargs):
+        # type: (Callable, List[Optional[int]], Any, Any) -> List[Job]
+        """Submit `func` once per seed in `seeds`."""
+        return [
+            self.submit(func, *args, seed=seed, **kwargs) for seed in seeds
+        ]
+
+    def warm_up(self):
+        """Start all worker processes, they are spawned lazily otherwise."""
+        if self.num_workers:
+            if self._pool is None:
+                self._start()
+            for job in [self._pool.submit(os.getpid)
+                        for _ in range(self.num_workers)]:
+                job.result()
+
+    def shutdown(self):
+        """
+        Wait for the workers to finish and release the shared memory of
+        all results that were never assembled.
+        """
+        # waiting jobs can still run inline
+        for job in self._jobs:
+            if not job.waiting():
+                job.discard()
+        self._jobs = []
+        self._waiting = []
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _start(self):
+        # spawn, forking a process with an open window is not safe
+        self._pool = futures.ProcessPoolExecutor(
+            self.num_workers,
+            multiprocessing.get_context('spawn')
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+class Job(object):
+    """Handle of a submitted generator, see GenerationService.submit."""
+    __slots__ = ('_future', '_call', '_value', '_done', '_callbacks')
+
+    def __init__(self, future=None, value=None, call=None):
+        # type: (Optional[futures.Future], Any, Optional[tuple]) -> None
+        self._future = future
+        self._call = call
+        self._value = value
+        self._done = future is None and call is None
+        self._callbacks = []
+
+    def done(self):
+        # type: () -> bool
+        """Whether result() returns without waiting for a worker."""
+        return self._future is None or self._future.done()
+
+    def waiting(self):
+        # type: () -> bool
+        """Whether the job neither went to a worker nor ran inline yet."""
+        return self._call is not None
+
+    def assembled(self):
+        # type: () -> bool
+        """Whether the result was assembled or discarded."""
+        return self._done
+
+    def start(self, pool):
+        # type: (futures.ProcessPoolExecutor) -> None
+        """Hand a waiting job to the worker processes of `pool`."""
+        self._future = pool.submit(_generate, *self._call)
+        self._call = None
+
+    def then(self, callback):
+        # type: (Callable[[Any], None]) -> Job
+        """
+        Call `callback` with the result once it is assembled, immediately if
+        it already is. Returns the Job to allow chaining.
+        """
+        if self._done:
+            callback(self._value)
+        else:
+            self._callbacks.append(callback)
+        return self
+
+    def result(self):
+        """
+        Return the result of the generator, assembling its Geoms on the
+        calling thread (which should be the main thread). A job that is
+        still waiting for the worker processes runs inline instead.
+        """
+        if not self._done:
+            if self._call is not None:
+                func, args, kwargs, seed = self._call
+                self._value = cache.seeded(seed, func, *args, **kwargs)
+            else:
+                self._value = _assemble(self._future.result())
+            self._done = True
+            self._future = None
+            self._call = None
+            for callback in self._callbacks:
+                callback(self._value)
+            self._callbacks = None
+        return self._value
+
+    def discard(self):
+        """
+        Drop an unassembled result and unlink its shared memory. Pending
+        callbacks are not called.
+        """
+        future, self._future = self._future, None
+        self._call = None
+        self._done = True
+        self._callbacks = None
+        if future is None or future.cancel():
+            return
+        try:
+            packed = future.result()
+        except Exception:   # nothing was shipped
+            return
+        if packed['shm'] is not None:
+            _unlink(packed['shm'])
+
+
+class ThreadedLoader(object):
+    """
+    Runs model generators on a thread pool and hands the finished results
+    to callbacks on the main thread, from a task of the Panda3D task
+    manager. Unlike GenerationService there are no restrictions on the
+    generators, but they share the GIL with the main thread: they don't
+    finish sooner, they just don't block the frames in the meantime. They
+    also share the global RNG with it, so seeded generators on a loader
+    thread have to draw from a local one (see cache.local_rng).
+
+    Args:
+        task_mgr: the task manager that runs the delivery task
+        num_workers: number of threads
+        per_frame: maximum number of callbacks per frame
+    """
+    def __init__(
+            self,
+            task_mgr,
+            num_workers=common.LOADER_THREADS,
+            per_frame=common.LOADER_PER_FRAME
+    ):
+        # type: (Any, int, int) -> None
+        self._task_mgr = task_mgr
+        self._pool = futures.ThreadPoolExecutor(num_workers, 'loader')
+        self._finished = queue.SimpleQueue()
+        self._pending = 0
+        self._task = None
+        self.per_frame = per_frame
+
+    @property
+    def pending(self):
+        # type: () -> int
+        """Number of results not yet handed to their callback."""
+        return self._pending
+
+    def load(self, func, *args, callback, **kwargs):
+        # type: (Callable, Any, Callable[[Any], None], Any) -> futures.Future
+        """
+        Call `func(*args, **kwargs)` on a worker thread and, on a later
+        frame, `callback` with its result on the main thread. Exceptions of
+        `func` are raised on the main thread, from the delivery task.
+        """
+        future = self._pool.submit(func, *args, **kwargs)
+        self._pending += 1
+        future.add_done_callback(
+            lambda f: self._finished.put((f, callback))
+        )
+        if self._task is None:
+            self._task = self._task_mgr.add(self._deliver, 'threaded_loader')
+        return future
+
+    def shutdown(self):
+        """Drop pending results and stop the threads."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._task is not None:
+            self._task_mgr.remove(self._task)
+            self._task = None
+        self._pending = 0
+
+    def _deliver(self, task):
+        for _ in range(self.per_frame):
+            try:
+                future, callback = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if not future.cancelled():
+                callback(future.result())
+        if self._pending:
+            return task.cont
+        self._task = None
+        return task.done
+
+
+def _geom_node_paths(node_path):
+    # type: (core.NodePath) -> List[core.NodePath]
+    """Return `node_path` and all descendants that are GeomNodes, in order."""
+    node_paths = list(node_path.find_all_matches('**/+GeomNode'))
+    if node_path.node().is_geom_node():
+        node_paths.insert(0, node_path)
+    return node_paths
+
+
+def _shippable(geom):
+    # type: (core.Geom) -> bool
+    if geom.get_num_primitives() != 1:
+        return False
+    prim = geom.get_primitive(0)
+    return isinstance(prim, core.GeomTriangles) and prim.is_indexed()
+
+
+def _generate(func, args, kwargs, seed):
+    """Worker side: run the generator and pack its result."""
+    result = cache.seeded(seed, func, *args, **kwargs)
+    extras = None
+    if isinstance(result, tuple):
+        result, extras = result[0], result[1:]
+    is_node_path = isinstance(result, core.NodePath)
+    node_path = result if is_node_path else core.NodePath(result)
+
+    buffers, geoms = [], []
+    for node_i, gnp in enumerate(_geom_node_paths(node_path)):
+        gnode = gnp.node()
+        for geom_i in range(gnode.get_num_geoms()):
+            geom = gnode.get_geom(geom_i)
+            if not _shippable(geom):
+                continue    # travels inside the .bam
+            vdata = geom.get_vertex_data()
+            prim = geom.get_primitive(0)
+            arrays = [
+                memoryview(vdata.get_array(j))
+                for j in range(vdata.get_num_arrays())
+            ]
+            index = memoryview(prim.get_vertices())
+            geoms.append((
+                node_i,
+                geom_i,
+                vdata.get_num_rows(),
+                list(range(len(buffers), len(buffers) + len(arrays))),
+                len(buffers) + len(arrays),
+                prim.get_index_type(),
+                prim.get_num_vertices()
+            ))
+            buffers += arrays + [index]
+            # keep the format and state, drop the rows
+            gnode.set_geom(geom_i, core.Geom(core.GeomVertexData(
+                vdata.get_name(),
+                vdata.get_format(),
+                vdata.get_usage_hint()
+            )))
+
+    offsets = [0]
+    for buf in buffers:
+        offsets.append(-(-(offsets[-1] + buf.nbytes) // ALIGNMENT) * ALIGNMENT)
+    skeleton = node_path.encode_to_bam_stream()
+    shm_name = None
+    if buffers:
+        shm = _create_shared_memory(max(1, offsets[-1]))
+        try:
+            target = np.frombuffer(shm.buf, np.uint8)
+            for buf, offset in zip(buffers, offsets):
+                target[offset:offset + buf.nbytes] = np.frombuffer(
+                    buf,
+                    np.uint8
+                )
+            del target
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        shm_name = shm.name
+        shm.close()
+    spans = [(o, b.nbytes) for o, b in zip(offsets, buffers)]
+    return {
+        'skeleton': skeleton,
+        'node_path': is_node_path,
+        'extras': extras,
+        'shm': shm_name,
+        'spans': spans,
+        'geoms': geoms
+    }
+
+
+def _create_shared_memory(size):
+    # type: (int) -> shared_memory.SharedMemory
+    """
+    Return a new shared memory block that the worker does not track, the
+    main process unlinks it after assembly.
+    """
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:   # Python < 3.13
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        # noinspection PyProtectedMember
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlink(name):
+    # type: (str) -> None
+    """Unlink the shared memory block `name` of a worker."""
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _assemble(packed):
+    """Main thread side: rebuild the Geoms of a packed result."""
+    node_path = core.NodePath.decode_from_bam_stream(packed['skeleton'])
+    if packed['shm'] is not None:
+        shm = shared_memory.SharedMemory(packed['shm'])
+        try:
+            _fill_geoms(node_path, packed, np.frombuffer(shm.buf, np.uint8))
+        finally:
+            shm.close()
+            shm.unlink()
+    result = node_path if packed['node_path'] else node_path.node()
+    if packed['extras'] is None:
+        return result
+    return (result, ) + tuple(packed['extras'])
+
+
+def _fill_geoms(node_path, packed, data):
+    # type: (core.NodePath, dict, np.ndarray) -> None
+    spans = packed['spans']
+
+    def copy_into(array_data, span):
+        offset, size = spans[span]
+        np.frombuffer(memoryview(array_data), np.uint8)[:] = \
+            data[offset:offset + size]
+
+    gnps = _geom_node_paths(node_path)
+    for node_i, geom_i, rows, arrays, index, index_type, num_index in \
+            packed['geoms']:
+        gnode = gnps[node_i].node()
+        geom = gnode.modify_geom(geom_i)
+        vdata = geom.modify_vertex_data()
+        vdata.unclean_set_num_rows(rows)
+        for j, span in enumerate(arrays):
+            copy_into(vdata.modify_array(j), span)
+        prim = core.GeomTriangles(core.Geom.UH_static)
+        prim.set_index_type(index_type)
+        handle = prim.modify_vertices()
+        handle.unclean_set_num_rows(num_index)
+        copy_into(handle, index)
+        geom.add_primitive(prim)
+        gnode.set_geom(geom_i, geom)
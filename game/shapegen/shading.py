@@ -0,0 +1,401 @@
+"""
+Provides vectorized per vertex shading attributes for indexed meshes.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from math import cos
+from math import radians
+from typing import List
+from typing import Tuple
+
+import numpy as np
+
+
+def normalized(v):
+    # type: (np.ndarray) -> np.ndarray
+    """Return `v` normalized along its last axis, leaving zero vectors."""
+    length = np.sqrt((v * v).sum(axis=-1, keepdims=True))
+    return np.divide(v, length, out=np.zeros_like(v), where=length > 0)
+
+
+def face_normals(points, triangles):
+    # type: (np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Return the non normalized face normals of all triangles. Their length is
+    twice the triangle area.
+
+    Args:
+        points: (n, 3) vertex positions
+        triangles: (m, 3) vertex indices of ccw wound triangles
+    """
+    a = points[triangles[:, 0]]
+    return np.cross(points[triangles[:, 1]] - a, points[triangles[:, 2]] - a)
+
+
+def scatter_add(index, values, size):
+    # type: (np.ndarray, np.ndarray, int) -> np.ndarray
+    """
+    Return the (size, k) sums of the (n, k) `values` rows grouped by `index`.
+    A faster np.add.at for few columns.
+    """
+    return np.stack([
+        np.bincount(index, weights=values[:, i], minlength=size)
+        for i in range(values.shape[1])
+    ], axis=1)
+
+
+def smooth_normals(point_ids, triangles, normal_mag, sharp_angle=80.0):
+    # type: (np.ndarray, np.ndarray, np.ndarray, float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    Return a 3-tuple (vertex ids, triangles, normals) of area weighted vertex
+    normals, where vertices get duplicated along sharp edges. Every output
+    vertex references its source vertex in vertex ids, duplicates are
+    appended after the `len(point_ids)` source vertices and the returned
+    triangles reference the output vertices.
+
+    All triangles around a position form a single smoothing group, unless two
+    of them enclose an angle larger than `sharp_angle`. Only those positions
+    are grouped greedily in triangle order, so the result matches the
+    Mesh._compute_smooth_normals reference implementation.
+
+    The work is done on "entries", one per (position, triangle) pair, sorted
+    by position and then in the order the reference visits the triangles.
+    The entries of a position form a contiguous run.
+
+    Args:
+        point_ids: (n, ) position id of every vertex. Vertices that share a
+            position are smoothed together.
+        triangles: (m, 3) vertex indices
+        normal_mag: (m, 3) non normalized face normals (see face_normals)
+        sharp_angle: angle in degrees at which vertices will be duplicated
+            for sharp edges.
+    """
+    num_vts = len(point_ids)
+    if not len(triangles):
+        return (
+            np.arange(num_vts, dtype=np.int32),
+            triangles.copy(),
+            np.zeros((num_vts, 3), np.float32)
+        )
+    fn = normalized(normal_mag).astype(np.float64)
+    ent_p, ent_t, ent_v = _position_entries(point_ids, triangles)
+    starts = np.flatnonzero(np.diff(ent_p, prepend=-1))
+    sizes = np.diff(np.append(starts, len(ent_p)))
+    group = _smoothing_groups(
+        fn,
+        ent_t,
+        starts,
+        sizes,
+        cos(radians(sharp_angle))
+    )
+
+    # area weighted group normals, summed in triangle order
+    by_group = np.lexsort((np.arange(len(group)), group))
+    group_starts = np.flatnonzero(np.diff(group[by_group], prepend=-1))
+    group_normals = normalized(
+        np.add.reduceat(normal_mag[ent_t[by_group]], group_starts, axis=0)
+    )
+    return _split_vertices(
+        triangles,
+        num_vts,
+        ent_v[by_group],
+        ent_t[by_group],
+        group[by_group],
+        group_normals
+    )
+
+
+def _position_entries(point_ids, triangles):
+    # type: (np.ndarray, np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    Return the 3-tuple (position, triangle, vertex) of all entries, i.e. of
+    every (position, triangle) pair, in the order the reference visits the
+    triangles per position: by vertex id, then triangle id. A triangle that
+    touches a position more than once is kept at its first occurrence but
+    mapped to the last vertex it was seen with, like the reference does.
+    """
+    corner_v = triangles.ravel()
+    corner_t = np.repeat(np.arange(len(triangles)), 3)
+    corner_p = point_ids[corner_v]
+    order = np.lexsort((corner_t, corner_v, corner_p))
+    corner_p, corner_v, corner_t = (
+        corner_p[order], corner_v[order], corner_t[order]
+    )
+    # stable sort by (position, triangle) to find repeated pairs
+    pt_key = corner_p.astype(np.int64) * len(triangles) + corner_t
+    key_order = np.lexsort((np.arange(len(pt_key)), pt_key))
+    first = np.ones(len(pt_key), bool)
+    first[1:] = pt_key[key_order][1:] != pt_key[key_order][:-1]
+    last = np.ones(len(pt_key), bool)
+    last[:-1] = first[1:]
+    keep = np.sort(key_order[first])
+    ent_v = np.empty(len(pt_key), corner_v.dtype)
+    ent_v[key_order[first]] = corner_v[key_order[last]]
+    return corner_p[keep], corner_t[keep], ent_v[keep]
+
+
+def _smoothing_groups(fn, ent_t, starts, sizes, split_cos):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, float) -> np.ndarray
+    """
+    Return the global smoothing group of every entry. Groups are numbered
+    consecutively, position by position.
+
+    Args:
+        fn: (m, 3) unit face normals, zero for degenerate triangles
+        ent_t: triangle of every entry
+        starts: index of the first entry of every position
+        sizes: number of entries of every position
+        split_cos: cosine of the sharp angle
+    """
+    num_ent = len(ent_t)
+    ent_start = np.repeat(starts, sizes)
+    # rank of an entry within its position
+    rank = np.arange(num_ent) - ent_start
+
+    # all pairs (i, j), i < j, of entries of the same position: entry i pairs
+    # with the counts[i] entries after it in its run
+    counts = np.repeat(sizes, sizes) - rank - 1
+    pair_i = np.repeat(np.arange(num_ent), counts)
+    pair_j = pair_i + 1 + (
+        np.arange(len(pair_i)) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    dots = (fn[ent_t[pair_i]] * fn[ent_t[pair_j]]).sum(axis=1)
+    sharp_i = pair_i[dots < split_cos]
+    sharp_j = pair_j[dots < split_cos]
+
+    # local group per position: 0 for all entries of positions without sharp
+    # pairs. Sharp pairs are ordered by position, runs of them start at
+    # sharp_pts and end before sharp_ends.
+    group = np.zeros(num_ent, np.int64)
+    sharp_start = ent_start[sharp_i]
+    sharp_pts = np.flatnonzero(np.diff(sharp_start, prepend=-1))
+    sharp_ends = np.append(sharp_pts[1:], len(sharp_i))
+    if split_cos > 0:
+        only_deg = _degenerate_groups(
+            group,
+            fn,
+            ent_t,
+            starts,
+            sizes,
+            sharp_i,
+            sharp_j,
+            sharp_pts
+        )
+        sharp_pts, sharp_ends = sharp_pts[~only_deg], sharp_ends[~only_deg]
+    for lo, hi in zip(sharp_pts.tolist(), sharp_ends.tolist()):
+        start = int(sharp_start[lo])
+        size = int(sizes[np.searchsorted(starts, start)])
+        conflicts = np.zeros((size, size), bool)
+        conflicts[rank[sharp_i[lo:hi]], rank[sharp_j[lo:hi]]] = True
+        conflicts |= conflicts.T
+        group[start:start + size] = _greedy_groups(_bitmasks(conflicts))
+
+    # offset the local groups of each position past those of the previous
+    group_base = np.zeros(len(starts), np.int64)
+    group_base[1:] = np.cumsum(np.maximum.reduceat(group, starts) + 1)[:-1]
+    return group + np.repeat(group_base, sizes)
+
+
+def _degenerate_groups(
+        group,
+        fn,
+        ent_t,
+        starts,
+        sizes,
+        sharp_i,
+        sharp_j,
+        sharp_pts
+):
+    # type: (...) -> np.ndarray
+    """
+    Fill in the local groups of the positions whose sharp pairs all involve
+    a degenerate triangle (e.g. at the poles of a sphere) and return the
+    bool mask of those positions among `sharp_pts`.
+
+    Only valid for a sharp angle below 90°, where a degenerate triangle
+    (zero normal) conflicts with every triangle. The greedy result is then
+    known without running it: all other triangles share the first group
+    that holds none of the degenerate ones, and every degenerate triangle
+    opens a new group.
+    """
+    if not len(sharp_pts):
+        return np.zeros(0, bool)
+    num_ent = len(ent_t)
+    ent_start = np.repeat(starts, sizes)
+    ent_deg = ~fn.any(axis=1)[ent_t]
+    by_deg = ent_deg[sharp_i] | ent_deg[sharp_j]
+    only_deg = np.logical_and.reduceat(by_deg, sharp_pts)
+    # entries of the positions handled here
+    fast = np.zeros(num_ent, bool)
+    fast[ent_start[sharp_i][sharp_pts[only_deg]]] = True
+    fast = fast[ent_start]
+    # degenerate / other entries before each entry within its position
+    deg_before = np.cumsum(ent_deg) - ent_deg
+    deg_before -= deg_before[ent_start]
+    rest_before = np.cumsum(~ent_deg) - ~ent_deg
+    rest_before -= rest_before[ent_start]
+    # the other triangles join the group opened by the first of them, after
+    # the groups of the degenerate triangles that came before it
+    first_rest = np.where(ent_deg, num_ent, np.arange(num_ent))
+    first_rest = np.minimum.reduceat(first_rest, starts)
+    rest_label = deg_before[np.minimum(first_rest, num_ent - 1)]
+    group[fast] = np.where(
+        ent_deg,
+        deg_before + (rest_before > 0),
+        np.repeat(rest_label, sizes)
+    )[fast]
+    return only_deg
+
+
+def _bitmasks(conflicts):
+    # type: (np.ndarray) -> List[int]
+    """
+    Return the rows of the (k, k) bool `conflicts` matrix as int bitmasks,
+    bit j of row i set if triangle i conflicts with triangle j. Group
+    membership in _greedy_groups is then a single `&` per group.
+    """
+    return [
+        int.from_bytes(row.tobytes(), 'little')
+        for row in np.packbits(conflicts, axis=1, bitorder='little')
+    ]
+
+
+def _greedy_groups(conflicts):
+    """
+    Return the smoothing group index of every triangle around a position. A
+    triangle joins the first group that contains none of the triangles it
+    conflicts with, otherwise it opens a new group.
+
+    Args:
+        conflicts: per triangle bitmask of the conflicting triangles, see
+            _bitmasks
+    """
+    groups = []     # member bitmask per group
+    labels = []
+    for i, conflict in enumerate(conflicts):
+        for gid, members in enumerate(groups):
+            if not members & conflict:
+                groups[gid] = members | 1 << i
+                labels.append(gid)
+                break
+        else:
+            labels.append(len(groups))
+            groups.append(1 << i)
+    return labels
+
+
+def _split_vertices(triangles, num_vts, ent_v, ent_t, ent_g, group_normals):
+    # type: (...) -> Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+    Return the (vertex ids, triangles, normals) of smooth_normals for the
+    entries sorted by group. The first normal of a vertex keeps the vertex,
+    every further distinct normal gets a new vertex, numbered in visiting
+    order.
+    """
+    # identical group normals share a vertex, even across groups
+    _, normal_ids = np.unique(group_normals, axis=0, return_inverse=True)
+    ent_n = normal_ids.reshape(-1)[ent_g]
+    vn_key = ent_v.astype(np.int64) * (ent_n.max() + 1) + ent_n
+    _, vn_first, vn_inv = np.unique(
+        vn_key,
+        return_index=True,
+        return_inverse=True
+    )
+    _, v_first, v_inv = np.unique(
+        ent_v,
+        return_index=True,
+        return_inverse=True
+    )
+    # (vertex, normal) pairs by the first visit of their vertex, then their
+    # own first visit. All but the first pair of a vertex are duplicates.
+    pair_v = ent_v[vn_first]
+    pair_order = np.lexsort((vn_first, v_first[v_inv[vn_first]]))
+    pair_v_sorted = pair_v[pair_order]
+    is_new = np.zeros(len(pair_order), bool)
+    is_new[1:] = pair_v_sorted[1:] == pair_v_sorted[:-1]
+    pair_vid = np.empty(len(pair_order), np.int64)
+    pair_vid[pair_order] = np.where(
+        is_new,
+        num_vts + np.cumsum(is_new) - 1,
+        pair_v_sorted
+    )
+    new_src = pair_v_sorted[is_new]
+
+    vertex_ids = np.concatenate(
+        (np.arange(num_vts), new_src)
+    ).astype(np.int32)
+    normals = np.zeros((len(vertex_ids), 3), np.float32)
+    normals[pair_vid] = group_normals[ent_g[vn_first]]
+
+    # point the triangle corners of duplicated entries to their new vertex
+    out_trs = triangles.copy()
+    ent_vid = pair_vid[vn_inv.reshape(-1)]
+    repl = ent_vid != ent_v
+    col = np.argmax(triangles[ent_t[repl]] == ent_v[repl, None], axis=1)
+    out_trs[ent_t[repl], col] = ent_vid[repl]
+    return vertex_ids, out_trs, normals
+
+
+def tangent_space(points, texcoords, triangles, normals):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Return a 2-tuple (tangents, bitangents) of per vertex unit vectors for
+    normal mapping. Per triangle tangents are accumulated on their vertices,
+    orthogonalized against the vertex normal and the bitangent handedness
+    follows the uv winding, like in Mesh._compute_tangents.
+
+    Args:
+        points: (n, 3) vertex positions
+        texcoords: (n, 2) vertex uv coordinates
+        triangles: (m, 3) vertex indices
+        normals: (n, 3) unit vertex normals
+    """
+    points = np.asarray(points, np.float64)
+    texcoords = np.asarray(texcoords, np.float64)
+    normals = np.asarray(normals, np.float64)
+    p0, uv0 = points[triangles[:, 0]], texcoords[triangles[:, 0]]
+    e1, e2 = points[triangles[:, 1]] - p0, points[triangles[:, 2]] - p0
+    uv1, uv2 = texcoords[triangles[:, 1]] - uv0, texcoords[triangles[:, 2]] - uv0
+    d = uv1[:, 0] * uv2[:, 1] - uv1[:, 1] * uv2[:, 0]
+    r = np.divide(1.0, d, out=np.ones_like(d), where=d != 0)[:, None]
+    face_t = (e1 * uv2[:, 1:] - e2 * uv1[:, 1:]) * r
+    face_b = (e1 * uv2[:, :1] - e2 * uv1[:, :1]) * r
+
+    corners = triangles.ravel()
+    tangents = scatter_add(corners, np.repeat(face_t, 3, axis=0), len(normals))
+    bitangents = scatter_add(
+        corners,
+        np.repeat(face_b, 3, axis=0),
+        len(normals)
+    )
+
+    t = normalized(
+        tangents - normals * (normals * tangents).sum(axis=1, keepdims=True)
+    )
+    b = np.cross(normals, t)
+    flip = (np.cross(normals, tangents) * bitangents).sum(axis=1) > 0
+    b[flip] *= -1
+    return t, normalized(b)
@@ -26,8 +26,19 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from functools import partial
 from math import ceil
 from math import pi
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import numpy as np
@@ -36,14 +47,166 @@ from panda3d import core
 from . import draw
 from . import mesh
 from . import noise
+from . import simplify
+from . import tessellate
 from . import util
 from .. import common
 
+SPHERE_CACHE_SIZE = 128
+
 
 class ShapeGen(object):
-    def __init__(self):
-        self._draw = draw.Draw()
-        self._noise = noise.Noise()
+    def __init__(
+            self,
+            mesh_type=mesh.ArrayMesh,
+            weld_eps=None,
+            lod_levels=1,
+            optimize=False,
+            packed=False,
+            tolerance=None
+    ):
+        """
+        Args:
+            mesh_type: Mesh class used to build the shapes.
+            weld_eps: if set, near duplicate positions within `weld_eps` are
+                welded (requires an ArrayMesh `mesh_type`).
+            lod_levels: if > 1, shapes are returned as LODNode with that many
+                levels (requires an ArrayMesh `mesh_type`).
+            optimize: reorder the exported index and vertex buffers for
+                vertex cache locality (requires an ArrayMesh `mesh_type`).
+            packed: export with the compact util.packed_format (requires an
+                ArrayMesh `mesh_type`).
+            tolerance: if set, the maximum world space chord error of curved
+                surfaces. Segment counts are derived from it and explicit
+                `polygon`/`max_seg_len` arguments become the finest allowed
+                tessellation, see tessellation and shapegen.tessellate.
+        """
+        self._state = _GenState(tolerance)
+        if weld_eps is not None:
+            mesh_type = partial(mesh_type, weld_eps=weld_eps)
+        self._mesh_type = mesh_type
+        self._lod_levels = lod_levels
+        self._optimize = optimize
+        self._packed = packed
+        self._lod_lock = threading.Lock()
+        self.lod_triangles = [0] * lod_levels
+
+    @property
+    def tolerance(self):
+        # type: () -> Optional[float]
+        """Chord error tolerance of the calling thread, see tessellation."""
+        return self._state.tolerance
+
+    @tolerance.setter
+    def tolerance(self, value):
+        # type: (Optional[float]) -> None
+        self._state.tolerance = value
+
+    @contextmanager
+    def tessellation(self, tolerance):
+        # type: (Optional[float]) -> Iterator[None]
+        """
+        Context manager to build shapes with chord error `tolerance`, e.g.
+        `pixel_tolerance(distance)` for a variant seen from `distance`.
+        """
+        tolerance, self.tolerance = self.tolerance, tolerance
+        try:
+            yield
+        finally:
+            self.tolerance = tolerance
+
+    def batch(self, primitives, name='batch'):
+        # type: (Iterable[Primitive], str) -> core.PandaNode
+        """
+        Return a single node with all `primitives`, one Geom per material and
+        export arguments (flat/smooth, nac, ...) instead of one GeomNode per
+        shape. A LODNode with one merged GeomNode per level is returned if
+        LOD is enabled. Requires an ArrayMesh `mesh_type`.
+
+        Args:
+            primitives: Primitive specs, placed by their `transform`
+            name: name of the node
+        """
+        groups = {}     # type: Dict[tuple, Tuple[List[mesh.ArrayMesh], dict]]
+        for prim in primitives:
+            msh, export_args = self._build(prim)
+            key = (prim.material, tuple(sorted(export_args.items())))
+            groups.setdefault(key, ([], export_args))[0].append(msh)
+
+        parts = []      # type: List[Tuple[core.RenderState, List[core.Geom]]]
+        for i, ((material, _), (meshes, export_args)) in enumerate(
+                groups.items()):
+            msh = mesh.concatenate(meshes, f'{name}/{i}')
+            if self._optimize:
+                export_args['optimize'] = True
+            if self._packed:
+                export_args['packed'] = True
+            lod_meshes = simplify.lod_levels(msh, self._lod_levels)
+            for j in range(self._lod_levels):
+                level = lod_meshes[min(j, len(lod_meshes) - 1)]
+                with self._lod_lock:
+                    self.lod_triangles[j] += len(level.triangles)
+            parts.append((
+                _material_state(material),
+                [level.export(**export_args).modify_geom(0)
+                 for level in lod_meshes]
+            ))
+
+        # levels of parts without LOD show the same Geom at every distance
+        children = []
+        for j in range(max([len(geoms) for _, geoms in parts] or [1])):
+            node = core.GeomNode(name)
+            for state, geoms in parts:
+                node.add_geom(geoms[min(j, len(geoms) - 1)], state)
+            children.append(node)
+        if len(children) < 2:
+            return children[0]
+        return simplify.lod_switch(children, f'{name}/lod')
+
+    def _build(self, prim):
+        # type: (Primitive) -> Tuple[mesh.ArrayMesh, dict]
+        """
+        Return a 2-tuple (mesh, export arguments) of `prim`, with its
+        transform applied to the mesh.
+        """
+        state = self._state
+        state.capture = []
+        try:
+            getattr(self, prim.shape)(**prim.kwargs)
+            msh, export_args = state.capture[0]
+        finally:
+            state.capture = None
+        transform = export_args.pop('transform', None)
+        if transform is not None:
+            msh.transform(transform)
+        if prim.transform is not None:
+            msh.transform(prim.transform)
+        return msh, export_args
+
+    def _export(self, msh, **export_args):
+        """
+        Return the exported node of `msh`, a LODNode if LOD is enabled. The
+        triangle counts per level are summed up in `lod_triangles`.
+        """
+        capture = self._state.capture
+        if capture is not None:     # batch() exports the merged meshes
+            capture.append((msh, export_args))
+            return None
+        if self._optimize:
+            export_args['optimize'] = True
+        if self._packed:
+            export_args['packed'] = True
+        if self._lod_levels < 2:
+            return msh.export(**export_args)
+        node, counts = simplify.lod_node(
+            msh,
+            self._lod_levels,
+            **export_args
+        )
+        with self._lod_lock:
+            for i in range(self._lod_levels):
+                self.lod_triangles[i] += counts[min(i, len(counts) - 1)]
+        return node
 
     def sphere(
             self,
@@ -67,7 +230,8 @@ class ShapeGen(object):
             origin:
             direction:
             radius:
-            polygon: number of vertices to be used per 360° revolution
+            polygon: number of vertices to be used per 360° revolution, None
+                to derive it from the tolerance
             h_deg:
             h_offset:
             p_from:
@@ -76,13 +240,50 @@ class ShapeGen(object):
             nac:
             name:
         """
+        polygon = self._polygon(radius, polygon)
+        dr = self._state.array_draw
+        dr.setup(origin, direction)
+        # other mesh types (Mesh, subclasses) get every vertex added
+        if self._mesh_type is mesh.ArrayMesh:
+            msh = _sphere_template(
+                polygon,
+                float(h_deg),
+                float(h_offset),
+                float(p_from),
+                float(p_to)
+            ).mesh(name or 'sphere', dr.matrix, radius, color)
+        else:
+            msh = self._mesh_type(name or 'sphere')
+            dr.set_radius(radius)
+            self._sphere_grid(
+                msh,
+                dr,
+                polygon,
+                h_deg,
+                h_offset,
+                p_from,
+                p_to,
+                color
+            )
+        return self._export(
+            msh,
+            face_normals=False,
+            sharp_angle=80.0,
+            nac=nac
+        )
+
+    @staticmethod
+    def _sphere_grid(msh, dr, polygon, h_deg, h_offset, p_from, p_to, color):
+        """
+        Add the vertices and triangles of `sphere` to `msh`, with the rig
+        `dr` already set up. All ring points are evaluated at once, then
+        added in the order of the original Draw rig walk. Returns a 2-tuple
+        (rows, vertex id per row).
+        """
         h_polygon = max(3, int(ceil(polygon / 360 * h_deg)))
         segments = max(1, int(ceil(polygon / 2) / 180 * (p_to - p_from)))
         wrap = h_deg == 360
         complete = h_deg == 360 and p_to - p_from == 180.0
-        self._draw.setup(origin, direction)
-        self._draw.set_radius(radius)
-        msh = mesh.Mesh(name or 'sphere')
         p_steps = np.linspace(p_from, p_to, segments + 1)
         h_steps = np.linspace(
             h_offset,
@@ -92,96 +293,65 @@ class ShapeGen(object):
         )
         u_steps = np.linspace(0, 1, h_polygon, endpoint=False)
         v_steps = np.linspace(0, 1, segments + 1)
-        last = len(p_steps) - 1
-        verts = []
-        slice_verts = []
-        slice_upper = None  # type: Union[None, core.Point3]
-        slice_lower = None  # type: Union[None, core.Point3]
-        for i, (p, v) in enumerate(zip(p_steps, v_steps)):
-            self._draw.set_hp_r(h_offset, p, radius)
-            if i == 0:
-                if p == -90.0:
-                    if complete:
-                        line = [
-                            msh.add_vertex(
-                                self._draw.point,
-                                color,
-                                core.Vec2(u, v)
-                            )
-                            for u in u_steps
-                        ]
-                    else:
-                        line = [msh.add_vertex(self._draw.point, color)]
-                else:
-                    line = [msh.add_vertex(self._draw.center_point, color)]
-                verts.append(line)
-                if not wrap:
-                    slice_verts.append(line[0])
-                    slice_lower = msh[line[0]].point
-                if p == -90.0:
-                    continue
-
-            if i < last or p < 90:
-                line = []
-                for j, (h, u) in enumerate(zip(h_steps, u_steps)):
-                    self._draw.set_hp_r(h, p)
-                    if complete:
-                        line.append(
-                            msh.add_vertex(
-                                self._draw.point,
-                                color,
-                                core.Vec2(u, v)
-                            )
-                        )
-                    else:
-                        line.append(msh.add_vertex(self._draw.point, color))
-
-                    if not wrap:
-                        if j == 0:
-                            slice_verts.insert(0, line[-1])
-                        elif j == h_polygon - 1:
-                            slice_verts.append(line[-1])
-                if complete:
-                    line.append(
-                        msh.add_vertex(
-                            msh[line[0]].point,
-                            color,
-                            core.Vec2(1, v)
-                        )
-                    )
-                verts.append(line)
-
-            if i == last:
-                self._draw.set_hp_r(h_offset, p, radius)
-                if p == 90.0:
-                    if complete:
-                        line = [
-                            msh.add_vertex(
-                                self._draw.point,
-                                color,
-                                core.Vec2(u, v)
-                            )
-                            for u in u_steps
-                        ]
-                    else:
-                        line = [msh.add_vertex(self._draw.point, color)]
-                else:
-                    line = [msh.add_vertex(self._draw.center_point, color)]
-                verts.append(line)
-                if not wrap:
-                    slice_verts.append(line[0])
-                    slice_upper = msh[line[0]].point
-
-        self._populate_triangles(msh, verts, wrap and not complete)
+        first = 1 if p_from == -90.0 else 0
+        stop = segments if p_to == 90.0 else segments + 1
+        grid = dr.points(
+            h_steps[None, :],
+            p_steps[first:stop, None]
+        ).reshape(-1, h_polygon, 3)
+        caps = (
+            dr.points(h_offset, (p_from, p_to)),
+            dr.center_points(h_offset, (p_from, p_to))
+        )
+        rows = _Rows()
+
+        def cap(i, v):
+            p = (p_from, p_to)[i]
+            if abs(p) != 90.0:
+                return rows.add(caps[1][i])
+            if not complete:
+                return rows.add(caps[0][i])
+            return rows.add(
+                np.repeat(caps[0][i:i + 1], h_polygon, axis=0),
+                np.column_stack((u_steps, np.full(h_polygon, v)))
+            )
+
+        lower = cap(0, 0.0)
+        num_rings = stop - first
+        if complete:
+            # closing seam vertex at u=1 for every ring
+            u, v = np.meshgrid(np.append(u_steps, 1.0), v_steps[first:stop])
+            ring_ids = rows.add(
+                np.concatenate((grid, grid[:, :1]), axis=1),
+                np.stack((u, v), axis=-1)
+            ).reshape(num_rings, h_polygon + 1)
+        else:
+            ring_ids = rows.add(grid).reshape(num_rings, h_polygon)
+        upper = cap(1, 1.0)
+        lines = [lower] + list(ring_ids) + [upper]
         if not wrap:
-            center = slice_lower + (slice_upper - slice_lower) * 0.5
-            verts = [[msh.add_vertex(center, color)], slice_verts]
-            self._populate_triangles(msh, verts, True, True)
-        return msh.export(
-            face_normals=False,
-            sharp_angle=80.0,
-            nac=nac
+            slice_verts = np.concatenate((
+                ring_ids[::-1, 0],
+                lower[:1],
+                ring_ids[:, -1],
+                upper[:1]
+            ))
+            bottom, top = rows.points[[lower[0], upper[0]]]
+            center = rows.add(bottom + (top - bottom) * 0.5)
+
+        vids = ShapeGen._add_vertices(msh, rows, color)
+        ShapeGen._populate_triangles(
+            msh,
+            [vids[line] for line in lines],
+            wrap and not complete
         )
+        if not wrap:
+            ShapeGen._populate_triangles(
+                msh,
+                [vids[center], vids[slice_verts]],
+                True
+            )
+        return rows, vids
 
     def cone(
             self,
@@ -209,7 +379,8 @@ class ShapeGen(object):
             origin:
             direction:
             radius: Union[float, Tuple[float, float]]
-            polygon: number of vertices to be used per 360° revolution
+            polygon: number of vertices to be used per 360° revolution, None
+                to derive it from the tolerance
             length: for capsule needs to be > 2 * radius to account for the
                 capsule
             smooth: whether to use smooth of flat shading
@@ -240,12 +411,12 @@ class ShapeGen(object):
         if not (0.0 <= origin_offset <= 1.0):
             raise ValueError('origin_offset must be in 0..1 range')
 
-        # draw/mesh/general
-        self._draw.setup(origin, direction)
+        # mesh/general
         wrap = h_deg == 360
-        msh = mesh.Mesh(name or 'cone')
+        msh = self._mesh_type(name or 'cone')
 
         # distance and amount computation
+        polygon = self._polygon(max(rd), polygon)
         h_polygon = max(3, int(ceil(polygon / 360 * h_deg)))
         circumference = 2 * pi * (sum(rd) * 0.5)
         seg_len = circumference / polygon
@@ -367,32 +538,49 @@ class ShapeGen(object):
                 )[::-1]
             )
 
-        # offset TODO: find out how to modify Draw to allow this
-        x_steps = np.linspace(0, top_offset[0], len(dir_steps))
-        y_steps = np.linspace(0, top_offset[1], len(dir_steps))
-
-        verts = []
-        for d, r, p, v, xo, yo in zip(
-                dir_steps, dir_radii, p_steps, dir_v_steps, x_steps, y_steps):
-            self._draw.set_dir_offset(d)
-            line = []
-            for h, hr, u in zip(h_steps, h_radii, u_steps):
-                self._draw.set_hp_r(h, p, r * hr if not p else r)
-                line.append(msh.add_vertex(
-                    self._draw.point if hr else self._draw.center_point,
-                    color,
-                    core.Vec2(u, v)
-                ))
-            verts.append(line)
-        self._populate_triangles(msh, verts, False, chk_illegal=True)
+        # every row is a ring at one direction offset, every column a
+        # heading; the slice center column (h_radii 0) lies on the axis
+        dr = self._state.array_draw
+        dr.setup(origin, direction)
+        row_r = dir_radii[:, None] * np.where(
+            p_steps[:, None] != 0,
+            1.0,
+            h_radii[None, :]
+        )
+        grid = dr.points(
+            h_steps[None, :],
+            p_steps[:, None],
+            row_r,
+            dir_steps[:, None]
+        ).reshape(len(dir_steps), len(h_steps), 3)
+        axis = h_radii == 0
+        if axis.any():
+            grid[:, axis] = dr.center_points(
+                h_steps[None, axis],
+                p_steps[:, None],
+                row_r[:, axis],
+                dir_steps[:, None]
+            ).reshape(len(dir_steps), -1, 3)
+        # top offset shears the rings linearly along the direction axis
+        grid += dr.axis_offsets(
+            np.linspace(0, top_offset[0], len(dir_steps)),
+            np.linspace(0, top_offset[1], len(dir_steps))
+        )[:, None, :]
+        # dir_v_steps has extra entries for capsules, rows use the first ones
+        u, v = np.meshgrid(u_steps, dir_v_steps[:len(dir_steps)])
+        rows = _Rows(grid, np.stack((u, v), axis=-1))
+        vids = self._add_vertices(msh, rows, color).reshape(grid.shape[:2])
+        self._add_triangles(msh, util.grid_triangles(vids), chk_illegal=True)
 
         if smooth:
-            return msh.export(
+            return self._export(
+                msh,
                 face_normals=False,
                 sharp_angle=sharp_angle,
                 nac=nac
             )
-        return msh.export(
+        return self._export(
+            msh,
             nac=nac
         )
 
@@ -440,10 +628,13 @@ class ShapeGen(object):
         #     raise ValueError('expected max_seg_len to be larger than the '
         #                      'smallest bounds - corner_radius')
 
-        msh = mesh.Mesh(name or 'box')
-        self._draw.setup(core.Vec3(0), core.Vec3.forward())
+        msh = self._mesh_type(name or 'box')
+        dr = self._state.draw
+        dr.setup(core.Vec3(0), core.Vec3.forward())
 
         max_seg_len = max_seg_len or min(bounds - corner_radius) / 4
+        if corner_radius:   # flat faces have no chord error
+            max_seg_len = self._seg_len(corner_radius, max_seg_len)
         b_seg_count = core.LVecBase3i(
             *map(int, map(
                     ceil, (bounds - corner_radius) / max_seg_len
@@ -546,27 +737,28 @@ class ShapeGen(object):
         verts = []
         for z, xm, ym in zip(z_offsets, z_x_m, z_y_m):
             if xm == ym == 0:
-                self._draw.set_pos_hp_r(0, 0, z, 0, 0, 0)
-                verts.append([msh.add_vertex(self._draw.point, color)])
+                dr.set_pos_hp_r(0, 0, z, 0, 0, 0)
+                verts.append([msh.add_vertex(dr.point, color)])
                 continue
             elif not xm or not ym:
                 raise RuntimeError('xm and ym must be either both 0 or '
                                    'positive')
             line = []
             for x, y in zip(x_offsets * xm, y_offsets * ym):
-                self._draw.set_pos_hp_r(x, y, z, 0, 0, 0)
-                line.append(msh.add_vertex(self._draw.point, color))
+                dr.set_pos_hp_r(x, y, z, 0, 0, 0)
+                line.append(msh.add_vertex(dr.point, color))
             verts.append(line)
 
         self._populate_triangles(msh, verts, wrap=False, ccw=False)
         for i in range(3):
             msh.mirror_extend(i)
-        self._draw.setup(origin, direction)
-        return msh.export(
+        dr.setup(origin, direction)
+        return self._export(
+            msh,
             face_normals=not smooth,
             sharp_angle=sharp_angle,
             nac=nac,
-            transform=self._draw.transform_mat,
+            transform=dr.transform_mat,
             no_texcoord=True
         )
 
@@ -602,78 +794,65 @@ class ShapeGen(object):
             noise_frequency:
             name:
         """
-        msh = mesh.Mesh(name or 'blob')
-        self._draw.setup(origin, direction)
+        msh = self._mesh_type(name or 'blob')
+        dr = self._state.array_draw
+        dr.setup(origin, direction)
         if color.get_num_components() < 4:
             color = core.Vec4(color, 1)
         if color2 is not None and color2.get_num_components() < 4:
             color2 = core.Vec4(color2, 1)
-        seg_len = min(bounds) / 4
+        seg_len = self._seg_len(min(bounds) / 2, min(bounds) / 4)
         segments = core.LVecBase3i(*map(int, bounds / seg_len)) + 1
         h_segments = (sum(segments.xy) - 2) * 2
         p_segments = h_segments // 2 + 1
-        h_n, p_n, r_n, c_n = self._noise.blob(
+        h_n, p_n, r_n, c_n = np.asarray(self._state.noise.blob(
             h_segments, p_segments, 4, noise_radius, seed, noise_frequency
-        )
-        c_n = [1 / (c.max() - c.min()) * (c - c.min()) for c in c_n]
-        base_r = np.average(r_n[0])
-        top_r = np.average(r_n[-1])
-        base_c = np.average(c_n[0])
-        top_c = np.average(c_n[-1])
+        ), np.float64)
+        c_min = c_n.min(axis=1, keepdims=True)
+        c_n = 1 / (c_n.max(axis=1, keepdims=True) - c_min) * (c_n - c_min)
         p_steps = np.linspace(-90, 90, p_segments)
         p_step = (p_steps[1] - p_steps[0]) * 0.9
         h_steps = np.linspace(0, 360, h_segments, endpoint=False)
         h_step = (h_steps[1] - h_steps[0]) * 0.9
-        verts = []
-        for pid, p in enumerate(p_steps):
-            if abs(p) == 90:
-                r = base_r if p == -90 else top_r
-                r = bounds.z + r * bounds.z
-                self._draw.set_hp_r(0, p, r)
-                if color2 is None:
-                    c = color
-                else:
-                    f = base_c if p == -90 else top_c
-                    c = f * color + (1 - f) * color2
-                    c = core.Vec4(*c)
-                verts.append([msh.add_vertex(self._draw.point, c)])
-                continue
-            # af = pid * h_segments
-            # at = af + h_segments
-            twopi = np.linspace(0, 2 * np.pi, h_segments, endpoint=False)
-            zp = (
-                h_steps,
-                h_n[pid],
-                p_n[pid],
-                r_n[pid],
-                c_n[pid],
-                np.abs(np.cos(twopi)),
-                np.abs(np.sin(twopi))
-            )
-            verts.append([])
-            sin_p = abs(np.sin(np.radians(p)))
-            cos_p = abs(np.cos(np.radians(p)))
-            rz = sin_p * bounds.z
-            for h, ho, po, ro, c, cos_h, sin_h in zip(*zp):
-                rx = cos_h * bounds.x
-                ry = sin_h * bounds.y
-                r_h = np.sqrt(rx ** 2 + ry ** 2) * cos_p
-                r = np.sqrt(r_h ** 2 + rz ** 2)
-                self._draw.set_hp_r(
-                    h + ho * h_step,
-                    p + po * p_step,
-                    r + r * ro
-                )
-                if color2 is None:
-                    col = color
-                else:
-                    col = c * color + (1 - c) * color2
-                    col = core.Vec4(*col)
-                verts[-1].append(
-                    msh.add_vertex(self._draw.point, col)
-                )
+
+        # the radius follows the ellipsoid of `bounds`, scaled by noise
+        twopi = np.linspace(0, 2 * np.pi, h_segments, endpoint=False)
+        p_rad = np.radians(p_steps[1:-1, None])
+        r_h = np.sqrt(
+            (np.abs(np.cos(twopi)) * bounds.x) ** 2
+            + (np.abs(np.sin(twopi)) * bounds.y) ** 2
+        ) * np.abs(np.cos(p_rad))
+        r = np.sqrt(r_h ** 2 + (np.abs(np.sin(p_rad)) * bounds.z) ** 2)
+        body = dr.points(
+            h_steps + h_n[1:-1] * h_step,
+            p_steps[1:-1, None] + p_n[1:-1] * p_step,
+            r + r * r_n[1:-1]
+        )
+        # the poles are single vertices at the average noise of their row
+        poles = dr.points(
+            np.zeros(2),
+            np.array([-90.0, 90.0]),
+            bounds.z + r_n[[0, -1]].mean(axis=1) * bounds.z
+        )
+        rows = _Rows(poles[0])
+        rows.add(body)
+        rows.add(poles[1])
+        if color2 is None:
+            colors = color
+        else:
+            f = np.concatenate((
+                c_n[:1].mean(axis=1),
+                c_n[1:-1].ravel(),
+                c_n[-1:].mean(axis=1)
+            ))[:, None]
+            colors = f * np.asarray(color) + (1 - f) * np.asarray(color2)
+        vids = self._add_vertices(msh, rows, colors)
+        verts = [vids[:1]]
+        verts += list(vids[1:-1].reshape(-1, h_segments))
+        verts.append(vids[-1:])
         self._populate_triangles(msh, verts, wrap=True)
-        return msh.export(
+        return self._export(
+            msh,
             face_normals=not smooth,
             sharp_angle=sharp_angle,
             nac=nac
@@ -699,7 +878,8 @@ class ShapeGen(object):
             a: 2-Tuple base and top a for the ellipse
             b: 2-Tuple base and top b for the ellipse
             h: height
-            max_seg_len: maximum segment length (approximation)
+            max_seg_len: maximum segment length (approximation), None to
+                derive it from the tolerance
             exp: exponent used to determine slope from base to top
             top_xy: displacement between base and top on the xy-plane.
             color:
@@ -711,7 +891,12 @@ class ShapeGen(object):
         if b[0] == b[1]:
             b = b[0], b[1] * 1.0001
 
-        msh = mesh.Mesh(name or 'devils_tower')
+        msh = self._mesh_type(name or 'devils_tower')
+        # smallest radius of curvature of the base and top ellipses
+        max_seg_len = self._seg_len(
+            min(min(ai, bi) ** 2 / max(ai, bi) for ai, bi in zip(a, b)),
+            max_seg_len
+        )
         h_seg_len = np.sqrt((max_seg_len ** 2) / 2)
         base_perimeter = 2 * np.pi * np.sqrt((a[0] ** 2 + b[0] ** 2) / 2)
         top_perimeter = 2 * np.pi * np.sqrt((a[1] ** 2 + b[1] ** 2) / 2)
@@ -770,28 +955,229 @@ class ShapeGen(object):
             core.Vec2(1)
         )])
         self._populate_triangles(msh, verts, wrap=False)
-        return msh.export(face_normals=False, nac=nac, tangent=True)
+        return self._export(msh, face_normals=False, nac=nac, tangent=True)
+
+    def _polygon(self, radius, polygon):
+        # type: (float, Optional[int]) -> int
+        """Return the vertices per revolution to use for `radius`."""
+        if self.tolerance is None:
+            if polygon is None:
+                raise ValueError('polygon is required without a tolerance')
+            return polygon
+        return tessellate.chord_polygon(radius, self.tolerance, polygon)
+
+    def _seg_len(self, radius, seg_len):
+        # type: (float, Optional[float]) -> float
+        """Return the segment length to use on a curve with `radius`."""
+        if self.tolerance is None:
+            if seg_len is None:
+                raise ValueError('max_seg_len is required without a tolerance')
+            return seg_len
+        length = tessellate.chord_length(radius, self.tolerance)
+        return length if seg_len is None else max(seg_len, length)
+
+    @staticmethod
+    def _add_vertices(msh, rows, color):
+        # type: (Union[mesh.Mesh, mesh.ArrayMesh], _Rows, Union[core.Vec4, np.ndarray]) -> np.ndarray
+        """
+        Return the vertex ids of all `rows`, added like consecutive
+        add_vertex calls (in bulk for ArrayMesh). `color` is either a single
+        color or an (n, 4) array with one color per row.
+        """
+        points, texcoords = rows.points, rows.texcoords
+        if isinstance(msh, mesh.ArrayMesh):
+            if isinstance(color, np.ndarray):
+                colors = color
+            else:
+                colors = np.tile(
+                    np.asarray(tuple(color), np.float32),
+                    (len(points), 1)
+                )
+            return msh.add_vertices(points, colors, texcoords)
+        if isinstance(color, np.ndarray):
+            colors = [core.Vec4(*c) for c in color.tolist()]
+        else:
+            colors = [color] * len(points)
+        return np.array([
+            msh.add_vertex(core.Point3(*pt), c, core.Vec2(*uv))
+            for pt, c, uv in zip(points.tolist(), colors, texcoords.tolist())
+        ], np.int64)
+
+    @staticmethod
+    def _add_triangles(msh, triangles, chk_illegal=False):
+        """
+        Add (m, 3) triangles, in bulk for ArrayMesh. With `chk_illegal`
+        triangles with two vertices at the same position are skipped.
+        """
+        if chk_illegal and len(triangles):
+            if isinstance(msh, mesh.ArrayMesh):
+                pts = msh.points[triangles]
+            else:
+                pts = np.array([
+                    [tuple(msh[v].point) for v in t]
+                    for t in triangles.tolist()
+                ], np.float32)
+            same = (pts[:, [0, 1, 2]] == pts[:, [1, 2, 0]]).all(axis=2)
+            triangles = triangles[~same.any(axis=1)]
+        if isinstance(msh, mesh.ArrayMesh):
+            msh.add_triangles(triangles)
+            return
+        for triangle in triangles.tolist():
+            msh.add_triangle(*triangle)
 
     @staticmethod
     def _populate_triangles(msh, verts, wrap, ccw=True, chk_illegal=False):
-        for i in range(len(verts) - 1):
-            upper = verts[i + 1]
-            lower = verts[i]
-            tri_ids = util.triangle_line_connect(
-                len(upper),
-                len(lower),
-                wrap,
-                ccw
-            )
-            for up, lo in tri_ids:
-                triangle = [upper[v] for v in up] + [lower[v] for v in lo]
-                if chk_illegal:
-                    pts = []
-                    for v in triangle:
-                        point = msh[v].point
-                        if point in pts:
-                            break
-                        pts.append(point)
-                    if len(pts) < 3:
-                        continue
-                msh.add_triangle(*triangle)
+        """Add the triangles connecting consecutive lines of vertex ids."""
+        ShapeGen._add_triangles(
+            msh,
+            util.strip_triangles(verts, wrap, ccw),
+            chk_illegal
+        )
+
+
+class _GenState(threading.local):
+    """Per thread drawing rigs, noise and settings of a ShapeGen."""
+    def __init__(self, tolerance):
+        # type: (Optional[float]) -> None
+        self.draw = draw.Draw()
+        self.array_draw = draw.ArrayDraw()
+        self.noise = noise.Noise()
+        self.capture = None     # type: Optional[list]
+        self.tolerance = tolerance
+
+
+class Primitive(object):
+    """
+    Spec of one shape in ShapeGen.batch: the name of the ShapeGen method and
+    its keyword arguments, plus an optional transform applied to the shape
+    and a material. Primitives with equal materials share a Geom.
+    """
+    __slots__ = ('shape', 'kwargs', 'transform', 'material')
+
+    def __init__(self, shape, transform=None, material=None, **kwargs):
+        # type: (str, Optional[core.Mat4], Any, Any) -> None
+        """
+        Args:
+            shape: 'sphere', 'cone', 'box', 'blob' or 'elliptic_cone'
+            transform: Mat4 applied to the shape
+            material: None, core.Texture, core.Material or core.RenderState
+            **kwargs: passed on to the ShapeGen method
+        """
+        if shape not in ('sphere', 'cone', 'box', 'blob', 'elliptic_cone'):
+            raise ValueError(f'unknown shape "{shape}"')
+        self.shape = shape
+        self.transform = transform
+        self.material = material
+        self.kwargs = kwargs
+
+
+def _material_state(material):
+    # type: (Any) -> core.RenderState
+    """Return the Geom state of a Primitive material."""
+    if material is None:
+        return core.RenderState.make_empty()
+    if isinstance(material, core.RenderState):
+        return material
+    if isinstance(material, core.Texture):
+        return core.RenderState.make(core.TextureAttrib.make(material))
+    if isinstance(material, core.Material):
+        return core.RenderState.make(core.MaterialAttrib.make(material))
+    raise TypeError('material must be a Texture, Material or RenderState')
+
+
+class _SphereTemplate(object):
+    """
+    A unit sphere built by ShapeGen._sphere_grid with a fixed rig, whose
+    points are only transformed per call. Welding and the triangle layout
+    don't depend on origin, direction, radius or (a uniform) color.
+    """
+    __slots__ = ('unit', 'vpt', 'texcoords', 'triangles')
+
+    def __init__(self, unit, vpt, texcoords, triangles):
+        # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> None
+        self.unit = unit
+        self.vpt = vpt
+        self.texcoords = texcoords
+        self.triangles = triangles
+
+    def mesh(self, name, matrix, radius, color):
+        # type: (str, np.ndarray, float, core.Vec4) -> mesh.ArrayMesh
+        """
+        Return a new ArrayMesh of the sphere, placed by the (4, 4) rig
+        `matrix` (see ArrayDraw.matrix).
+        """
+        points = self.unit @ (matrix[:3, :3] * radius) + matrix[3, :3]
+        return mesh.ArrayMesh.from_arrays(
+            name,
+            points.astype(np.float32),
+            self.vpt.copy(),
+            np.tile(np.asarray(tuple(color), np.float32), (len(self.vpt), 1)),
+            self.texcoords.copy(),
+            self.triangles.copy()
+        )
+
+
+@lru_cache(maxsize=SPHERE_CACHE_SIZE)
+def _sphere_template(polygon, h_deg, h_offset, p_from, p_to):
+    # type: (int, float, float, float, float) -> _SphereTemplate
+    dr = draw.ArrayDraw()
+    dr.setup(core.Vec3(0), core.Vec3.up())
+    dr.set_radius(1.0)
+    msh = mesh.ArrayMesh()
+    rows, vids = ShapeGen._sphere_grid(
+        msh,
+        dr,
+        polygon,
+        h_deg,
+        h_offset,
+        p_from,
+        p_to,
+        core.Vec4(1)
+    )
+    arrays = msh.arrays()
+    # float64 position of every point, back in rig space where the sphere
+    # scales with the radius
+    _, first = np.unique(arrays['vpt'][vids], return_index=True)
+    unit = rows.points[first] @ np.linalg.inv(dr.matrix[:3, :3])
+    return _SphereTemplate(
+        unit,
+        arrays['vpt'],
+        arrays['texcoords'],
+        arrays['triangles']
+    )
+
+
+class _Rows(object):
+    """Vertex rows (position, uv) collected in insertion order."""
+    def __init__(self, points=None, texcoords=None):
+        self._points = []
+        self._texcoords = []
+        self._len = 0
+        if points is not None:
+            self.add(points, texcoords)
+
+    def add(self, points, texcoords=None):
+        # type: (np.ndarray, Optional[np.ndarray]) -> np.ndarray
+        """Append rows and return their row ids."""
+        points = np.asarray(points, np.float64).reshape(-1, 3)
+        if texcoords is None:
+            texcoords = np.zeros((len(points), 2))
+        self._points.append(points)
+        self._texcoords.append(
+            np.asarray(texcoords, np.float64).reshape(-1, 2)
+        )
+        self._len += len(points)
+        return np.arange(self._len - len(points), self._len)
+
+    @property
+    def points(self):
+        # type: () -> np.ndarray
+        return np.concatenate(self._points)
+
+    @property
+    def texcoords(self):
+        # type: () -> np.ndarray
+        return np.concatenate(self._texcoords)
+
+    def __len__(self):
+        return self._len
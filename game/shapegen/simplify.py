@@ -0,0 +1,397 @@
+"""
+Provides quadric error metric mesh simplification and LOD chains.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import heapq
+from math import ceil
+from math import log
+from typing import Any
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+from panda3d import core
+
+from . import mesh
+from . import shading
+from .. import common
+
+BOUNDARY_WEIGHT = 100.0
+MIN_NORMAL_DOT = 0.2
+
+
+def simplify(msh, targets):
+    # type: (mesh.ArrayMesh, Sequence[int]) -> List[mesh.ArrayMesh]
+    """
+    Return one simplified copy of `msh` per entry in `targets`, reduced by
+    quadric error metric edge collapses (Garland & Heckbert) until at most
+    that many triangles remain. All levels come from a single collapse
+    sequence, so `targets` must be descending. Edges collapse on positions,
+    vertices keep their color and uv. Boundaries and attribute seams are
+    preserved by additional perpendicular quadrics and collapses that would
+    flip a triangle are rejected.
+
+    Args:
+        msh: source mesh
+        targets: descending triangle counts
+    """
+    arrays = msh.arrays()
+    pts = arrays['points'].astype(np.float64)
+    vpt = arrays['vpt']
+    trs = msh.triangles
+    tri_pts = vpt[trs]
+    valid = (
+        (tri_pts[:, 0] != tri_pts[:, 1])
+        & (tri_pts[:, 1] != tri_pts[:, 2])
+        & (tri_pts[:, 2] != tri_pts[:, 0])
+    )
+    trs, tri_pts = trs[valid], tri_pts[valid]
+    quadrics = _quadrics(pts, trs, tri_pts)
+
+    corners = tri_pts.tolist()
+    alive = [True] * len(corners)
+    num_alive = len(corners)
+    point_tris = [set() for _ in range(len(pts))]
+    for t, c in enumerate(corners):
+        for p in c:
+            point_tris[p].add(t)
+    version = [0] * len(pts)
+    edges = _unique_edges(tri_pts)
+    costs, positions = _collapse_costs(
+        quadrics[edges[:, 0]] + quadrics[edges[:, 1]],
+        pts[edges[:, 0]],
+        pts[edges[:, 1]]
+    )
+    heap = list(zip(
+        costs.tolist(),
+        edges[:, 0].tolist(),
+        edges[:, 1].tolist(),
+        [0] * len(edges),
+        [0] * len(edges),
+        map(tuple, positions.tolist())
+    ))
+    heapq.heapify(heap)
+    quadrics = quadrics.tolist()
+    pts = list(map(tuple, pts.tolist()))
+
+    def entry(a, b):
+        cost, pos = _collapse_cost(
+            [qa + qb for qa, qb in zip(quadrics[a], quadrics[b])],
+            pts[a],
+            pts[b]
+        )
+        return cost, a, b, version[a], version[b], pos
+
+    levels = []
+    for target in targets:
+        while num_alive > target and heap:
+            _, a, b, va, vb, pos = heapq.heappop(heap)
+            if va != version[a] or vb != version[b]:
+                continue
+            shared = point_tris[a] & point_tris[b]
+            if not _can_collapse(pts, corners, point_tris, a, b, pos, shared):
+                continue
+            for t in shared:
+                alive[t] = False
+                for p in corners[t]:
+                    if p != a and p != b:
+                        point_tris[p].discard(t)
+            num_alive -= len(shared)
+            point_tris[a] -= shared
+            for t in point_tris[b] - shared:
+                c = corners[t]
+                c[c.index(b)] = a
+                point_tris[a].add(t)
+            point_tris[b] = set()
+            pts[a] = pos
+            quadrics[a] = [qa + qb for qa, qb in zip(quadrics[a], quadrics[b])]
+            version[a] += 1
+            version[b] += 1
+            neighbours = {p for t in point_tris[a] for p in corners[t]}
+            neighbours.discard(a)
+            for p in neighbours:
+                heapq.heappush(heap, entry(a, p))
+        levels.append(_build_level(msh, trs, pts, corners, alive))
+    return levels
+
+
+def lod_node(
+        msh,
+        levels=common.LOD_LEVELS,
+        ratio=common.LOD_RATIO,
+        min_triangles=64,
+        far=1e5,
+        **export_args
+):
+    # type: (mesh.ArrayMesh, int, float, int, float, Any) -> Tuple[core.PandaNode, List[int]]
+    """
+    Return a 2-tuple (node, triangle counts) of a LODNode with `levels`
+    levels, each keeping `ratio` of the triangles of the previous one. Meshes
+    smaller than `min_triangles` are exported without LOD. Level switches are
+    placed where the exponential scene fog (common.FOG_EXP_DENSITY) has
+    covered an equal share of the remaining contrast, see switch_distances.
+
+    Args:
+        msh: source mesh
+        levels: number of levels, including the full detail one
+        ratio: triangle ratio between two consecutive levels
+        min_triangles: meshes below this triangle count get no LOD
+        far: distance up to which the coarsest level is shown
+        **export_args: passed on to ArrayMesh.export
+    """
+    meshes = lod_levels(msh, levels, ratio, min_triangles)
+    children = [level.export(**export_args) for level in meshes]
+    counts = [len(level.triangles) for level in meshes]
+    if len(children) < 2:
+        return children[0], counts
+    return lod_switch(children, f'{msh.name}/lod', far), counts
+
+
+def lod_levels(
+        msh,
+        levels=common.LOD_LEVELS,
+        ratio=common.LOD_RATIO,
+        min_triangles=64
+):
+    # type: (mesh.ArrayMesh, int, float, int) -> List[mesh.ArrayMesh]
+    """
+    Return the meshes of the LOD levels of `msh`, starting with `msh`
+    itself. Only `msh` is returned if it is smaller than `min_triangles`.
+    Arguments as in lod_node.
+    """
+    num_triangles = len(msh.triangles)
+    if levels < 2 or num_triangles < min_triangles:
+        return [msh]
+    targets = [
+        max(min_triangles // 4, int(ceil(num_triangles * ratio ** i)))
+        for i in range(1, levels)
+    ]
+    return [msh] + simplify(msh, targets)
+
+
+def lod_switch(children, name='lod', far=1e5):
+    # type: (List[core.PandaNode], str, float) -> core.LODNode
+    """
+    Return a LODNode switching between the `children` nodes, one per level
+    starting with the full detail one. See lod_node.
+    """
+    # switch distances are measured from the surface, not the center
+    node = core.LODNode(name)
+    bounds = children[0].get_bounds()
+    radius = 0.0
+    if not bounds.is_empty():
+        node.set_center(bounds.get_center())
+        radius = bounds.get_radius()
+    levels = len(children)
+    distances = [0.0] + [
+        d + radius for d in switch_distances(levels)[1:]
+    ] + [far]
+    for i, child in enumerate(children):
+        node.add_switch(distances[i + 1], distances[i])
+        node.add_child(child)
+    return node
+
+
+def switch_distances(levels, density=common.FOG_EXP_DENSITY):
+    # type: (int, float) -> List[float]
+    """
+    Return the `levels` near distances of the LOD levels. Exponential fog
+    blends a fraction of 1 - exp(-density * d) of the fog color into a
+    surface at distance d, level i starts where that reaches i / levels.
+    """
+    return [log(levels / (levels - i)) / density for i in range(levels)]
+
+
+def _quadrics(pts, trs, tri_pts):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Return the (n, 10) area weighted plane quadrics per position, including
+    the perpendicular planes along boundary and attribute seam edges.
+    """
+    normal_mag = shading.face_normals(pts, tri_pts)
+    area = np.sqrt((normal_mag * normal_mag).sum(axis=1)) / 2
+    normals = shading.normalized(normal_mag)
+    planes = np.hstack((
+        normals,
+        -(normals * pts[tri_pts[:, 0]]).sum(axis=1, keepdims=True)
+    ))
+    weights = np.repeat(area, 3)
+    corner_planes = np.repeat(planes, 3, axis=0)
+    index = tri_pts.ravel()
+
+    # edges (by vertex) that only belong to a single triangle
+    edge_v = np.stack([trs, np.roll(trs, -1, axis=1)], axis=2).reshape(-1, 2)
+    edge_p = np.stack(
+        [tri_pts, np.roll(tri_pts, -1, axis=1)],
+        axis=2
+    ).reshape(-1, 2)
+    _, inv, count = np.unique(
+        np.sort(edge_v, axis=1),
+        axis=0,
+        return_inverse=True,
+        return_counts=True
+    )
+    border = np.flatnonzero(count[inv.reshape(-1)] == 1)
+    if len(border):
+        a, b = pts[edge_p[border, 0]], pts[edge_p[border, 1]]
+        edge = b - a
+        side = shading.normalized(np.cross(edge, planes[border // 3, :3]))
+        side_planes = np.hstack((side, -(side * a).sum(axis=1, keepdims=True)))
+        side_weights = (edge * edge).sum(axis=1) * BOUNDARY_WEIGHT
+        index = np.concatenate((index, edge_p[border].ravel()))
+        corner_planes = np.vstack((
+            corner_planes,
+            np.repeat(side_planes, 2, axis=0)
+        ))
+        weights = np.concatenate((weights, np.repeat(side_weights, 2)))
+
+    rows, cols = np.triu_indices(4)
+    products = corner_planes[:, rows] * corner_planes[:, cols]
+    return shading.scatter_add(index, products * weights[:, None], len(pts))
+
+
+def _unique_edges(tri_pts):
+    # type: (np.ndarray) -> np.ndarray
+    """Return the (k, 2) unique position pairs of all triangle edges."""
+    edges = np.stack(
+        [tri_pts, np.roll(tri_pts, -1, axis=1)],
+        axis=2
+    ).reshape(-1, 2)
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+def _collapse_cost(q, pa, pb):
+    # type: (List[float], List[float], List[float]) -> Tuple[float, Tuple[float, ...]]
+    """
+    Return a 2-tuple (error, position) of the position minimizing the
+    quadric `q`, falling back to the best of the edge end and mid points if
+    the quadric is singular or the optimum lies far off the edge.
+    """
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = q
+    ax, ay, az = pa
+    bx, by, bz = pb
+    mx, my, mz = (ax + bx) / 2, (ay + by) / 2, (az + bz) / 2
+    candidates = [pa, pb, (mx, my, mz)]
+    det = _det3(a2, ab, ac, ab, b2, bc, ac, bc, c2)
+    scale = a2 + b2 + c2
+    if abs(det) > 1e-9 * scale * scale * scale:
+        x = _det3(-ad, ab, ac, -bd, b2, bc, -cd, bc, c2) / det
+        y = _det3(a2, -ad, ac, ab, -bd, bc, ac, -cd, c2) / det
+        z = _det3(a2, ab, -ad, ab, b2, -bd, ac, bc, -cd) / det
+        if (x - mx) ** 2 + (y - my) ** 2 + (z - mz) ** 2 <= \
+                (ax - bx) ** 2 + (ay - by) ** 2 + (az - bz) ** 2:
+            candidates.append((x, y, z))
+    best = None
+    for pos in candidates:
+        x, y, z = pos
+        err = (
+            x * (a2 * x + 2 * (ab * y + ac * z + ad))
+            + y * (b2 * y + 2 * (bc * z + bd))
+            + z * (c2 * z + 2 * cd) + d2
+        )
+        if best is None or err < best[0]:
+            best = err, pos
+    return best
+
+
+def _collapse_costs(q, pa, pb):
+    # type: (np.ndarray, np.ndarray, np.ndarray) -> Tuple[np.ndarray, np.ndarray]
+    """Vectorized _collapse_cost for (k, 10) quadrics and (k, 3) end points."""
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2 = q.T
+    mid = (pa + pb) / 2
+    det = _det3(a2, ab, ac, ab, b2, bc, ac, bc, c2)
+    scale = a2 + b2 + c2
+    solvable = np.abs(det) > 1e-9 * scale * scale * scale
+    det = np.where(solvable, det, 1)
+    opt = np.stack((
+        _det3(-ad, ab, ac, -bd, b2, bc, -cd, bc, c2) / det,
+        _det3(a2, -ad, ac, ab, -bd, bc, ac, -cd, c2) / det,
+        _det3(a2, ab, -ad, ab, b2, -bd, ac, bc, -cd) / det
+    ), axis=1)
+    solvable &= ((opt - mid) ** 2).sum(axis=1) <= ((pa - pb) ** 2).sum(axis=1)
+    candidates = np.stack((pa, pb, mid, np.where(solvable[:, None], opt, pa)))
+    x, y, z = candidates[..., 0], candidates[..., 1], candidates[..., 2]
+    err = (
+        x * (a2 * x + 2 * (ab * y + ac * z + ad))
+        + y * (b2 * y + 2 * (bc * z + bd))
+        + z * (c2 * z + 2 * cd) + d2
+    )
+    best = np.argmin(err, axis=0)
+    rows = np.arange(len(q))
+    return err[best, rows], candidates[best, rows]
+
+
+def _det3(a, b, c, d, e, f, g, h, i):
+    """Return the determinant of the row major 3x3 matrix a..i."""
+    return a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+
+
+def _can_collapse(pts, corners, point_tris, a, b, pos, shared):
+    """
+    Return whether the edge a, b can collapse into `pos` without creating
+    non manifold geometry or flipping any of the remaining triangles.
+    """
+    if not shared:
+        return False
+    ring_a = {p for t in point_tris[a] for p in corners[t]}
+    ring_b = {p for t in point_tris[b] for p in corners[t]}
+    if len(ring_a & ring_b) - 2 > len(shared):
+        return False
+    for p, tris in ((a, point_tris[a]), (b, point_tris[b])):
+        for t in tris - shared:
+            c = [pts[i] for i in corners[t]]
+            ox, oy, oz = _normal(*c)
+            c[corners[t].index(p)] = pos
+            nx, ny, nz = _normal(*c)
+            dot = ox * nx + oy * ny + oz * nz
+            len2 = (ox * ox + oy * oy + oz * oz) * (nx * nx + ny * ny + nz * nz)
+            if dot <= 0 or dot * dot < MIN_NORMAL_DOT ** 2 * len2:
+                return False
+    return True
+
+
+def _normal(p0, p1, p2):
+    ux, uy, uz = p1[0] - p0[0], p1[1] - p0[1], p1[2] - p0[2]
+    vx, vy, vz = p2[0] - p0[0], p2[1] - p0[1], p2[2] - p0[2]
+    return uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx
+
+
+def _build_level(msh, trs, pts, corners, alive):
+    # type: (mesh.ArrayMesh, np.ndarray, list, list, list) -> mesh.ArrayMesh
+    """Return a new ArrayMesh of the surviving triangles."""
+    keep = np.flatnonzero(alive)
+    level = mesh.ArrayMesh(msh.name)
+    corner_v = trs[keep].ravel()
+    corner_p = np.array(corners, np.int64).reshape(-1, 3)[keep].ravel()
+    vids = level.add_vertices(
+        np.array(pts, np.float32)[corner_p],
+        msh.colors[corner_v],
+        msh.texcoords[corner_v]
+    )
+    level.add_triangles(vids.reshape(-1, 3))
+    return level
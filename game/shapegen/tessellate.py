@@ -0,0 +1,91 @@
+"""
+Provides functions to derive tessellation density from an error tolerance.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from math import acos
+from math import ceil
+from math import radians
+from math import sqrt
+from math import tan
+from typing import Optional
+
+from .. import common
+
+
+def chord_segments(radius, tolerance, degrees=360.0, minimum=3):
+    # type: (float, float, float, int) -> int
+    """
+    Return the number of segments needed to approximate an arc of `degrees`
+    with `radius`, so that no chord deviates more than `tolerance` from it.
+    """
+    if radius <= tolerance:
+        return minimum
+    step = 2 * acos(1 - tolerance / radius)
+    return max(minimum, int(ceil(radians(degrees) / step)))
+
+
+def chord_polygon(radius, tolerance, polygon=None, minimum=3):
+    # type: (float, float, Optional[int], int) -> int
+    """
+    Return the vertices per 360° revolution for a circle with `radius` at
+    `tolerance`, not exceeding `polygon` if given.
+    """
+    n = chord_segments(radius, tolerance, minimum=minimum)
+    if polygon is None:
+        return min(n, common.TESS_MAX_POLYGON)
+    return min(n, polygon)
+
+
+def chord_length(radius, tolerance):
+    # type: (float, float) -> float
+    """
+    Return the longest segment on a curve with `radius` whose chord deviates
+    at most `tolerance` from it.
+    """
+    if radius <= tolerance:
+        return 2.0 * radius
+    return 2.0 * sqrt(2.0 * radius * tolerance - tolerance ** 2)
+
+
+def pixel_tolerance(
+        distance,
+        pixels=common.TESS_PIXELS,
+        fov=common.TESS_FOV,
+        screen_height=common.TESS_SCREEN_HEIGHT
+):
+    # type: (float, float, float, int) -> float
+    """
+    Return the world space error that projects to `pixels` on screen at
+    `distance` from the camera.
+
+    Args:
+        distance: distance from the camera
+        pixels: tolerated error in pixels
+        fov: vertical field of view in degrees
+        screen_height: vertical resolution in pixels
+    """
+    return 2.0 * distance * tan(radians(fov) / 2.0) / screen_height * pixels
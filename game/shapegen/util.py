@@ -26,7 +26,11 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+from functools import lru_cache
+from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 import numpy as np
@@ -35,6 +39,8 @@ from PIL import ImageDraw
 
 from panda3d import core
 
+from . import shading
+
 
 def bw_tex(x, y):
     black = (0, 0, 0, 255)
@@ -129,54 +135,86 @@ def comp_triangle_normal(pa, pb, pc, normalized=True):
     return n
 
 
-def _triangle_line_connect(upper, lower, wrap_around, ccw):
-    """Return triangle indices for two lines of vertices"""
-    steps = max(upper, lower)
-    upper_edges = np.linspace(0, upper, steps, endpoint=False, dtype=np.int32)
-    lower_edges = np.linspace(0, lower, steps, endpoint=False, dtype=np.int32)
-    if ccw:
-        upper_edges = upper_edges[::-1]
-        lower_edges = lower_edges[::-1]
+class ArrayBuffer(object):
+    """
+    Growable, contiguous NumPy buffer. Rows are appended along the first axis
+    and the underlying storage doubles in size when full. Single row appends
+    are staged in a list and copied in bulk the next time `data` is accessed.
 
-    triangles = []
-    for i in range(steps - 0 if wrap_around else steps - 1):
-        id1 = i
-        id2 = (i + 1) % steps
-        u_edge = upper_edges[id1] != upper_edges[id2]
-        l_edge = lower_edges[id1] != lower_edges[id2]
-
-        if u_edge:
-            triangles.append(
-                (
-                    (upper_edges[id1], upper_edges[id2]),
-                    (lower_edges[id1],)
-                )
-            )
-            if l_edge:
-                triangles.append(
-                    (
-                        (upper_edges[id2],),
-                        (lower_edges[id2], lower_edges[id1])
-                    )
-                )
-                continue
+    Args:
+        shape: shape of a single row (default scalar rows)
+        dtype: NumPy dtype of the buffer
+        capacity: initial number of rows allocated
+    """
+    def __init__(self, shape=(), dtype=np.float32, capacity=64):
+        self._data = np.empty((max(1, capacity),) + tuple(shape), dtype)
+        self._len = 0
+        self._pending = []
 
-        if l_edge:
-            triangles.append(
-                (
-                    (upper_edges[id1],),
-                    (lower_edges[id2], lower_edges[id1])
-                )
-            )
-    return triangles
+    @classmethod
+    def from_array(cls, array):
+        # type: (np.ndarray) -> ArrayBuffer
+        """
+        Return a full buffer that uses `array` as storage without copying it,
+        until it has to grow.
+        """
+        buf = cls.__new__(cls)
+        buf._data = array
+        buf._len = len(array)
+        buf._pending = []
+        return buf
+
+    def append(self, row):
+        self._pending.append(row)
+        return self._len + len(self._pending) - 1
+
+    def extend(self, rows):
+        self._flush()
+        rows = np.asarray(rows, dtype=self._data.dtype)
+        rows = rows.reshape((-1,) + self._data.shape[1:])
+        start = self._len
+        end = start + rows.shape[0]
+        if end > self._data.shape[0]:
+            self.reserve(max(end, self._data.shape[0] * 2))
+        self._data[start:end] = rows
+        self._len = end
+        return start
+
+    def reserve(self, capacity):
+        if capacity <= self._data.shape[0]:
+            return
+        data = np.empty((capacity,) + self._data.shape[1:], self._data.dtype)
+        data[:self._len] = self._data[:self._len]
+        self._data = data
+
+    def _flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self.extend(pending)
 
+    @property
+    def data(self):
+        # type: () -> np.ndarray
+        """View of the used part of the buffer."""
+        self._flush()
+        return self._data[:self._len]
 
-_tlc_cache = {}
+    def __len__(self):
+        return self._len + len(self._pending)
 
 
-def triangle_line_connect(upper, lower, wrap_around=True, ccw=True):
+STRIP_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=STRIP_CACHE_SIZE)
+def line_pair_indices(upper, lower, wrap_around=True, ccw=True):
+    # type: (int, int, bool, bool) -> np.ndarray
     """
-    Return a list of 2-tuples that make up single triangles from upper, lower.
+    Return the (m, 3) int32 indices of the triangles connecting two lines of
+    vertices, indexing into the concatenation of the upper and the lower
+    line. Both lines are walked in `max(upper, lower)` steps; a step emits a
+    triangle for every line that advances to a new vertex. The result is
+    read-only, it is shared through a bounded LRU cache.
 
     Args:
         upper: length of the upper line (num vertices)
@@ -184,19 +222,220 @@ def triangle_line_connect(upper, lower, wrap_around=True, ccw=True):
         wrap_around: whether the last vertex should connect back to the first
         ccw: whether the lines are in ccw order
     """
-    k = (upper, lower, wrap_around, ccw)
-    if k not in _tlc_cache:
-        _tlc_cache[k] = _triangle_line_connect(*k)
-    return _tlc_cache[k]
+    steps = max(upper, lower)
+    up = np.linspace(0, upper, steps, endpoint=False, dtype=np.int32)
+    lo = np.linspace(0, lower, steps, endpoint=False, dtype=np.int32) + upper
+    if ccw:
+        up, lo = up[::-1], lo[::-1]
+    i1 = np.arange(steps if wrap_around else steps - 1)
+    i2 = (i1 + 1) % steps
+    u_edge = up[i1] != up[i2]
+    l_edge = lo[i1] != lo[i2]
+
+    # every step has up to two triangle slots, unused slots are dropped
+    first = np.where(
+        u_edge[:, None],
+        np.stack((up[i1], up[i2], lo[i1]), axis=-1),
+        np.stack((up[i1], lo[i2], lo[i1]), axis=-1)
+    )
+    second = np.stack((up[i2], lo[i2], lo[i1]), axis=-1)
+    used = np.stack((u_edge | l_edge, u_edge & l_edge), axis=-1)
+    triangles = np.stack((first, second), axis=1)[used].astype(np.int32)
+    triangles.flags.writeable = False
+    return triangles
+
+
+def ring_strip_indices(lengths, wrap_around=True, ccw=True):
+    # type: (Sequence[int], bool, bool) -> np.ndarray
+    """
+    Return the (m, 3) int32 indices of the whole surface that connects
+    consecutive rings (lines) of vertices with the given `lengths`, indexing
+    into the concatenation of all rings. The result is read-only, it is
+    shared through a bounded LRU cache.
+
+    Args:
+        lengths: number of vertices of every ring, from the lowest up
+        wrap_around: whether the last vertex should connect back to the first
+        ccw: whether the rings are in ccw order
+    """
+    return _ring_strip_indices(
+        tuple(int(n) for n in lengths),
+        wrap_around,
+        ccw
+    )
+
+
+@lru_cache(maxsize=STRIP_CACHE_SIZE)
+def _ring_strip_indices(lengths, wrap_around, ccw):
+    # type: (Tuple[int, ...], bool, bool) -> np.ndarray
+    starts = np.cumsum((0, ) + lengths, dtype=np.int64)
+    triangles = []
+    for i, (lower, upper) in enumerate(zip(lengths[:-1], lengths[1:])):
+        pair = line_pair_indices(upper, lower, wrap_around, ccw)
+        triangles.append(np.where(
+            pair < upper,
+            pair + starts[i + 1],
+            pair - upper + starts[i]
+        ))
+    if triangles:
+        triangles = np.concatenate(triangles).astype(np.int32)
+    else:
+        triangles = np.zeros((0, 3), np.int32)
+    triangles.flags.writeable = False
+    return triangles
+
+
+def strip_triangles(lines, wrap_around=True, ccw=True):
+    # type: (List[np.ndarray], bool, bool) -> np.ndarray
+    """
+    Return the (m, 3) vertex ids of all triangles that connect consecutive
+    `lines` of vertex ids (see ring_strip_indices).
+    """
+    if not lines:
+        return np.zeros((0, 3), np.int32)
+    ids = np.concatenate([np.asarray(line, np.int64) for line in lines])
+    return ids[ring_strip_indices([len(line) for line in lines],
+                                  wrap_around, ccw)]
+
+
+def grid_triangles(ids):
+    # type: (np.ndarray) -> np.ndarray
+    """
+    Return the (m, 3) triangles connecting consecutive rows of the (rows,
+    columns) vertex id grid `ids`, like ring_strip_indices for rows of equal
+    length without wrap around, in ccw order.
+    """
+    a = np.arange(ids.shape[1] - 1, 0, -1)
+    lower, upper = ids[:-1], ids[1:]
+    return np.stack((
+        upper[:, a], upper[:, a - 1], lower[:, a],
+        upper[:, a - 1], lower[:, a - 1], lower[:, a]
+    ), axis=-1).reshape(-1, 3)
+
+
+_NUMPY_TYPES = {
+    core.Geom.NT_uint8: np.uint8,
+    core.Geom.NT_uint16: np.uint16,
+    core.Geom.NT_uint32: np.uint32,
+    core.Geom.NT_int8: np.int8,
+    core.Geom.NT_int16: np.int16,
+    core.Geom.NT_int32: np.int32,
+    core.Geom.NT_float32: np.float32,
+    core.Geom.NT_float64: np.float64,
+}
+
+
+def array_dtype(array_format):
+    # type: (core.GeomVertexArrayFormat) -> np.dtype
+    """
+    Return a structured NumPy dtype with the same memory layout as one row of
+    `array_format`.
+    """
+    names, formats, offsets = [], [], []
+    for i in range(array_format.get_num_columns()):
+        column = array_format.get_column(i)
+        if column.get_numeric_type() not in _NUMPY_TYPES:
+            raise ValueError(
+                f'unsupported numeric type of column "{column.get_name()}"'
+            )
+        names.append(column.get_name().get_name())
+        formats.append((
+            _NUMPY_TYPES[column.get_numeric_type()],
+            (column.get_num_components(), )
+        ))
+        offsets.append(column.get_start())
+    return np.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': array_format.get_stride()
+    })
+
+
+def _to_column(values, dtype):
+    # type: (np.ndarray, np.dtype) -> np.ndarray
+    """
+    Convert float column values to `dtype`. uint8 columns (colors) are
+    converted the way GeomVertexWriter does, int16 columns only occur in
+    packed formats and hold normalized snorm values.
+    """
+    base = dtype.base
+    if base.kind == 'u' and base.itemsize == 1:
+        return np.clip(np.asarray(values, np.float32) * 255, 0, 255)
+    if base == np.int16:
+        return np.round(np.clip(values, -1, 1) * 32767)
+    return values
+
+
+def packed_format(no_texcoord=False, tangents=False):
+    # type: (bool, bool) -> core.GeomVertexFormat
+    """
+    Return a registered compact vertex format: float32 vertex, snorm16
+    normal (and tangent/binormal), unorm8 color and float32 texcoord.
+    Texcoords stay float32, Panda 1.10 has no half float numeric type and
+    unnormalized integer texcoords would sample a single texel. The snorm16
+    columns rely on being normalized when uploaded, GeomVertexReader returns
+    the raw integer values.
+    """
+    va_format = core.GeomVertexArrayFormat()
+    va_format.add_column('vertex', 3, core.Geom.NT_float32, core.Geom.C_point)
+    va_format.add_column('normal', 3, core.Geom.NT_int16, core.Geom.C_normal)
+    if tangents:
+        va_format.add_column(
+            'tangent', 3, core.Geom.NT_int16, core.Geom.C_vector
+        )
+        va_format.add_column(
+            'binormal', 3, core.Geom.NT_int16, core.Geom.C_vector
+        )
+    va_format.add_column('color', 4, core.Geom.NT_uint8, core.Geom.C_color)
+    if not no_texcoord:
+        va_format.add_column(
+            'texcoord', 2, core.Geom.NT_float32, core.Geom.C_texcoord
+        )
+    # noinspection PyCallByClass
+    return core.GeomVertexFormat.register_format(va_format)
+
+
+def xform_points(mat, points):
+    # type: (core.Mat4, np.ndarray) -> np.ndarray
+    """Return (n, 3) `points` transformed by `mat` like Mat4.xform_point."""
+    m = np.array(mat, np.float64)
+    return points @ m[:3, :3] + m[3, :3]
+
+
+def xform_vectors(mat, vectors, normals=False):
+    # type: (core.Mat4, np.ndarray, bool) -> np.ndarray
+    """
+    Return the normalized (n, 3) `vectors` transformed by `mat`. Normals are
+    transformed by the inverse transpose, like Mat4.xform_vec_general.
+    """
+    m = np.array(mat, np.float64)[:3, :3]
+    if normals:
+        m = np.linalg.inv(m).T
+    return shading.normalized(vectors @ m)
 
 
 # noinspection PyArgumentList
 class VertArray(object):
-    def __init__(self, name='noname', no_texcoord=False, tangents=True):
+    def __init__(
+            self,
+            name='noname',
+            no_texcoord=False,
+            tangents=True,
+            packed=False
+    ):
         self._name = name
         self._no_texcoord = no_texcoord
         self._tangents = tangents
-        if no_texcoord and not tangents:
+        self._packed = packed
+        self._dtype = None      # type: Optional[np.dtype]
+        if packed:
+            self._vdata = core.GeomVertexData(
+                self._name,
+                packed_format(no_texcoord, tangents),
+                core.Geom.UH_static
+            )
+        elif no_texcoord and not tangents:
             self._vdata = core.GeomVertexData(
                 self._name,
                 core.GeomVertexFormat.get_v3n3c4(),
@@ -264,6 +503,8 @@ class VertArray(object):
             tangent=None,
             bitangent=None
     ):
+        if self._packed:
+            raise ValueError('packed formats only support add_arrays')
         self._vwriter.add_data3(point)
         self._nwriter.add_data3(normal)
         if self._tangents:
@@ -280,7 +521,105 @@ class VertArray(object):
     def add_triangle(self, va, vb, vc):
         self._prim.add_vertices(va, vb, vc)
 
+    @property
+    def dtype(self):
+        # type: () -> np.dtype
+        """Structured NumPy dtype of one interleaved vertex row."""
+        if self._dtype is None:
+            self._dtype = array_dtype(self._vdata.get_format().get_array(0))
+        return self._dtype
+
+    def add_interleaved(self, data):
+        # type: (np.ndarray) -> int
+        """
+        Bulk alternative to add_row. Appends all rows of `data`, which must
+        be of `dtype`, with a single copy into the vertex array and returns
+        the index of the first row added.
+
+        Args:
+            data: (n, ) array of dtype
+        """
+        data = np.ascontiguousarray(data)
+        if data.dtype != self.dtype:
+            raise ValueError(f'expected dtype {self.dtype}, got {data.dtype}')
+        start = self._v_id
+        self._v_id += len(data)
+        # noinspection PyArgumentList
+        self._vdata.set_num_rows(self._v_id)
+        view = np.frombuffer(
+            memoryview(self._vdata.modify_array(0)),
+            self.dtype
+        )
+        view[start:] = data
+        for writer in (
+                self._vwriter,
+                self._nwriter,
+                self._cwriter,
+                self._twriter,
+                self._tawriter if self._tangents else None,
+                self._biwriter if self._tangents else None
+        ):
+            if writer is not None:
+                writer.set_row(self._v_id)
+        return start
+
+    def add_arrays(
+            self,
+            point,
+            normal,
+            color,
+            tex=None,
+            tangent=None,
+            bitangent=None
+    ):
+        # type: (np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]) -> int
+        """
+        Bulk alternative to add_row, taking one (n, k) array per column.
+        Returns the index of the first row added.
+        """
+        columns = {
+            'vertex': point,
+            'normal': normal,
+            'color': color,
+            'texcoord': tex,
+            'tangent': tangent,
+            'binormal': bitangent
+        }
+        data = np.empty(len(point), self.dtype)
+        for name in self.dtype.names:
+            if columns[name] is None:
+                if name == 'texcoord':
+                    raise ValueError('tex not provided')
+                raise ValueError('tangent and bitangent not provided')
+            data[name] = _to_column(columns[name], self.dtype[name])
+        return self.add_interleaved(data)
+
+    def add_triangles(self, indices):
+        # type: (np.ndarray) -> None
+        """
+        Bulk alternative to add_triangle. Appends all triangles with a single
+        write into the index array, using 16 bit indices while possible.
+
+        Args:
+            indices: (m, 3) or flat array of vertex indices
+        """
+        indices = np.asarray(indices).ravel()
+        if not len(indices):
+            return
+        if self._v_id >= 0xffff or indices.max() >= 0xffff:
+            self._prim.set_index_type(core.Geom.NT_uint32)
+        index_type = _NUMPY_TYPES[self._prim.get_index_type()]
+        start = self._prim.get_num_vertices()
+        handle = self._prim.modify_vertices()
+        # noinspection PyArgumentList
+        handle.set_num_rows(start + len(indices))
+        np.frombuffer(memoryview(handle), index_type)[start:] = indices
+
     def transform(self, mat):
+        if self._packed:
+            raise ValueError(
+                'packed formats must be transformed before add_arrays'
+            )
         self._vdata.transform_vertices(mat)
 
     @property
@@ -299,6 +638,8 @@ DR = 3
 
 
 class AABB(object):
+    __slots__ = ('origin', 'bb')
+
     def __init__(self, origin, bb):
         # type: (core.Vec2, core.Vec2) -> None
         self.origin = origin
@@ -351,6 +692,15 @@ class AABB(object):
 
 
 class QuadNode(object):
+    __slots__ = (
+        'aabb',
+        'children',
+        'leafs',
+        'depth',
+        'max_leaf_nodes',
+        'root'
+    )
+
     def __init__(self, aabb, depth, max_leaf_nodes, root=False):
         self.aabb = aabb
         self.children = {i: None for i in range(4)}
@@ -369,6 +719,8 @@ class QuadNode(object):
 
 
 class QuadElement(object):
+    __slots__ = ('point', 'data', 'aabb')
+
     def __init__(self, point, data, aabb=None):
         self.point = point
         self.data = data
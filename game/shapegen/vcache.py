@@ -0,0 +1,216 @@
+"""
+Provides triangle and vertex reordering for post transform vertex cache
+locality, reduced overdraw and pre transform fetch locality.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from collections import deque
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from . import shading
+
+CACHE_SIZE = 32
+
+
+def optimize(triangles, positions=None, cache_size=CACHE_SIZE):
+    # type: (np.ndarray, Optional[np.ndarray], int) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Return a 2-tuple (triangles, vertex order). Triangles are reordered with
+    Tipsify and, if `positions` are given, the resulting clusters are sorted
+    to reduce overdraw. The strip walk order of ShapeGen is often close to
+    optimal already, so the input order is kept if it has the lower ACMR.
+    Vertices are then renumbered in order of first use, `vertex order` holds
+    the old vertex id of every new vertex.
+
+    Args:
+        triangles: (m, 3) vertex indices
+        positions: (n, 3) vertex positions, enables overdraw sorting
+        cache_size: vertex cache size to optimize for
+    """
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    order, clusters = tipsify(triangles, cache_size)
+    if positions is not None:
+        order = overdraw_sort(triangles, positions, order, clusters)
+    if acmr(triangles[order], cache_size) < acmr(triangles, cache_size):
+        triangles = triangles[order]
+    return vertex_order(triangles)
+
+
+def tipsify(triangles, cache_size=CACHE_SIZE):
+    # type: (np.ndarray, int) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Return a 2-tuple (triangle order, cluster starts) of the Tipsify
+    ordering (Sander, Nehab and Barczak 2007). Cluster starts are positions
+    in the triangle order where the fanning had to jump and the vertex cache
+    is cold, the resulting clusters can be reordered freely.
+
+    Args:
+        triangles: (m, 3) vertex indices
+        cache_size: vertex cache size to optimize for
+    """
+    num_tris = len(triangles)
+    if not num_tris:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    corners = triangles.ravel()
+    num_vts = int(corners.max()) + 1
+    adj_order = np.argsort(corners, kind='stable') // 3
+    adj_start = np.zeros(num_vts + 1, np.int64)
+    adj_start[1:] = np.cumsum(np.bincount(corners, minlength=num_vts))
+    adjacency = adj_order.tolist()
+    adj_start = adj_start.tolist()
+    tri_list = triangles.tolist()
+
+    live = np.bincount(corners, minlength=num_vts).tolist()
+    timestamp = [0] * num_vts
+    emitted = [False] * num_tris
+    dead_end = deque()
+    order = []
+    clusters = [0]
+    stamp = cache_size + 1
+    cursor = 0
+    fanning = 0
+    while fanning >= 0:
+        candidates = set()
+        for t in adjacency[adj_start[fanning]:adj_start[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in tri_list[t]:
+                dead_end.append(v)
+                candidates.add(v)
+                live[v] -= 1
+                if stamp - timestamp[v] > cache_size:
+                    timestamp[v] = stamp
+                    stamp += 1
+
+        # next fanning vertex: the one that stays longest in the cache
+        fanning = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if stamp - timestamp[v] + 2 * live[v] <= cache_size:
+                    priority = stamp - timestamp[v]
+                if priority > best:
+                    best = priority
+                    fanning = v
+        if fanning >= 0:
+            continue
+        while dead_end:
+            v = dead_end.pop()
+            if live[v] > 0:
+                fanning = v
+                break
+        else:
+            while cursor < num_vts:
+                if live[cursor] > 0:
+                    fanning = cursor
+                    break
+                cursor += 1
+        if fanning >= 0 and stamp - timestamp[fanning] > cache_size:
+            clusters.append(len(order))
+    return np.array(order, np.int64), np.array(clusters, np.int64)
+
+
+def overdraw_sort(triangles, positions, order, clusters):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    """
+    Return `order` with its clusters sorted for less overdraw, independent
+    of the view direction: clusters that face away from the mesh centroid
+    the most are drawn first, as they are the most likely to occlude others.
+
+    Args:
+        triangles: (m, 3) vertex indices
+        positions: (n, 3) vertex positions
+        order: triangle order (see tipsify)
+        clusters: start of every cluster in `order`
+    """
+    if len(clusters) < 2:
+        return order
+    positions = np.asarray(positions, np.float64)
+    tris = triangles[order]
+    normal_mag = shading.face_normals(positions, tris)
+    area = np.sqrt((normal_mag * normal_mag).sum(axis=1))
+    centers = positions[tris].mean(axis=1)
+    mesh_center = (centers * area[:, None]).sum(axis=0) / max(area.sum(), 1e-9)
+    cluster_normal = shading.normalized(
+        np.add.reduceat(normal_mag, clusters, axis=0)
+    )
+    cluster_area = np.maximum(np.add.reduceat(area, clusters), 1e-9)
+    cluster_center = np.add.reduceat(
+        centers * area[:, None],
+        clusters,
+        axis=0
+    ) / cluster_area[:, None]
+    facing = ((cluster_center - mesh_center) * cluster_normal).sum(axis=1)
+    cluster_order = np.argsort(-facing, kind='stable')
+    sizes = np.diff(np.append(clusters, len(order)))
+    cluster_id = np.repeat(np.arange(len(clusters)), sizes)
+    rank = np.empty_like(cluster_order)
+    rank[cluster_order] = np.arange(len(cluster_order))
+    return order[np.argsort(rank[cluster_id], kind='stable')]
+
+
+def vertex_order(triangles):
+    # type: (np.ndarray) -> Tuple[np.ndarray, np.ndarray]
+    """
+    Return a 2-tuple (triangles, vertex order) with vertices renumbered in
+    order of their first use. `vertex order` holds the old vertex id of
+    every new vertex, vertices that are not referenced are dropped.
+    """
+    corners = np.asarray(triangles).ravel()
+    unique, first = np.unique(corners, return_index=True)
+    old_ids = unique[np.argsort(first, kind='stable')]
+    new_ids = np.zeros(int(corners.max()) + 1 if len(corners) else 0, np.int64)
+    new_ids[old_ids] = np.arange(len(old_ids))
+    return new_ids[triangles].reshape(-1, 3), old_ids
+
+
+def acmr(triangles, cache_size=CACHE_SIZE):
+    # type: (np.ndarray, int) -> float
+    """
+    Return the average cache miss ratio (vertex shader invocations per
+    triangle) of a FIFO vertex cache with `cache_size` entries.
+    """
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    if not len(triangles):
+        return 0.0
+    cache = deque()
+    cached = set()
+    misses = 0
+    for v in triangles.ravel().tolist():
+        if v in cached:
+            continue
+        misses += 1
+        cache.append(v)
+        cached.add(v)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return misses / len(triangles)
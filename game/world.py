@@ -27,6 +27,8 @@ SOFTWARE.
 """
 
 import random
+from functools import partial
+from typing import Dict
 
 import numpy as np
 from PIL import Image
@@ -37,16 +39,65 @@ from . import gamedata
 from . import modelgen
 from . import common
 from . import collision
-from .shapegen import shape
+from .shapegen import cache
 from .shapegen import noise
 from .shapegen import util
+from .shapegen import scatter
 from .shapegen import sdf
+from .shapegen import service
+
+# everything that changes the output of world_fields for the same seed
+field_cache = cache.FieldCache(salt=(
+    common.T_XY,
+    common.N_TYPE, common.N_FRACTAL_OCT, common.N_FRACTAL_GAIN,
+    common.N_FRACTAL_LAC, common.N_FREQ, common.N_PERT_TYPE,
+    common.N_PERT_OCT, common.N_PERT_AMP, common.N_PERT_FREQ,
+    common.N_PERT_LAC, common.N_PERT_GAIN,
+    common.WN_TYPE, common.WN_DIST_FUNC, common.WN_RET_TYPE,
+    common.WN_FRACTAL_OCT, common.W_CELL_TYPE_COUNT, common.W_BOUND_CLIP,
+    common.W_WOOD_CELL_COUNT
+)) if common.FIELD_CACHE else None
+
+
+def world_fields(seed, store=True):
+    # type: (int, bool) -> Dict[str, np.ndarray]
+    """
+    Return the terrain heightfield, woods and bounds masks and obelisk
+    coordinates of world `seed`, served from the field cache if enabled.
+    Cached arrays are read-only. With `store` False the cache is bypassed,
+    for worlds that never come up again.
+    """
+    if field_cache is None or not store:
+        return cache.seeded(seed, _generate_fields, seed)
+    return field_cache.arrays(
+        'world_fields',
+        _generate_fields,
+        seed,
+        seed=seed
+    )
+
+
+def _generate_fields(seed):
+    # type: (int) -> Dict[str, np.ndarray]
+    gen = noise.Noise(seed)
+    woods, bounds, ob_coords = gen.woods()
+    heightfield = gen.terrain()
+    # level ground for the three rings
+    f = sdf.circle((30, 30), 15)
+    avg = np.max(heightfield[713:743, 713:743])
+    heightfield[713:743, 713:743][f] = avg
+    return {
+        'heightfield': heightfield,
+        'woods': woods.astype(bool),
+        'bounds': bounds,
+        'obelisks': np.array(ob_coords, dtype=np.int32)
+    }
 
 
 class World(gamedata.GameData):
-    def __init__(self, collision_handler):
+    def __init__(self, collision_handler, gen_service):
+        # type: (collision.CollisionHandler, service.GenerationService) -> None
         gamedata.GameData.__init__(self)
-        self.heightfield = None
         self.__collision = collision_handler
         self.terrain = None
         self.terrain_root = None
@@ -54,12 +105,30 @@ class World(gamedata.GameData):
         self.tree_root = self.render.attach_new_node('tree_root')
         self.devils_tower = None
         self.__solved_symbols = None
-        self.noise = noise.Noise()
-        self.__woods, self.__bounds, self.ob_coords = self.noise.woods()
+        self.seed = common.WORLD_SEED
+        if self.seed is None and common.WORLD_VARIANTS:
+            self.seed = random.randrange(common.WORLD_VARIANTS)
+        # one-off random worlds would fill the caches with entries that are
+        # never read again
+        self.__recurring = self.seed is not None
+        if self.seed is None:
+            self.seed = random.getrandbits(31)
+        self.noise = noise.Noise(self.seed)
+        fields = world_fields(self.seed, self.__recurring)
+        self.heightfield = fields['heightfield']
+        self.__woods = fields['woods']
+        self.__bounds = fields['bounds']
+        self.ob_coords = [(int(x), int(y)) for x, y in fields['obelisks']]
         # print(self.ob_coords)
+        # props stream in after the first frame
+        self.__loader = service.ThreadedLoader(self.task_mgr)
+        # models are generated in the background while the terrain is set up
+        self.__models = {}
+        self.__request_models(gen_service)
         self.setup_terrain()
         self.place_devils_tower()
         self.place_trees()
+        self.__models = None
         self.__setup_solved_symbols()
 
         self.__first_obelisk = True
@@ -79,6 +148,51 @@ class World(gamedata.GameData):
     def collision(self):
         return self.__collision
 
+    def __request_models(self, gen_service):
+        # type: (service.GenerationService) -> None
+        """Submit all models needed by the setup methods to `gen_service`."""
+        self.__tower_key = self.__request(gen_service, modelgen.devils_tower)
+        tree_seeds = [
+            modelgen.variant(self.seed, 'tree', i)
+            for i in range(common.W_INDIVIDUAL_TREES)
+        ]
+        self.__tree_keys = [
+            self.__request(
+                gen_service,
+                (modelgen.fir_tree, modelgen.leaf_tree)[seed % 2],
+                seed=seed
+            )
+            for seed in tree_seeds
+        ]
+        self.__circle_keys = [
+            self.__request(
+                gen_service,
+                modelgen.stone_circle,
+                20,
+                30,
+                seed=modelgen.variant(self.seed, 'stone_circle', i)
+            )
+            for i in range(len(self.ob_coords))
+        ]
+        self.__obelisk_key = self.__request(gen_service, modelgen.obelisk)
+
+    def __request(self, gen_service, func, *args, seed=None):
+        key = func, args, seed
+        if key not in self.__models:
+            self.__models[key] = modelgen.generate(
+                gen_service,
+                func,
+                *args,
+                seed=seed,
+                store=seed is None or self.__recurring
+            )
+        return key
+
+    def __model(self, key):
+        """Return a copy of the NodePath of a requested model."""
+        node_path = self.__models[key].result()
+        return core.NodePath(node_path.node().copy_subgraph())
+
     def __setup_solved_symbols(self):
         c = core.CardMaker('solved')
         c.set_frame(core.Vec4(0, 0.2, -0.3, 0.3))
@@ -122,16 +236,7 @@ class World(gamedata.GameData):
 
     def place_devils_tower(self):
         self.devils_tower = self.render.attach_new_node(
-            shape.ShapeGen().elliptic_cone(
-                a=(240, 70),
-                b=(200, 80),
-                h=250,
-                max_seg_len=20.0,
-                exp=2.5,
-                top_xy=(40, -20),
-                color=core.Vec4(0.717, 0.635, 0.558, 1),
-                nac=False
-            )
+            self.__models[self.__tower_key].result()
         )
         h = random.randint(0, 360)
         self.collision.add(
@@ -208,23 +313,15 @@ class World(gamedata.GameData):
         #     core.TextureStage.CO_src_color
         # )
         self.terrain_root.set_texture(ts, tex)
-        trees = [
-            random.choice((modelgen.fir_tree, modelgen.leaf_tree))()
-            for _ in range(common.W_INDIVIDUAL_TREES)
-        ]
-        x = 3
-        y = 3
+        trees = [self.__models[key].result() for key in self.__tree_keys]
         hs = common.T_XY * common.T_XY_SCALE / 2
-        while y < self.__woods.shape[0] - 3:
-            step = np.random.randint(9, 30)
-            x += step
-            if x > self.__woods.shape[0] - 3:
-                y += np.random.randint(10, 20)
-                if y >= self.__woods.shape[0] - 3:
-                    break
-                x = max(3, x % self.__woods.shape[0])
-            if not self.__woods[y, x]:
-                continue
+        inner = np.zeros_like(self.__woods)
+        inner[3:-3, 3:-3] = True
+        sites = scatter.Scatter(
+            self.__woods & inner,
+            reach=common.W_TREE_SPACING
+        )
+        for x, y in sites.fill(common.W_TREE_SPACING):
             node_path = self.tree_root.attach_new_node('fir_tree')
             orig, r = random.choice(trees)
             orig.copy_to(node_path)
@@ -242,13 +339,13 @@ class World(gamedata.GameData):
             pos.z = self.sample_terrain_z(pos.x, pos.y)
             node_path.set_pos(pos)
 
+    @staticmethod
+    def __add_stone(parent, stone):
+        # type: (core.NodePath, core.NodePath) -> None
+        stone.reparent_to(parent)
+
     # noinspection PyArgumentList
     def setup_terrain(self):
-        self.heightfield = self.noise.terrain()
-        f = sdf.circle((30, 30), 15)
-        avg = np.max(self.heightfield[713:743, 713:743])
-        self.heightfield[713:743, 713:743][f] = avg
-
         # self.heightfield[self.__bounds] -= 0.1
         # self.heightfield = np.clip(self.heightfield, 0, 1)
         hf = (self.heightfield * 255).astype(np.uint8)
@@ -282,11 +379,17 @@ class World(gamedata.GameData):
         for i in range(40):
             d.set_y(random.uniform(common.T_ST_Y_MIN, common.T_ST_Y_MAX))
             rot.set_h(360 / 40 * (i + random.random() - 0.5))
-            node_path = modelgen.stone(core.Vec2(
-                random.uniform(common.T_ST_MIN_SIZE, common.T_ST_MAX_SIZE),
-                random.uniform(common.T_ST_MIN_SIZE, common.T_ST_MAX_SIZE)
-            ))
-            node_path.reparent_to(self.render)
+            node_path = self.render.attach_new_node('stone')
+            # random_stone draws from a local RNG, see cache.local_rng
+            self.__loader.load(
+                modelgen.cached,
+                modelgen.random_stone,
+                common.T_ST_MIN_SIZE,
+                common.T_ST_MAX_SIZE,
+                seed=modelgen.variant(self.seed, 'stone', i),
+                store=self.__recurring,
+                callback=partial(self.__add_stone, node_path)
+            )
             node_path.set_pos(d.get_pos(self.render))
             node_path.set_hpr(
                 random.uniform(0, 360),
@@ -301,8 +404,8 @@ class World(gamedata.GameData):
         mat = core.Material('mat')
         mat.set_emission(core.Vec4(0.2, 0.4, 0.1, 1))
         for i, (x, y) in enumerate(self.ob_coords):
-            stone_circle = modelgen.stone_circle(20, 30)
-            node_path = modelgen.obelisk()
+            stone_circle = self.__model(self.__circle_keys[i])
+            node_path = self.__model(self.__obelisk_key)
             node_path.reparent_to(stone_circle)
             stone_circle.reparent_to(self.render)
             node_path.set_material(mat)
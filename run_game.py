@@ -26,11 +26,10 @@ SOFTWARE.
 
 import sys
 
-if sys.version_info < (3, 6):
+if sys.version_info < (3, 9):
     print('''
 ===================================================
-Sorry, but this game requires Python 3.
-It was tested on 3.7, but 3.6 may also work.
+Sorry, but this game requires Python 3.9 or higher.
 ===================================================
 ''')
     sys.exit(1)
@@ -64,5 +63,8 @@ print('Using numpy {0}'.format(np.__version__))
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    # model generation spawns worker processes, also from frozen builds
+    multiprocessing.freeze_support()
     import game
     game.main()
@@ -0,0 +1,1134 @@
+"""
+Reference implementations of the generators as they were before being
+optimized, and helpers to compare results, shared by the tests and
+benchmark.py.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import random
+from functools import partial
+from math import ceil
+from math import pi
+from typing import Union
+
+import numpy as np
+import pyfastnoisesimd as fns
+from panda3d import core
+
+from game import common
+from game import modelgen
+from game.shapegen import mesh
+from game.shapegen import noise
+from game.shapegen import scatter
+from game.shapegen import sdf
+from game.shapegen import shape
+
+
+def geom_arrays(node):
+    """
+    Return a dict of all vertex columns and the triangle indices of the first
+    Geom of a GeomNode as NumPy arrays. Trailing rows that are not referenced
+    by any triangle are dropped (Mesh.export reserves rows for unused
+    vertices).
+    """
+    geom = node.get_geom(0)
+    vdata = geom.get_vertex_data()
+    arrays = {}
+    for i in range(vdata.get_format().get_num_columns()):
+        column = vdata.get_format().get_column(i)
+        name = column.get_name().get_name()
+        reader = core.GeomVertexReader(vdata, name)
+        n = column.get_num_components()
+        rows = []
+        while not reader.is_at_end():
+            rows.append(tuple(reader.get_data4())[:n])
+        arrays[name] = np.array(rows, np.float64)
+    prim = geom.get_primitive(0).decompose()
+    arrays['index'] = np.array(
+        [prim.get_vertex(i) for i in range(prim.get_num_vertices())],
+        np.int64
+    )
+    used = arrays['index'].max() + 1 if len(arrays['index']) else 0
+    for k in arrays:
+        if k != 'index':
+            arrays[k] = arrays[k][:used]
+    return arrays
+
+
+def assert_same_geom(a, b, atol=1e-4):
+    """Raise AssertionError if the GeomNodes `a` and `b` differ."""
+    a, b = geom_arrays(a), geom_arrays(b)
+    if a.keys() != b.keys():
+        raise AssertionError(f'columns differ: {list(a)} vs {list(b)}')
+    for k in a:
+        if a[k].shape != b[k].shape:
+            raise AssertionError(f'{k}: shape {a[k].shape} vs {b[k].shape}')
+        if k == 'index':
+            if not np.array_equal(a[k], b[k]):
+                raise AssertionError('triangle indices differ')
+        elif not np.allclose(a[k], b[k], atol=atol):
+            d = np.abs(a[k] - b[k]).max()
+            raise AssertionError(f'{k}: max deviation {d}')
+
+
+def reference_triangle_line_connect(upper, lower, wrap_around, ccw):
+    """util.triangle_line_connect before ring_strip_indices, uncached."""
+    steps = max(upper, lower)
+    upper_edges = np.linspace(0, upper, steps, endpoint=False, dtype=np.int32)
+    lower_edges = np.linspace(0, lower, steps, endpoint=False, dtype=np.int32)
+    if ccw:
+        upper_edges = upper_edges[::-1]
+        lower_edges = lower_edges[::-1]
+
+    triangles = []
+    for i in range(steps - 0 if wrap_around else steps - 1):
+        id1 = i
+        id2 = (i + 1) % steps
+        u_edge = upper_edges[id1] != upper_edges[id2]
+        l_edge = lower_edges[id1] != lower_edges[id2]
+
+        if u_edge:
+            triangles.append(
+                (
+                    (upper_edges[id1], upper_edges[id2]),
+                    (lower_edges[id1],)
+                )
+            )
+            if l_edge:
+                triangles.append(
+                    (
+                        (upper_edges[id2],),
+                        (lower_edges[id2], lower_edges[id1])
+                    )
+                )
+                continue
+
+        if l_edge:
+            triangles.append(
+                (
+                    (upper_edges[id1],),
+                    (lower_edges[id2], lower_edges[id1])
+                )
+            )
+    return triangles
+
+
+def reference_populate_triangles(
+        msh,
+        verts,
+        wrap,
+        ccw=True,
+        chk_illegal=False
+):
+    """ShapeGen._populate_triangles before ring_strip_indices."""
+    for i in range(len(verts) - 1):
+        upper = verts[i + 1]
+        lower = verts[i]
+        tri_ids = reference_triangle_line_connect(
+            len(upper),
+            len(lower),
+            wrap,
+            ccw
+        )
+        for up, lo in tri_ids:
+            triangle = [upper[v] for v in up] + [lower[v] for v in lo]
+            if chk_illegal:
+                pts = []
+                for v in triangle:
+                    point = msh[v].point
+                    if point in pts:
+                        break
+                    pts.append(point)
+                if len(pts) < 3:
+                    continue
+            msh.add_triangle(*triangle)
+
+
+# noinspection PyArgumentList
+def reference_sphere(
+        sg,
+        origin,
+        direction,
+        radius,
+        polygon,
+        h_deg=360.0,
+        h_offset=0,
+        p_from=-90.0,
+        p_to=90.0,
+        color=core.Vec4(1),
+        nac=common.NAC,
+        name=None
+):
+    h_polygon = max(3, int(ceil(polygon / 360 * h_deg)))
+    segments = max(1, int(ceil(polygon / 2) / 180 * (p_to - p_from)))
+    wrap = h_deg == 360
+    complete = h_deg == 360 and p_to - p_from == 180.0
+    sg._state.draw.setup(origin, direction)
+    sg._state.draw.set_radius(radius)
+    msh = sg._mesh_type(name or 'sphere')
+    p_steps = np.linspace(p_from, p_to, segments + 1)
+    h_steps = np.linspace(
+        h_offset,
+        h_deg + h_offset,
+        h_polygon,
+        endpoint=False
+    )
+    u_steps = np.linspace(0, 1, h_polygon, endpoint=False)
+    v_steps = np.linspace(0, 1, segments + 1)
+    last = len(p_steps) - 1
+    verts = []
+    slice_verts = []
+    slice_upper = None  # type: Union[None, core.Point3]
+    slice_lower = None  # type: Union[None, core.Point3]
+    for i, (p, v) in enumerate(zip(p_steps, v_steps)):
+        sg._state.draw.set_hp_r(h_offset, p, radius)
+        if i == 0:
+            if p == -90.0:
+                if complete:
+                    line = [
+                        msh.add_vertex(
+                            sg._state.draw.point,
+                            color,
+                            core.Vec2(u, v)
+                        )
+                        for u in u_steps
+                    ]
+                else:
+                    line = [msh.add_vertex(sg._state.draw.point, color)]
+            else:
+                line = [msh.add_vertex(sg._state.draw.center_point, color)]
+            verts.append(line)
+            if not wrap:
+                slice_verts.append(line[0])
+                slice_lower = msh[line[0]].point
+            if p == -90.0:
+                continue
+
+        if i < last or p < 90:
+            line = []
+            for j, (h, u) in enumerate(zip(h_steps, u_steps)):
+                sg._state.draw.set_hp_r(h, p)
+                if complete:
+                    line.append(
+                        msh.add_vertex(
+                            sg._state.draw.point,
+                            color,
+                            core.Vec2(u, v)
+                        )
+                    )
+                else:
+                    line.append(msh.add_vertex(sg._state.draw.point, color))
+
+                if not wrap:
+                    if j == 0:
+                        slice_verts.insert(0, line[-1])
+                    elif j == h_polygon - 1:
+                        slice_verts.append(line[-1])
+            if complete:
+                line.append(
+                    msh.add_vertex(
+                        msh[line[0]].point,
+                        color,
+                        core.Vec2(1, v)
+                    )
+                )
+            verts.append(line)
+
+        if i == last:
+            sg._state.draw.set_hp_r(h_offset, p, radius)
+            if p == 90.0:
+                if complete:
+                    line = [
+                        msh.add_vertex(
+                            sg._state.draw.point,
+                            color,
+                            core.Vec2(u, v)
+                        )
+                        for u in u_steps
+                    ]
+                else:
+                    line = [msh.add_vertex(sg._state.draw.point, color)]
+            else:
+                line = [msh.add_vertex(sg._state.draw.center_point, color)]
+            verts.append(line)
+            if not wrap:
+                slice_verts.append(line[0])
+                slice_upper = msh[line[0]].point
+
+    reference_populate_triangles(msh, verts, wrap and not complete)
+    if not wrap:
+        center = slice_lower + (slice_upper - slice_lower) * 0.5
+        verts = [[msh.add_vertex(center, color)], slice_verts]
+        reference_populate_triangles(msh, verts, True, True)
+    return sg._export(
+        msh,
+        face_normals=False,
+        sharp_angle=80.0,
+        nac=nac
+    )
+
+
+# noinspection PyArgumentList
+def reference_cone(
+        sg,
+        origin,
+        direction,
+        radius,
+        polygon,
+        length,
+        smooth=True,
+        sharp_angle=80.0,
+        capsule=False,
+        h_deg=360.0,
+        h_offset=0.0,
+        origin_offset=0.5,
+        top_offset=(0.0, 0.0),
+        color=core.Vec4(1),
+        nac=common.NAC,
+        name=None
+):
+    rd = radius if isinstance(radius, (tuple, list)) else (radius, radius)
+    zc = 0
+    for i, r in enumerate(rd):
+        if i > 1:
+            raise ValueError('maximum 2 radii allowed')
+        if r <= 0:
+            zc += 1
+    if zc == 2:
+        raise ValueError('radius/radii have to be positive and '
+                         'non-zero float(s)/int(s)')
+    if capsule and length <= sum(rd):
+        raise ValueError('length has to be > radius * 2 or sum(radius)')
+    if not (0.0 <= origin_offset <= 1.0):
+        raise ValueError('origin_offset must be in 0..1 range')
+
+    # draw/mesh/general
+    sg._state.draw.setup(origin, direction)
+    wrap = h_deg == 360
+    msh = sg._mesh_type(name or 'cone')
+
+    # distance and amount computation
+    h_polygon = max(3, int(ceil(polygon / 360 * h_deg)))
+    circumference = 2 * pi * (sum(rd) * 0.5)
+    seg_len = circumference / polygon
+    if capsule:
+        cap_segments = max(2, int(ceil(sum(rd) / seg_len / 2)))
+        bod_segments = int(ceil((length - sum(rd)) / seg_len))
+    else:
+        cap_segments = 0
+        bod_segments = int(ceil(length / seg_len))
+    if wrap:
+        slice_len = 0.0
+    else:
+        slice_len = 2 * rd[0]
+    u_len = circumference / 360 * h_deg + slice_len
+    slice_start_u = 1.0 - slice_len / u_len
+    body_len = (length - sum(rd)) if capsule else length
+    v_len = sum(rd) * capsule + body_len
+    body_start_v = 1.0 / v_len * rd[0] * capsule
+    body_end_v = 1.0 - 1.0 / v_len * rd[1] * capsule
+    body_base = -origin_offset * length + rd[0] * capsule
+    body_top = (1.0 - origin_offset) * length - rd[1] * capsule
+
+    # radii, direction, heading, pitch, uv
+    if capsule and rd[0]:
+        lcap_r_steps = np.array([rd[0]] * cap_segments, np.float64)
+        lcap_dir_steps = np.array([body_base] * cap_segments, np.float64)
+        lcap_v_steps = np.linspace(
+            0,
+            body_start_v,
+            cap_segments,
+            endpoint=False
+        )
+        lcap_p_steps = np.linspace(
+            -90,
+            0,
+            cap_segments,
+            endpoint=False
+        )
+    else:
+        lcap_r_steps = np.array([0.0])
+        lcap_dir_steps = np.array([body_base])
+        lcap_v_steps = np.zeros(1)
+        lcap_p_steps = np.zeros(1)
+
+    if capsule and rd[1]:
+        ucap_r_steps = np.array([rd[1]] * cap_segments, np.float64)
+        ucap_dir_steps = np.array([body_top] * cap_segments, np.float64)
+        ucap_v_steps = np.linspace(
+            1.0,
+            body_end_v,
+            cap_segments,
+            endpoint=False
+        )
+        ucap_v_steps = ucap_v_steps[::-1]
+        ucap_p_steps = np.linspace(
+            90,
+            0,
+            cap_segments,
+            endpoint=False
+        )[::-1]
+    else:
+        ucap_r_steps = np.array([0.0])
+        ucap_dir_steps = np.array([body_top])
+        ucap_v_steps = np.ones(1)
+        ucap_p_steps = np.zeros(1)
+
+    body_r_steps_dir = np.linspace(rd[0], rd[1], bod_segments + 1)
+    body_dir_steps = np.linspace(
+        body_base,
+        body_top,
+        bod_segments + 1
+    )
+    body_v_steps = np.linspace(
+        body_start_v,
+        body_end_v,
+        cap_segments * 2 + bod_segments + 1
+    )
+
+    dir_steps = np.append(lcap_dir_steps, body_dir_steps)
+    dir_steps = np.append(dir_steps, ucap_dir_steps)
+    dir_radii = np.append(lcap_r_steps, body_r_steps_dir)
+    dir_radii = np.append(dir_radii, ucap_r_steps)
+    dir_v_steps = np.append(lcap_v_steps, body_v_steps)
+    dir_v_steps = np.append(dir_v_steps, ucap_v_steps)
+    p_steps = np.append(lcap_p_steps, np.zeros(bod_segments + 1))
+    p_steps = np.append(p_steps, ucap_p_steps)
+
+    if wrap:
+        h_steps = np.linspace(h_offset, h_deg + h_offset, h_polygon + 1)
+        h_radii = np.ones(h_polygon + 1)
+        u_steps = np.linspace(
+            0,
+            1,
+            h_polygon + 1
+        )
+    else:
+        h_steps = np.linspace(h_offset, h_deg + h_offset, h_polygon)
+        h_steps = np.append(
+            h_steps,
+            np.linspace(
+                360.0 + h_offset,
+                h_deg + h_offset,
+                2,
+                endpoint=False
+            )[::-1]
+        )
+        h_radii = np.append(np.ones(h_polygon), [0.0, 1.0])
+        u_steps = np.linspace(
+            0,
+            slice_start_u,
+            h_polygon
+        )
+        u_steps = np.append(
+            u_steps,
+            np.linspace(
+                1,
+                slice_start_u,
+                2 * (not wrap), endpoint=False
+            )[::-1]
+        )
+
+    # offset TODO: find out how to modify Draw to allow this
+    x_steps = np.linspace(0, top_offset[0], len(dir_steps))
+    y_steps = np.linspace(0, top_offset[1], len(dir_steps))
+
+    verts = []
+    for d, r, p, v, xo, yo in zip(
+            dir_steps, dir_radii, p_steps, dir_v_steps, x_steps, y_steps):
+        sg._state.draw.set_dir_offset(d)
+        line = []
+        for h, hr, u in zip(h_steps, h_radii, u_steps):
+            sg._state.draw.set_hp_r(h, p, r * hr if not p else r)
+            line.append(msh.add_vertex(
+                sg._state.draw.point if hr else sg._state.draw.center_point,
+                color,
+                core.Vec2(u, v)
+            ))
+        verts.append(line)
+    reference_populate_triangles(msh, verts, False, chk_illegal=True)
+
+    if smooth:
+        return sg._export(
+            msh,
+            face_normals=False,
+            sharp_angle=sharp_angle,
+            nac=nac
+        )
+    return sg._export(
+        msh,
+        nac=nac
+    )
+
+
+# noinspection PyArgumentList
+def reference_blob(
+        sg,
+        origin,
+        direction,
+        bounds,
+        smooth=True,
+        sharp_angle=80.0,
+        color=core.Vec4(1),
+        color2=None,
+        nac=common.NAC,
+        seed=None,
+        noise_radius=6.0,
+        noise_frequency=0.001,
+        name=None
+):
+    msh = sg._mesh_type(name or 'blob')
+    sg._state.draw.setup(origin, direction)
+    if color.get_num_components() < 4:
+        color = core.Vec4(color, 1)
+    if color2 is not None and color2.get_num_components() < 4:
+        color2 = core.Vec4(color2, 1)
+    seg_len = min(bounds) / 4
+    segments = core.LVecBase3i(*map(int, bounds / seg_len)) + 1
+    h_segments = (sum(segments.xy) - 2) * 2
+    p_segments = h_segments // 2 + 1
+    h_n, p_n, r_n, c_n = sg._state.noise.blob(
+        h_segments, p_segments, 4, noise_radius, seed, noise_frequency
+    )
+    c_n = [1 / (c.max() - c.min()) * (c - c.min()) for c in c_n]
+    base_r = np.average(r_n[0])
+    top_r = np.average(r_n[-1])
+    base_c = np.average(c_n[0])
+    top_c = np.average(c_n[-1])
+    p_steps = np.linspace(-90, 90, p_segments)
+    p_step = (p_steps[1] - p_steps[0]) * 0.9
+    h_steps = np.linspace(0, 360, h_segments, endpoint=False)
+    h_step = (h_steps[1] - h_steps[0]) * 0.9
+    verts = []
+    for pid, p in enumerate(p_steps):
+        if abs(p) == 90:
+            r = base_r if p == -90 else top_r
+            r = bounds.z + r * bounds.z
+            sg._state.draw.set_hp_r(0, p, r)
+            if color2 is None:
+                c = color
+            else:
+                f = base_c if p == -90 else top_c
+                c = f * color + (1 - f) * color2
+                c = core.Vec4(*c)
+            verts.append([msh.add_vertex(sg._state.draw.point, c)])
+            continue
+        # af = pid * h_segments
+        # at = af + h_segments
+        twopi = np.linspace(0, 2 * np.pi, h_segments, endpoint=False)
+        zp = (
+            h_steps,
+            h_n[pid],
+            p_n[pid],
+            r_n[pid],
+            c_n[pid],
+            np.abs(np.cos(twopi)),
+            np.abs(np.sin(twopi))
+        )
+        verts.append([])
+        sin_p = abs(np.sin(np.radians(p)))
+        cos_p = abs(np.cos(np.radians(p)))
+        rz = sin_p * bounds.z
+        for h, ho, po, ro, c, cos_h, sin_h in zip(*zp):
+            rx = cos_h * bounds.x
+            ry = sin_h * bounds.y
+            r_h = np.sqrt(rx ** 2 + ry ** 2) * cos_p
+            r = np.sqrt(r_h ** 2 + rz ** 2)
+            sg._state.draw.set_hp_r(
+                h + ho * h_step,
+                p + po * p_step,
+                r + r * ro
+            )
+            if color2 is None:
+                col = color
+            else:
+                col = c * color + (1 - c) * color2
+                col = core.Vec4(*col)
+            verts[-1].append(
+                msh.add_vertex(sg._state.draw.point, col)
+            )
+    reference_populate_triangles(msh, verts, wrap=True)
+    return sg._export(
+        msh,
+        face_normals=not smooth,
+        sharp_angle=sharp_angle,
+        nac=nac
+    )
+
+
+def assert_same_mesh(ref, new, atol=1e-4):
+    """
+    Raise AssertionError if the ArrayMesh `new` differs from `ref`. Triangles
+    of `ref` with two corners at the same position in `new` are ignored, the
+    Draw rig reference keeps some of them due to float32 rounding noise.
+    """
+    if ref.num_vertices != new.num_vertices:
+        raise AssertionError(
+            f'vertices: {ref.num_vertices} vs {new.num_vertices}'
+        )
+    for k in ('points', 'colors', 'texcoords'):
+        if not np.allclose(getattr(ref, k), getattr(new, k), atol=atol):
+            d = np.abs(getattr(ref, k) - getattr(new, k)).max()
+            raise AssertionError(f'{k}: max deviation {d}')
+    pts = new.points[ref.triangles]
+    same = (pts[:, [0, 1, 2]] == pts[:, [1, 2, 0]]).all(axis=2).any(axis=1)
+    if not np.array_equal(ref.triangles[~same], new.triangles):
+        raise AssertionError('triangles differ')
+
+
+# noinspection PyArgumentList
+def blob(sg):
+    return sg.blob(
+        origin=core.Vec3(0),
+        direction=core.Vec3.up(),
+        bounds=core.Vec3(20, 30, 25),
+        color=core.Vec4(0.2, 0.2, 0.2, 1),
+        color2=core.Vec4(0.3, 0.3, 0.3, 1),
+        seed=1234,
+        noise_radius=200,
+        nac=False
+    )
+
+
+def devils_tower(sg):
+    return sg.elliptic_cone(
+        a=(240, 70),
+        b=(200, 80),
+        h=250,
+        max_seg_len=20.0,
+        exp=2.5,
+        top_xy=(40, -20),
+        color=core.Vec4(0.717, 0.635, 0.558, 1),
+        nac=False
+    )
+
+
+# noinspection PyArgumentList
+SHAPES = {
+    'sphere': lambda sg: sg.sphere(
+        core.Vec3(0), core.Vec3.up(), 1, 20, nac=False
+    ),
+    'sphere_slice': lambda sg: sg.sphere(
+        core.Vec3(1, 2, 3), core.Vec3(0, 1, 0.3), 2, 16, h_deg=200,
+        p_from=-30, p_to=60, nac=False
+    ),
+    'hemisphere': lambda sg: sg.sphere(
+        core.Vec3(0), core.Vec3.up(), 1, 12, p_from=0, nac=False
+    ),
+    'cone': lambda sg: sg.cone(
+        core.Vec3(0), core.Vec3.up(), (1.2, 0), 12, 50, origin_offset=0.05,
+        color=core.Vec3(0.2, 0.1, 0.0), nac=False
+    ),
+    'cone_flat': lambda sg: sg.cone(
+        core.Vec3(0), core.Vec3.up(), (2.5, 1.8), 4, 15.0, smooth=False,
+        origin_offset=0, nac=False
+    ),
+    'capsule': lambda sg: sg.cone(
+        core.Vec3(0), core.Vec3(1, 1, 0), (1, 0.5), 16, 5, capsule=True,
+        top_offset=(0.5, 0.2), nac=False
+    ),
+    'cone_slice': lambda sg: sg.cone(
+        core.Vec3(0), core.Vec3.up(), 2, 16, 3, h_deg=270, nac=False
+    ),
+    'ring': lambda sg: sg.cone(
+        core.Vec3(0), core.Vec3.up(), 10, 36, 3, nac=False
+    ),
+    'box': lambda sg: sg.box(
+        core.Vec3(0), core.Vec3.up(), core.Vec3(1, 2, 2), nac=False
+    ),
+    'box_round': lambda sg: sg.box(
+        core.Vec3(0), core.Vec3.up(), core.Vec3(1, 2, 2), corner_radius=0.3,
+        smooth=True, nac=False
+    ),
+    'blob': blob,
+    'blob_flat': lambda sg: sg.blob(
+        core.Vec3(0), core.Vec3.up(), core.Vec3(5, 5, 8), smooth=False,
+        seed=7, nac=False
+    ),
+    'elliptic_cone': devils_tower,
+}
+
+
+class RecordingMesh(mesh.ArrayMesh):
+    """ArrayMesh that records the add_vertex/add_triangle call stream."""
+    last = None
+
+    def __init__(self, name='noname', weld_eps=None):
+        mesh.ArrayMesh.__init__(self, name, weld_eps)
+        self.calls = []
+        RecordingMesh.last = self
+
+    def add_vertex(self, point, color=core.Vec4(1), texcoord=core.Vec2(0)):
+        self.calls.append((True, (point, color, texcoord)))
+        return mesh.ArrayMesh.add_vertex(self, point, color, texcoord)
+
+    def add_vertices(self, points, colors=None, texcoords=None):
+        vids = mesh.ArrayMesh.add_vertices(self, points, colors, texcoords)
+        n = len(vids)
+        colors = np.ones((n, 4)) if colors is None else colors
+        texcoords = np.zeros((n, 2)) if texcoords is None else texcoords
+        for row in zip(
+                np.reshape(points, (-1, 3)).tolist(),
+                np.asarray(colors).tolist(),
+                np.asarray(texcoords).tolist()):
+            self.calls.append((True, (
+                core.Point3(*row[0]),
+                core.Vec4(*row[1]) if len(row[1]) == 4 else core.Vec3(*row[1]),
+                core.Vec2(*row[2])
+            )))
+        return vids
+
+    def add_triangle(self, va, vb, vc):
+        self.calls.append((False, (va, vb, vc)))
+        return mesh.ArrayMesh.add_triangle(self, va, vb, vc)
+
+    def add_triangles(self, triangles):
+        for triangle in np.reshape(triangles, (-1, 3)).tolist():
+            self.calls.append((False, tuple(triangle)))
+        return mesh.ArrayMesh.add_triangles(self, triangles)
+
+    def replay(self, mesh_type):
+        msh = mesh_type()
+        for is_vertex, args in self.calls:
+            if is_vertex:
+                msh.add_vertex(*args)
+            else:
+                msh.add_triangle(*args)
+        return msh
+
+
+# noinspection PyArgumentList
+SPHERES = {
+    'complete': {},
+    'slice': {'h_deg': 200, 'p_from': -30, 'p_to': 60},
+    'hemisphere': {'p_from': 0},
+    'band': {'p_from': -45, 'p_to': 45, 'h_offset': 30},
+    'wedge': {'h_deg': 90, 'p_to': 0},
+}
+
+
+# noinspection PyArgumentList
+CONES = {
+    'trunk': ((1.2, 0), 12, 50, {'origin_offset': 0.05}),
+    'cylinder': (1, 16, 5, {}),
+    'prism_flat': ((2.5, 1.8), 4, 15.0, {'smooth': False}),
+    'capsule': ((1, 0.5), 16, 5, {'capsule': True}),
+    'capsule_slice': (1, 16, 5, {'capsule': True, 'h_deg': 200}),
+    'slice': (2, 16, 3, {'h_deg': 270, 'h_offset': 20}),
+    'ring': (10, 36, 3, {}),
+}
+
+
+BLOBS = {
+    'stone': (core.Vec3(20, 30, 25), {
+        'color2': core.Vec4(0.3, 0.3, 0.3, 1), 'noise_radius': 200
+    }),
+    'canopy': (core.Vec3(6, 7, 9), {
+        'color2': core.Vec4(0.1, 0.5, 0.1, 1), 'noise_radius': 12
+    }),
+    'plain': (core.Vec3(4, 4, 4), {}),
+    'flat': (core.Vec3(3, 5, 2), {'smooth': False, 'seed': 7}),
+}
+
+
+def reference_fir_tree(
+        avg_height=50,
+        avg_segments=6,
+        avg_radius=1.2,
+        offset=0.4,
+        tex=None
+):
+    """modelgen.fir_tree with one GeomNode per cone, as before batching."""
+    sg = modelgen.sg
+    height = random.uniform(
+        offset * avg_height,
+        (1.0 - offset + 1) * avg_height
+    )
+    segments = int(ceil(avg_segments / avg_height * height))
+    trunk_radius = avg_radius / avg_height * height
+    trunk_color = core.Vec4(common.FIR_TRUNK_START)   # copy, see fir_tree
+    trunk_color += common.FIR_TRUNK_DELTA * random.random()
+    bbc = common.FIR_BRANCH_START + common.FIR_BRANCH_DELTA * random.random()
+    branch_colors = [
+        bbc + common.FIR_BRANCH_DELTA * (random.random() - 0.5) * 0.1
+        for _ in range(segments)
+    ]
+    node_path = core.NodePath('fir_tree')
+    trunk_node_path = node_path.attach_new_node(
+        sg.cone(
+            origin=core.Vec3(0),
+            direction=core.Vec3.up(),
+            radius=(trunk_radius, 0),
+            polygon=12,
+            length=height,
+            origin_offset=0.05,
+            color=trunk_color,
+            nac=False,
+            name='fir_tree/trunk'
+        )
+    )
+    trunk_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 5), 0)
+    if tex is not None:
+        trunk_node_path.set_texture(tex, 1)
+    seg_height = height * 0.8 / segments
+    seg_start = height * 0.2
+    for i, bc in enumerate(branch_colors):
+        radius = (
+            random.uniform(
+                (segments - i) * trunk_radius * 0.8,
+                (segments - i) * trunk_radius * 1.0
+            ),
+            random.uniform(
+                (segments - i - 1) * trunk_radius * 0.6,
+                (segments - i - 1) * trunk_radius * 0.8
+            ) if i < segments - 1 else 0,
+        )
+        br_node_path = node_path.attach_new_node(
+            sg.cone(
+                origin=core.Vec3(0),
+                direction=core.Vec3.up(),
+                radius=radius,
+                polygon=16,
+                length=seg_height,
+                color=bc,
+                nac=False,
+                name=f'fir_tree/branch{i}'
+            )
+        )
+        br_node_path.set_z(
+            trunk_node_path,
+            seg_start + seg_height * 0.5 + i * seg_height
+        )
+        br_node_path.set_hpr(random.uniform(0, 360), random.uniform(0, 5), 0)
+    return node_path, trunk_radius
+
+
+def world_triangles(root):
+    """
+    Return all triangles below `root` as (m, 3, 3) corner positions in the
+    space of `root`, sorted to be comparable independent of node layout.
+    """
+    tris = []
+    for node_path in geom_node_paths(root):
+        mat = node_path.get_mat(root)
+        node = node_path.node()
+        for i in range(node.get_num_geoms()):
+            reader = core.GeomVertexReader(
+                node.get_geom(i).get_vertex_data(),
+                'vertex'
+            )
+            pts = []
+            while not reader.is_at_end():
+                pts.append(tuple(mat.xform_point(reader.get_data3())))
+            prim = node.get_geom(i).get_primitive(0).decompose()
+            idx = [prim.get_vertex(j) for j in range(prim.get_num_vertices())]
+            tris.append(np.array(pts)[np.array(idx, np.int64)].reshape(-1, 3, 3))
+    tris = np.concatenate(tris)
+    keys = np.round(tris.reshape(len(tris), -1), 3)
+    return tris[np.lexsort(keys.T[::-1])]
+
+
+def num_geoms(root):
+    """Return the number of Geoms below `root`."""
+    return sum(
+        node_path.node().get_num_geoms()
+        for node_path in geom_node_paths(root)
+    )
+
+
+def geom_node_paths(root):
+    """Return `root` and all its descendants that are GeomNodes."""
+    node_paths = list(root.find_all_matches('**/+GeomNode'))
+    if root.node().is_geom_node():
+        node_paths.insert(0, root)
+    return node_paths
+
+
+def geom_bytes(root):
+    """Return the raw vertex and index data of all Geoms below `root`."""
+    data = []
+    for node_path in geom_node_paths(root):
+        node = node_path.node()
+        for i in range(node.get_num_geoms()):
+            geom = node.get_geom(i)
+            vdata = geom.get_vertex_data()
+            for j in range(vdata.get_num_arrays()):
+                data.append(bytes(vdata.get_array(j).get_handle().get_data()))
+            for j in range(geom.get_num_primitives()):
+                index = geom.get_primitive(j).get_vertices()
+                data.append(bytes(index.get_handle().get_data()))
+    return data
+
+
+def generation_jobs():
+    """Return (func, args, seed) of the models World generates at startup."""
+    jobs = [(modelgen.devils_tower, (), None), (modelgen.obelisk, (), None)]
+    for seed in range(8):
+        jobs.append(((modelgen.fir_tree, modelgen.leaf_tree)[seed % 2], (),
+                     seed))
+        jobs.append((modelgen.random_stone, (3, 6), seed))
+    for seed in range(4):
+        jobs.append((modelgen.stone_circle, (20, 30), seed))
+    return jobs
+
+
+def unpack(result):
+    result = result[0] if isinstance(result, tuple) else result
+    return result if isinstance(result, core.NodePath) \
+        else core.NodePath(result)
+
+
+def shape_jobs(sg):
+    """Return calls of `sg` that only depend on their arguments."""
+    jobs = []
+    for i in range(6):
+        jobs.append(partial(
+            sg.blob, core.Vec3(0), core.Vec3.up(),
+            core.Vec3(3 + i, 4, 5), seed=i + 1, color2=core.Vec4(0.5)
+        ))
+        jobs.append(partial(
+            sg.cone, core.Vec3(i), core.Vec3.up(), (2.0, 0.5), 12 + i, 9.0,
+            capsule=True
+        ))
+        jobs.append(partial(
+            sg.box, core.Vec3(0), core.Vec3.up(), core.Vec3(2, 3, 4), 0.5,
+            corner_radius=0.8, smooth=True
+        ))
+        jobs.append(partial(
+            sg.batch, [shape.Primitive(
+                'sphere', transform=core.Mat4.translate_mat(j, 0, 0),
+                origin=core.Vec3(0), direction=core.Vec3.up(), radius=1 + j,
+                polygon=10 + i
+            ) for j in range(3)]
+        ))
+    return jobs
+
+
+# noinspection DuplicatedCode
+def reference_setup_fns(
+        self,
+        noise_type=fns.NoiseType.Simplex,
+        frequency=0.01,
+        fractal_type=fns.FractalType.FBM,
+        fractal_octaves=3,
+        fractal_gain=0.5,
+        fractal_lacunarity=2.0,
+        perturb_type=fns.PerturbType.NoPerturb,
+        perturb_octaves=3,
+        perturb_frequency=0.5,
+        perturb_amp=1.0,
+        perturb_gain=0.5,
+        perturb_lacunarity=2.0,
+        perturb_normalise_length=1.0,
+        cell_distance_func=fns.CellularDistanceFunction.Euclidean,
+        cell_distance_indices=(0, 1),
+        cell_jitter=0.45,
+        cell_lookup_frequency=0.2,
+        cell_noise_lookup_type=fns.NoiseType.Simplex,
+        cell_return_type=fns.CellularReturnType.Distance,
+        seed=None
+):
+    """Noise.setup_fns before pooling: a new fns.Noise per call."""
+    self.fns = fns.Noise(seed or self.seed)
+    self.fns.noiseType = noise_type
+    self.fns.frequency = frequency
+    self.fns.fractal.fractalType = fractal_type
+    self.fns.fractal.octaves = fractal_octaves
+    self.fns.fractal.gain = fractal_gain
+    self.fns.fractal.lacunarity = fractal_lacunarity
+    self.fns.perturb.perturbType = perturb_type
+    self.fns.perturb.octaves = perturb_octaves
+    self.fns.perturb.frequency = perturb_frequency
+    self.fns.perturb.amp = perturb_amp
+    self.fns.perturb.gain = perturb_gain
+    self.fns.perturb.lacunarity = perturb_lacunarity
+    self.fns.perturb.normaliseLength = perturb_normalise_length
+    self.fns.cell.distanceFunc = cell_distance_func
+    self.fns.cell.distanceIndices = cell_distance_indices
+    self.fns.cell.jitter = cell_jitter
+    self.fns.cell.lookupFrequency = cell_lookup_frequency
+    self.fns.cell.noiseLookupType = cell_noise_lookup_type
+    self.fns.cell.returnType = cell_return_type
+
+
+def reference_woods(self):
+    """The part of Noise.woods before pooling that reconfigured `fns`."""
+    self.setup_fns(
+        noise_type=common.WN_TYPE,
+        cell_distance_func=common.WN_DIST_FUNC,
+        cell_return_type=common.WN_RET_TYPE,
+        fractal_octaves=common.WN_FRACTAL_OCT
+    )
+    c = self.fns.genAsGrid(self.terrain_grid)[0]
+    self.fns.cell.returnType = fns.CellularReturnType.Distance2Div
+    b = self.fns.genAsGrid(self.terrain_grid)[0]
+    return c, b
+
+
+def pooled_woods(self):
+    """Noise.woods with the pool, see reference_woods."""
+    self.setup_fns(
+        noise_type=common.WN_TYPE,
+        cell_distance_func=common.WN_DIST_FUNC,
+        cell_return_type=common.WN_RET_TYPE,
+        fractal_octaves=common.WN_FRACTAL_OCT
+    )
+    c = self.fns.genAsGrid(self.terrain_grid)[0]
+    self.setup_fns(
+        noise_type=common.WN_TYPE,
+        cell_distance_func=common.WN_DIST_FUNC,
+        cell_return_type=fns.CellularReturnType.Distance2Div,
+        fractal_octaves=common.WN_FRACTAL_OCT,
+        seed=self.fns.seed
+    )
+    b = self.fns.genAsGrid(self.terrain_grid)[0]
+    return c, b
+
+
+def reference_noise_blob(gen, xy, z, dim=1, r=None, seed=None, freq=0.001):
+    """
+    Noise.blob before vectorization. The offset of dimension `d` is d * z,
+    so the coordinates of the dimensions partially overwrite each other.
+    """
+    twopi = np.linspace(-np.pi, np.pi, xy, endpoint=False)
+    r = r or np.sqrt(((xy / 2) ** 2) * 2)
+    step = 2 * np.pi * r / xy
+    x_mesh = np.round(np.cos(twopi) * r)
+    y_mesh = np.round(np.sin(twopi) * r)
+    z_mesh = np.linspace(0, z * step, z)
+    gen.setup_fns(
+        noise_type=fns.NoiseType.SimplexFractal,
+        frequency=freq,
+        seed=seed
+    )
+    coord = fns.empty_coords(dim * z * xy)
+    for d in range(dim):
+        ds = d * z
+        for zi in range(z):
+            zs = zi * xy + ds
+            ro = d * r * 3
+            coord[0, zs:zs + xy] = x_mesh + ro
+            coord[1, zs:zs + xy] = y_mesh + ro
+            coord[2, zs:zs + xy] = z_mesh[zi]
+    a = gen.fns.genFromCoords(coord)
+    res = []
+    for d in range(dim):
+        ds = d * z
+        res.append([])
+        for zi in range(z):
+            zs = zi * xy + ds
+            res[-1].append(a[zs:zs + xy])
+    return res
+
+
+def reference_world_fields(seed):
+    """World.__init__/setup_terrain field generation before the cache."""
+    gen = noise.Noise(seed)
+    woods, bounds, ob_coords = gen.woods()
+    heightfield = gen.terrain()
+    f = sdf.circle((30, 30), 15)
+    avg = np.max(heightfield[713:743, 713:743])
+    heightfield[713:743, 713:743][f] = avg
+    return heightfield, woods, bounds, ob_coords
+
+
+def reference_obelisks(fltr, max_tries=20000):
+    """
+    The rejection sampling loop of Noise.woods, returns (sites, tries).
+    Gives up after `max_tries`, the original loop would spin forever.
+    """
+    obelisk_coordinates = [(825, 825)]
+    tries = 0
+    for i in range(3):
+        while tries < max_tries:
+            tries += 1
+            cx, cy = 500, 500
+            while 400 < cx < 600 or 400 < cy < 600:
+                cx, cy = np.random.randint(150, 950, 2)
+            ok = True
+            for x, y in obelisk_coordinates:
+                d = (core.Vec2(x, y) - core.Vec2(cx, cy)).length()
+                if d < 140:
+                    ok = False
+            if ok:
+                if np.sum(fltr[cy - 15:cy + 15, cx - 15:cx + 15]) > 300:
+                    obelisk_coordinates.append((cx, cy))
+                    break
+    return obelisk_coordinates, tries
+
+
+def check_obelisks(fltr, sites):
+    """
+    Return the number of `sites` (after the first, fixed one) that had to
+    fall back to a patch below the density threshold, raise AssertionError
+    if any site breaks the constraints of Noise.woods.
+    """
+    def spaced(cx, cy, previous):
+        return all((core.Vec2(x, y) - core.Vec2(cx, cy)).length() >= 140
+                   for x, y in previous)
+
+    def dense(cx, cy):
+        return np.sum(fltr[cy - 15:cy + 15, cx - 15:cx + 15]) > 300
+
+    cells = [(x, y) for y in range(150, 950, 5) for x in range(150, 950, 5)
+             if not (400 < x < 600 or 400 < y < 600)]
+    fallbacks = 0
+    for i, (cx, cy) in enumerate(sites[1:], 1):
+        if not (150 <= cx < 950 and 150 <= cy < 950) \
+                or 400 < cx < 600 or 400 < cy < 600 \
+                or not spaced(cx, cy, sites[:i]):
+            raise AssertionError(f'obelisk {cx, cy} misplaced')
+        if not dense(cx, cy):
+            fallbacks += 1
+            if any(spaced(x, y, sites[:i]) and dense(x, y) for x, y in cells):
+                raise AssertionError(f'obelisk {cx, cy} skipped dense woods')
+    return fallbacks
+
+
+def reference_trees(woods):
+    """The random walk World.place_trees picked tree cells with."""
+    sites = []
+    x = 3
+    y = 3
+    while y < woods.shape[0] - 3:
+        x += np.random.randint(9, 30)
+        if x > woods.shape[0] - 3:
+            y += np.random.randint(10, 20)
+            if y >= woods.shape[0] - 3:
+                break
+            x = max(3, x % woods.shape[0])
+        if woods[y, x]:
+            sites.append((x, y))
+    return sites
+
+
+def scatter_trees(woods):
+    """Tree cells as World.place_trees picks them."""
+    inner = np.zeros_like(woods)
+    inner[3:-3, 3:-3] = True
+    sites = scatter.Scatter(woods & inner, reach=common.W_TREE_SPACING)
+    return sites.fill(common.W_TREE_SPACING)
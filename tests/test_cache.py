@@ -0,0 +1,139 @@
+"""
+Tests of ModelCache and FieldCache.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+
+import numpy as np
+import pytest
+from panda3d import core
+
+from game import modelgen
+from game import world
+from game.shapegen import cache as modelcache
+from game.shapegen import shape
+from tests.reference import geom_arrays
+from tests.reference import geom_bytes
+from tests.reference import reference_world_fields
+from tests.reference import unpack
+
+MODELS = {
+    'fir_tree': (modelgen.fir_tree, (), 3),
+    'leaf_tree': (modelgen.leaf_tree, (), 5),
+    'random_stone': (modelgen.random_stone, (3, 6), 7),
+    'stone_circle': (modelgen.stone_circle, (20, 30), 11),
+    'obelisk': (modelgen.obelisk, (), None),
+}
+
+
+@pytest.mark.parametrize('name', MODELS)
+def test_model_cache_hit(tmp_path, name):
+    models = modelcache.ModelCache(str(tmp_path), 2 ** 30)
+    func, args, seed = MODELS[name]
+    fresh = modelcache.seeded(seed, func, *args)
+    stored = models.node(name, func, *args, seed=seed)
+    hit = models.node(name, func, *args, seed=seed)
+    assert models.misses == 1 and models.hits == 1
+    assert stored is not hit, 'hit did not load from disk'
+    assert geom_bytes(unpack(fresh)) == geom_bytes(unpack(hit))
+
+
+def test_model_cache_memory_mapped_mesh(tmp_path):
+    models = modelcache.ModelCache(str(tmp_path), 2 ** 30)
+    build = shape.ShapeGen()
+    build._export = lambda msh, **export_args: msh
+    args = (core.Vec3(0), core.Vec3.up(), (1.2, 0), 12, 50)
+    fresh = build.cone(*args, nac=False)
+    models.mesh('trunk', build.cone, *args, nac=False)
+    cached = models.mesh('trunk', build.cone, *args, nac=False)
+    assert isinstance(cached.arrays()['points'], np.memmap)
+    for k, v in fresh.arrays().items():
+        assert np.array_equal(v, cached.arrays()[k]), k
+    a = geom_arrays(fresh.export(nac=False))
+    b = geom_arrays(cached.export(nac=False))
+    for k in a:
+        assert np.array_equal(a[k], b[k]), k
+
+
+def test_model_cache_evicts_least_recently_used(tmp_path):
+    models = modelcache.ModelCache(str(tmp_path), 1)
+    for seed in range(3):
+        models.node('obelisk', modelgen.obelisk, seed=seed)
+    assert models.evictions == 2 and len(models._entries()) == 1
+
+
+def test_model_cache_failed_write(tmp_path):
+    # a failed write leaves no temporary file behind
+    models = modelcache.ModelCache(str(tmp_path), 2 ** 30)
+
+    def broken(path, result):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        models._store(models._path('broken', '.bam'), broken, None)
+    assert not any(n.endswith('.tmp') for n in os.listdir(str(tmp_path)))
+
+
+@pytest.fixture(scope='module')
+def reference_fields():
+    return modelcache.seeded(3, reference_world_fields, 3)
+
+
+def load_fields(fields, seed):
+    return fields.arrays('world_fields', world._generate_fields, seed,
+                         seed=seed)
+
+
+def test_field_cache(tmp_path, reference_fields):
+    fields = modelcache.FieldCache(str(tmp_path), 2, salt='test')
+    cold, warm = load_fields(fields, 3), load_fields(fields, 3)
+    assert fields.misses == 1 and fields.hits == 1
+    assert isinstance(warm['heightfield'], np.memmap)
+    assert not warm['heightfield'].flags.writeable
+    heightfield, woods, bounds, obelisks = reference_fields
+    for new in (cold, warm):
+        assert np.array_equal(new['heightfield'], heightfield)
+        assert np.array_equal(new['woods'], woods > 0)
+        assert np.array_equal(new['bounds'], bounds)
+        assert [tuple(c) for c in new['obelisks']] == obelisks
+
+
+def test_field_cache_evicts_least_recently_used(tmp_path):
+    fields = modelcache.FieldCache(str(tmp_path), 2, salt='test')
+    for seed in (3, 4, 5):
+        load_fields(fields, seed)
+    assert fields.evictions == 1 and len(fields._entries()) == 2
+
+
+def test_one_off_world_not_stored(tmp_path, monkeypatch):
+    fields = modelcache.FieldCache(str(tmp_path), 2, salt='test')
+    monkeypatch.setattr(world, 'field_cache', fields)
+    one_off = world.world_fields(6, store=False)
+    assert not fields.misses and not fields._entries()
+    assert one_off['heightfield'].flags.writeable
@@ -0,0 +1,57 @@
+"""
+Tests of ArrayDraw.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pytest
+from panda3d import core
+
+from game.shapegen import draw
+
+
+@pytest.mark.parametrize('n', (100, 10000))
+def test_array_draw_matches_draw(n):
+    rng = np.random.default_rng(0)
+    h = rng.uniform(-180, 180, n)
+    p = rng.uniform(-90, 90, n)
+    r = rng.uniform(0.1, 5, n)
+    z = rng.uniform(-3, 3, n)
+    origin, direction = core.Vec3(1, 2, 3), core.Vec3(-0.3, 0.2, 1)
+    offset = core.Vec3(10, 20, 30)
+    old, new = draw.Draw(), draw.ArrayDraw()
+    for d in (old, new):
+        d.setup(origin, direction)
+        d.set_orientation_offset(core.Vec3(0.5, 0.2, 0), offset)
+    pts, centers = [], []
+    for row in zip(h.tolist(), p.tolist(), r.tolist(), z.tolist()):
+        old.set_dir_offset(row[3])
+        old.set_hp_r(*row[:3])
+        pts.append(old.point)
+        centers.append(old.center_point)
+    np.testing.assert_allclose(new.points(h, p, r, z), pts, atol=1e-4)
+    np.testing.assert_allclose(new.center_points(h, p, r, z), centers,
+                               atol=1e-4)
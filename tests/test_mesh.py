@@ -0,0 +1,103 @@
+"""
+Tests of Mesh and ArrayMesh.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pytest
+from panda3d import core
+
+from game.shapegen import mesh
+from game.shapegen import shape
+from tests.reference import RecordingMesh
+from tests.reference import SHAPES
+from tests.reference import assert_same_geom
+from tests.reference import devils_tower
+
+EXPORT_ARGS = {'face_normals': False, 'nac': False}
+
+
+@pytest.mark.parametrize('name', SHAPES)
+def test_array_mesh_matches_mesh(name):
+    # smooth normals and tangents of ArrayMesh match Mesh
+    assert_same_geom(
+        SHAPES[name](shape.ShapeGen(mesh.Mesh)),
+        SHAPES[name](shape.ShapeGen(mesh.ArrayMesh))
+    )
+
+
+@pytest.mark.parametrize('weld_eps, rows', (
+    (1e-4, None),
+    (0.01, [(0, 0, 0), (.009, 0, 0), (.011, 0, 0)]),
+))
+def test_bulk_welding_matches_add_vertex(weld_eps, rows):
+    if rows is None:
+        devils_tower(shape.ShapeGen(RecordingMesh))
+        src = RecordingMesh.last.replay(mesh.ArrayMesh)
+        rows = src.points[src.triangles.ravel()]
+    rows = np.asarray(rows, np.float32)
+    one = mesh.ArrayMesh(weld_eps=weld_eps)
+    vids = [one.add_vertex(core.Vec3(*row)) for row in rows.tolist()]
+    many = mesh.ArrayMesh(weld_eps=weld_eps)
+    assert many.add_vertices(rows).tolist() == vids
+    assert np.array_equal(many.points, one.points)
+    assert many.num_welded == one.num_welded
+
+
+def parts():
+    rec = shape.ShapeGen(RecordingMesh)
+    result = []
+    for i, name in enumerate(SHAPES):
+        SHAPES[name](rec)
+        part = RecordingMesh.last.replay(mesh.ArrayMesh)
+        part.transform(core.Mat4.translate_mat(i * 10, 0, 0))
+        result.append(part)
+    return result
+
+
+def test_concatenate_welds_like_add_vertex():
+    new = parts()
+    msh = mesh.ArrayMesh()
+    for part in new:
+        pts, colors, uvs = part.points, part.colors, part.texcoords
+        for t in part.triangles.tolist():
+            msh.add_triangle(*[
+                msh.add_vertex(pts[v], colors[v], uvs[v]) for v in t
+            ])
+    assert_same_geom(
+        msh.export(**EXPORT_ARGS),
+        mesh.concatenate(new, weld=True).export(**EXPORT_ARGS)
+    )
+
+
+def test_concatenate_nested():
+    new = parts()
+    assert_same_geom(
+        mesh.concatenate(new, weld=True).export(**EXPORT_ARGS),
+        mesh.concatenate([mesh.concatenate(new)], weld=True).export(
+            **EXPORT_ARGS
+        )
+    )
@@ -0,0 +1,121 @@
+"""
+Tests of the noise generators and the obelisk placement.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pytest
+
+from game.shapegen import cache as modelcache
+from game.shapegen import noise
+from tests.reference import check_obelisks
+from tests.reference import pooled_woods
+from tests.reference import reference_noise_blob
+from tests.reference import reference_setup_fns
+from tests.reference import reference_woods
+
+
+def test_pooled_blob_noise(monkeypatch):
+    # the noise ShapeGen.blob requests for the stones around the tower
+    gen = noise.Noise()
+
+    def stone_blobs():
+        np.random.seed(3)
+        return [np.asarray(gen.blob(40, 21, 4, 200, None, 0.001))
+                for _ in range(10)]
+
+    new = stone_blobs()
+    monkeypatch.setattr(noise.Noise, 'setup_fns', reference_setup_fns)
+    for a, b in zip(stone_blobs(), new):
+        assert np.array_equal(a, b)
+
+
+def test_pooled_woods_noise(monkeypatch):
+    gen = noise.Noise()
+    gen.terrain_grid = [1, 256, 256]   # valid for any SIMD width
+    np.random.seed(5)
+    new = pooled_woods(gen)
+    monkeypatch.setattr(noise.Noise, 'setup_fns', reference_setup_fns)
+    np.random.seed(5)
+    for a, b in zip(reference_woods(gen), new):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize('xy, z, dim, r', (
+    (40, 21, 4, 200),
+    (96, 49, 4, 12),
+    (16, 9, 1, None),
+))
+def test_blob_noise(xy, z, dim, r):
+    gen = noise.Noise()
+    new = gen.blob(xy, z, dim, r, 11, 0.001)
+    old = reference_noise_blob(gen, xy, z, dim, r, 11, 0.001)
+    assert new.shape == (dim, z, xy)
+    assert new.base is not None, 'expected a view'
+    assert np.array_equal(new, np.asarray(old))
+
+
+@pytest.fixture(scope='module')
+def woods_filters():
+    """The woods filters Noise.woods placed obelisks in and the sites."""
+    filters = []
+    place_obelisks = noise._place_obelisks
+
+    def capture(fltr):
+        filters.append(fltr.copy())
+        return place_obelisks(fltr)
+
+    noise._place_obelisks = capture
+    try:
+        sites = [
+            modelcache.seeded(seed, noise.Noise(seed).woods)[2]
+            for seed in range(8)
+        ]
+    finally:
+        noise._place_obelisks = place_obelisks
+    return list(zip(filters, sites))
+
+
+def test_obelisks(woods_filters):
+    for fltr, sites in woods_filters:
+        assert len(sites) == 3
+        check_obelisks(fltr, [(825, 825)] + sites)
+
+
+@pytest.mark.parametrize('patches', (
+    # sparse woods: only a few patches are dense enough
+    ((200, 200), (200, 800), (800, 200), (620, 380)),
+    # no dense patch at all, rejection sampling would never end
+    (),
+))
+def test_obelisks_in_sparse_woods(woods_filters, patches):
+    fltr = np.zeros_like(woods_filters[0][0])
+    for x, y in patches:
+        fltr[y - 15:y + 15, x - 15:x + 15] = 1
+    np.random.seed(1)
+    sites = noise._place_obelisks(fltr)
+    assert len(sites) == 4
+    assert check_obelisks(fltr, sites) == 3 - len(patches[:3])
@@ -0,0 +1,77 @@
+"""
+Tests of Scatter.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pytest
+
+from game import common
+from game.shapegen import cache as modelcache
+from game.shapegen import noise
+from game.shapegen import scatter
+from tests.reference import scatter_trees
+
+
+def min_spacing(sites):
+    return min(
+        np.hypot(x1 - x2, y1 - y2)
+        for i, (x1, y1) in enumerate(sites) for x2, y2 in sites[:i]
+    )
+
+
+def test_sample_spacing():
+    np.random.seed(2)
+    sites = scatter.Scatter(np.ones((200, 200), bool), reach=30)
+    placed = sites.scatter(20, 30)
+    assert placed and min_spacing(placed) >= 30
+
+
+def test_sample_exhausted():
+    sites = scatter.Scatter(np.ones((10, 10), bool), reach=20)
+    sites.add(5, 5)
+    assert sites.sample(20) is None
+    with pytest.raises(ValueError):
+        sites.candidates(21)
+
+
+def test_fill_trees():
+    woods = modelcache.seeded(0, noise.Noise(0).woods)[0] > 0
+    np.random.seed(4)
+    sites = scatter_trees(woods)
+    assert min_spacing(sites) >= common.W_TREE_SPACING
+    assert all(woods[y, x] for x, y in sites)
+    assert all(3 <= x < woods.shape[1] - 3 and 3 <= y < woods.shape[0] - 3
+               for x, y in sites)
+
+
+def test_window_sums():
+    rng = np.random.default_rng(0)
+    field = rng.integers(0, 2, (40, 50))
+    sums = scatter.window_sums(field, 7)
+    for y, x in ((0, 0), (20, 25), (39, 49), (3, 46)):
+        assert sums[y, x] == field[max(0, y - 3):y + 4,
+                                   max(0, x - 3):x + 4].sum()
@@ -0,0 +1,132 @@
+"""
+Tests of GenerationService and ThreadedLoader.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import random
+import time
+from functools import partial
+from multiprocessing import shared_memory
+
+import pytest
+from direct.task.TaskManagerGlobal import taskMgr
+
+from game import modelgen
+from game.shapegen import cache as modelcache
+from game.shapegen import service
+from tests.reference import generation_jobs
+from tests.reference import geom_bytes
+from tests.reference import unpack
+
+
+@pytest.fixture(scope='module')
+def serial():
+    """Results and geometry of generation_jobs generated inline."""
+    results = [
+        modelcache.seeded(seed, f, *args)
+        for f, args, seed in generation_jobs()
+    ]
+    return results, [geom_bytes(unpack(r)) for r in results]
+
+
+def test_workers_match_inline(serial):
+    results, expected = serial
+    with service.GenerationService(1, 0) as gen_service:
+        submitted = [
+            gen_service.submit(f, *args, seed=seed)
+            for f, args, seed in generation_jobs()
+        ]
+        assert gen_service.started
+        while not all(job.done() for job in submitted):
+            time.sleep(0.001)
+        for ref, a, job in zip(results, expected, submitted):
+            b = job.result()
+            assert geom_bytes(unpack(b)) == a
+            if isinstance(ref, tuple):
+                assert ref[1:] == b[1:]
+
+
+def test_few_jobs_run_inline(serial):
+    _, expected = serial
+    with service.GenerationService(2) as gen_service:
+        submitted = [
+            gen_service.submit(f, *args, seed=seed)
+            for f, args, seed in generation_jobs()[:gen_service.min_jobs - 1]
+        ]
+        assert not gen_service.started
+        for a, job in zip(expected, submitted):
+            assert geom_bytes(unpack(job.result())) == a
+        assert not gen_service.started
+
+
+def test_unassembled_job_releases_shared_memory():
+    with service.GenerationService(1, 0) as gen_service:
+        job = gen_service.submit(modelgen.obelisk)
+        # noinspection PyProtectedMember
+        name = job._future.result()['shm']
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name).close()
+
+
+def test_single_core_runs_inline(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    assert service.GenerationService(None).num_workers == 0
+
+
+def test_threaded_loader(tmp_path):
+    # like World: seeded stones are generated (or read from the cache) on
+    # the loader threads, from a local RNG, while the main thread keeps
+    # drawing from the global one
+    seeds = list(range(6))
+    expected = {
+        seed: geom_bytes(unpack(
+            modelcache.seeded(seed, modelgen.random_stone, 3, 6)
+        ))
+        for seed in seeds
+    }
+    models = modelcache.ModelCache(str(tmp_path), 2 ** 30)
+    for seed in seeds[::2]:
+        models.node('stone', modelgen.random_stone, 3, 6, seed=seed)
+    delivered = {}
+    draws = []
+
+    def deliver(seed, stone):
+        delivered[seed] = stone
+
+    loader = service.ThreadedLoader(taskMgr)
+    random.seed(5)
+    for seed in seeds:
+        loader.load(models.node, 'stone', modelgen.random_stone, 3, 6,
+                    seed=seed, callback=partial(deliver, seed))
+    while loader.pending:
+        draws.append(random.random())
+        taskMgr.step()
+    loader.shutdown()
+    random.seed(5)
+    assert draws == [random.random() for _ in draws]
+    for seed in seeds:
+        assert geom_bytes(unpack(delivered[seed])) == expected[seed]
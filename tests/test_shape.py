@@ -0,0 +1,175 @@
+"""
+Tests of ShapeGen against the Draw rig references.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import random
+from concurrent import futures
+
+import numpy as np
+import pytest
+from panda3d import core
+
+from game import common
+from game import modelgen
+from game.shapegen import shape
+from tests.reference import BLOBS
+from tests.reference import CONES
+from tests.reference import SHAPES
+from tests.reference import SPHERES
+from tests.reference import assert_same_geom
+from tests.reference import assert_same_mesh
+from tests.reference import geom_arrays
+from tests.reference import geom_bytes
+from tests.reference import reference_blob
+from tests.reference import reference_cone
+from tests.reference import reference_fir_tree
+from tests.reference import reference_sphere
+from tests.reference import shape_jobs
+from tests.reference import world_triangles
+
+ORIGIN = core.Vec3(1, 2, 3)
+
+
+def mesh_gen():
+    """Return a ShapeGen whose shapes return the ArrayMesh, not a GeomNode."""
+    sg = shape.ShapeGen()
+    sg._export = lambda msh, **export_args: msh
+    return sg
+
+
+@pytest.mark.parametrize('polygon', (3, 8, 13, 32, 64, 128))
+@pytest.mark.parametrize('name', SPHERES)
+def test_sphere(name, polygon):
+    sg = shape.ShapeGen()
+    args = (ORIGIN, core.Vec3(0, 1, 0.3), 2, polygon)
+    assert_same_geom(
+        reference_sphere(sg, *args, nac=False, **SPHERES[name]),
+        sg.sphere(*args, nac=False, **SPHERES[name])
+    )
+
+
+@pytest.mark.parametrize('name', CONES)
+def test_cone(name):
+    build = mesh_gen()
+    radius, polygon, length, kwargs = CONES[name]
+    args = (ORIGIN, core.Vec3(1, 1, 0), radius, polygon, length)
+    assert_same_mesh(
+        reference_cone(build, *args, nac=False, **kwargs),
+        build.cone(*args, nac=False, **kwargs)
+    )
+
+
+def test_cone_top_offset():
+    # the base ring stays, the top ring moves
+    build = mesh_gen()
+    args = (ORIGIN, core.Vec3(1, 1, 0), 1, 16, 5)
+    plain = build.cone(*args, nac=False).points
+    offset = build.cone(*args, top_offset=(0.5, 0.2), nac=False).points
+    shift = np.sqrt(((offset - plain) ** 2).sum(axis=1))
+    assert np.allclose(shift[:17], 0, atol=1e-5)
+    assert np.allclose(shift[-17:], np.hypot(0.5, 0.2), atol=1e-5)
+
+
+@pytest.mark.parametrize('name', BLOBS)
+def test_blob(name):
+    build = mesh_gen()
+    bounds, kwargs = BLOBS[name]
+    kwargs = dict(
+        kwargs,
+        color=core.Vec4(0.2, 0.2, 0.2, 1),
+        nac=False,
+        seed=kwargs.get('seed', 1234)
+    )
+    args = (ORIGIN, core.Vec3(1, 1, 0), bounds)
+    assert_same_mesh(
+        reference_blob(build, *args, **kwargs),
+        build.blob(*args, **kwargs)
+    )
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_batched_fir_tree(monkeypatch, seed):
+    monkeypatch.setattr(modelgen, 'sg', shape.ShapeGen())
+    tex = core.Texture('bark')
+    random.seed(seed)
+    ref, _ = reference_fir_tree(tex=tex)
+    random.seed(seed)
+    new, _ = modelgen.fir_tree(tex=tex)
+    a, b = world_triangles(ref), world_triangles(new)
+    assert a.shape == b.shape
+    assert np.allclose(a, b, atol=1e-3)
+
+
+def test_batch_lod_node():
+    # one merged GeomNode per level
+    sg = shape.ShapeGen(lod_levels=3, optimize=True)
+    node = sg.batch([
+        shape.Primitive(
+            'cone',
+            transform=core.Mat4.translate_mat(i * 3, 0, 0),
+            origin=core.Vec3(0),
+            direction=core.Vec3.up(),
+            radius=(1, 0.5),
+            polygon=16,
+            length=5,
+            nac=False
+        ) for i in range(8)
+    ] + [shape.Primitive(
+        'sphere',
+        origin=core.Vec3(0, 5, 0),
+        direction=core.Vec3.up(),
+        radius=2,
+        polygon=24,
+        nac=False
+    )])
+    assert isinstance(node, core.LODNode)
+    assert node.get_num_children() == 3
+    for i in range(node.get_num_children()):
+        assert node.get_child(i).get_num_geoms() == 1
+
+
+@pytest.mark.parametrize('name', SHAPES)
+def test_packed_vertices(name):
+    a = geom_arrays(SHAPES[name](shape.ShapeGen()))
+    b = geom_arrays(SHAPES[name](shape.ShapeGen(packed=True)))
+    for k in ('normal', 'tangent', 'binormal'):
+        if k in b:
+            b[k] /= 32767
+    for k in a:
+        atol = 1 / 255 if k == 'color' else 1e-4
+        assert np.allclose(a[k], b[k], atol=atol), k
+
+
+def test_shared_on_threads():
+    sg = shape.ShapeGen(lod_levels=common.LOD_LEVELS, optimize=True,
+                        packed=common.PACKED_VERTICES)
+    expected = [geom_bytes(core.NodePath(job())) for job in shape_jobs(sg)]
+    with futures.ThreadPoolExecutor(4) as pool:
+        for _ in range(3):
+            results = pool.map(lambda job: job(), shape_jobs(sg))
+            assert [geom_bytes(core.NodePath(r)) for r in results] \
+                == expected
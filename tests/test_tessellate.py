@@ -0,0 +1,51 @@
+"""
+Tests of the tolerance based tessellation.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+import pytest
+from panda3d import core
+
+from game import common
+from game.shapegen import shape
+from game.shapegen import tessellate
+
+
+@pytest.mark.parametrize('tolerance', (0.005, 0.05, 0.5))
+@pytest.mark.parametrize('radius', (0.5, 1.2, 8.0, 60.0))
+def test_cone_chord_error(radius, tolerance):
+    build = shape.ShapeGen(tolerance=tolerance)
+    build._export = lambda msh, **export_args: msh
+    points = build.cone(core.Vec3(0), core.Vec3.up(), radius, None, radius,
+                        origin_offset=0.0).points
+    ring = points[np.abs(points[:, 2]) < 1e-5]
+    angles = np.unique(np.round(np.arctan2(ring[:, 1], ring[:, 0]), 6))
+    gaps = np.diff(np.append(angles, angles[0] + 2 * np.pi))
+    error = radius * (1 - np.cos(gaps.max() / 2))
+    if tessellate.chord_polygon(radius, tolerance) < common.TESS_MAX_POLYGON \
+            and radius > tolerance:
+        assert error <= tolerance * 1.0001
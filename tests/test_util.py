@@ -0,0 +1,88 @@
+"""
+Tests of the VertArray export and the triangle strip indices.
+"""
+
+__copyright__ = """
+MIT License
+
+Copyright (c) 2019 tcdude
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from math import pi
+
+import numpy as np
+import pytest
+
+from game.shapegen import mesh
+from game.shapegen import shape
+from game.shapegen import util
+from tests.reference import assert_same_geom
+from tests.reference import reference_populate_triangles
+from tests.reference import reference_triangle_line_connect
+
+
+def test_vert_array_bulk_matches_rows():
+    rng = np.random.default_rng(0)
+    n = 10000
+    cols = [rng.random((n, k), np.float32) for k in (3, 3, 4, 2)]
+    idx = rng.integers(0, n, (n * 2, 3))
+    rows = util.VertArray('rows', tangents=False)
+    for row in zip(*[map(tuple, c.tolist()) for c in cols]):
+        rows.add_row(*row)
+    for t in idx.tolist():
+        rows.add_triangle(*t)
+    bulk = util.VertArray('bulk', tangents=False)
+    bulk.add_arrays(*cols)
+    bulk.add_triangles(idx)
+    assert_same_geom(rows.node, bulk.node)
+
+
+@pytest.mark.parametrize('wrap', (False, True))
+@pytest.mark.parametrize('ccw', (False, True))
+def test_line_pair_indices(wrap, ccw):
+    for upper in range(1, 24):
+        for lower in range(1, 24):
+            ref = np.array([
+                list(up) + [upper + i for i in lo]
+                for up, lo in reference_triangle_line_connect(
+                    upper, lower, wrap, ccw
+                )
+            ], np.int64).reshape(-1, 3)
+            new = util.line_pair_indices(upper, lower, wrap, ccw)
+            assert np.array_equal(ref, new), (upper, lower)
+
+
+def test_degenerate_triangles_culled():
+    # sphere like surface, the pole rings collapse into single points
+    rings, polygon = 32, 64
+    p = np.linspace(-pi / 2, pi / 2, rings)[:, None]
+    h = np.linspace(0, 2 * pi, polygon, endpoint=False)[None, :]
+    pts = np.stack(np.broadcast_arrays(
+        np.cos(p) * np.cos(h), np.cos(p) * np.sin(h), np.sin(p)
+    ), axis=-1).reshape(-1, 3)
+    msh = mesh.ArrayMesh()
+    vids = msh.add_vertices(pts)
+    lines = [line.tolist() for line in vids.reshape(rings, polygon)]
+    old, new = msh.copy(), msh.copy()
+    reference_populate_triangles(old, lines, True, chk_illegal=True)
+    shape.ShapeGen._populate_triangles(new, lines, True, chk_illegal=True)
+    assert np.array_equal(old.triangles, new.triangles)
+    assert len(new.triangles) < rings * polygon * 2